@@ -0,0 +1,404 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+#
+# Benchmarks of the exporter on synthetic rigs.
+#
+# Usage:
+#
+#   blender -b --factory-startup --python benchmark.py -- [--cases FILE]
+#     [--repeat N] [--output FILE] [--baseline FILE] [--threshold T]
+#     [--package DIR]
+#
+# Each case procedurally builds an armature and its actions and meshes in
+# an empty scene, and exports it N times. A case is a JSON object:
+#
+#   {
+#     "name"          : "large-rig",
+#     "bones"         : 300,     the number of bones
+#     "depth"         : 10,      the length of each chain of bones below the root
+#     "actions"       : 2,       the number of actions
+#     "keys"          : 30,      the number of keyframes of each curve
+#     "vertices"      : 0,       the number of vertices of the child mesh
+#     "groups"        : 0,       the number of vertex groups of the child mesh
+#     "options"       : { ... }  exporter options, overriding the defaults
+#   }
+#
+# The cases are read from the given JSON file (a list of cases), or the
+# built-in cases are used. The results are written to the output file: for
+# each case, the median total time of the exports and the median time of
+# each phase, taken from the profile reports of the exports.
+#
+# If a baseline is given, which is a results file of an earlier run, the
+# total time and the time of each phase of each case are compared against
+# it, and the exit code is non-zero if any of them is slower than the
+# baseline by more than the threshold (0.25 is 25%). Phases that took less
+# than a few milliseconds in the baseline are too noisy to compare.
+#
+
+import argparse
+import importlib
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+
+import bpy
+
+BENCHMARK_VERSION = 1
+
+BENCHMARK_CASES = [
+  { "name" : "small",        "bones" : 10,  "depth" : 3,  "actions" : 5,   "keys" : 30,   "vertices" : 1000,   "groups" : 10, "options" : {} },
+  { "name" : "large-rig",    "bones" : 300, "depth" : 10, "actions" : 2,   "keys" : 30,   "vertices" : 0,      "groups" : 0,  "options" : {} },
+  { "name" : "many-actions", "bones" : 30,  "depth" : 4,  "actions" : 100, "keys" : 30,   "vertices" : 0,      "groups" : 0,  "options" : {} },
+  { "name" : "dense-keys",   "bones" : 30,  "depth" : 4,  "actions" : 5,   "keys" : 1000, "vertices" : 0,      "groups" : 0,  "options" : {} },
+  { "name" : "dense-mesh",   "bones" : 50,  "depth" : 5,  "actions" : 1,   "keys" : 10,   "vertices" : 200000, "groups" : 50, "options" : {} },
+  { "name" : "binary",       "bones" : 100, "depth" : 5,  "actions" : 20,  "keys" : 100,  "vertices" : 50000,  "groups" : 50, "options" : { "format" : "binary" } }
+]
+
+#
+# Phases that took less than this many seconds in the baseline are not
+# compared.
+#
+
+BENCHMARK_MINIMUM_PHASE_SECONDS = 0.005
+
+#
+# The arguments after "--" on the Blender command line.
+#
+
+def scriptArguments(argv):
+  if "--" in argv:
+    return argv[argv.index("--") + 1:]
+  #endif
+  return []
+#end
+
+def importExporter(package_dir):
+  package_dir = os.path.abspath(package_dir)
+  package_parent = os.path.dirname(package_dir)
+  if not (package_parent in sys.path):
+    sys.path.insert(0, package_parent)
+  #endif
+  return importlib.import_module(os.path.basename(package_dir) + ".export")
+#end
+
+def clearScene():
+  scene = bpy.context.scene
+  for obj in list(scene.objects):
+    scene.objects.unlink(obj)
+    bpy.data.objects.remove(obj)
+  #endfor
+  for action in list(bpy.data.actions):
+    bpy.data.actions.remove(action)
+  #endfor
+  for armature in list(bpy.data.armatures):
+    bpy.data.armatures.remove(armature)
+  #endfor
+  for mesh in list(bpy.data.meshes):
+    bpy.data.meshes.remove(mesh)
+  #endfor
+#end
+
+#
+# Build an armature with the given number of bones. Bone 0 is the root,
+# and the other bones form chains of the given depth below it.
+#
+
+def buildArmature(bone_count, depth):
+  scene    = bpy.context.scene
+  data     = bpy.data.armatures.new("BenchmarkArmature")
+  armature = bpy.data.objects.new("BenchmarkArmature", data)
+  scene.objects.link(armature)
+  scene.objects.active = armature
+
+  bpy.ops.object.mode_set(mode='EDIT')
+  bones = []
+  for bone_index in range(0, bone_count):
+    bone = data.edit_bones.new("bone%d" % bone_index)
+    if bone_index == 0:
+      bone.head = (0.0, 0.0, 0.0)
+      bone.tail = (0.0, 0.0, 1.0)
+    else:
+      if (bone_index - 1) % depth == 0:
+        parent = bones[0]
+      else:
+        parent = bones[bone_index - 1]
+      #endif
+      bone.parent = parent
+      bone.head   = parent.tail
+      bone.tail   = (parent.tail[0] + 0.1 * (bone_index % 7), parent.tail[1] + 0.1, parent.tail[2] + 0.5)
+    #endif
+    bones.append(bone)
+  #endfor
+  bpy.ops.object.mode_set(mode='OBJECT')
+
+  for pose_bone in armature.pose.bones:
+    pose_bone.rotation_mode = 'QUATERNION'
+  #endfor
+  return armature
+#end
+
+def addCurve(action, bone_name, curve_property, channel, frames, values):
+  fcurve = action.fcurves.new('pose.bones["%s"].%s' % (bone_name, curve_property), channel, bone_name)
+  points = fcurve.keyframe_points
+  points.add(len(frames))
+
+  coordinates = []
+  for frame, value in zip(frames, values):
+    coordinates.append(frame)
+    coordinates.append(value)
+  #endfor
+  points.foreach_set("co", coordinates)
+
+  for point in points:
+    point.interpolation = 'LINEAR'
+    point.easing        = 'EASE_IN_OUT'
+  #endfor
+  fcurve.update()
+#end
+
+#
+# Build an action that animates the location, scale and orientation of
+# every bone with the given number of keyframes.
+#
+
+def buildAction(armature, action_index, key_count, generator):
+  action = bpy.data.actions.new("action%d" % action_index)
+  frames = list(range(1, key_count + 1))
+
+  for pose_bone in armature.pose.bones:
+    for channel in range(0, 3):
+      addCurve(action, pose_bone.name, "location", channel, frames,
+        [generator.uniform(-1.0, 1.0) for frame in frames])
+      addCurve(action, pose_bone.name, "scale", channel, frames,
+        [generator.uniform(0.5, 1.5) for frame in frames])
+    #endfor
+
+    quaternions = []
+    for frame in frames:
+      q = [generator.gauss(0.0, 1.0) for component in range(0, 4)]
+      length = math.sqrt(sum(c * c for c in q))
+      quaternions.append([c / length for c in q])
+    #endfor
+    for channel in range(0, 4):
+      addCurve(action, pose_bone.name, "rotation_quaternion", channel, frames,
+        [q[channel] for q in quaternions])
+    #endfor
+  #endfor
+  return action
+#end
+
+#
+# Build a mesh with the given number of vertices as a child of the
+# armature. Each vertex belongs to up to four of the vertex groups, which
+# are named after the bones of the armature.
+#
+
+def buildMesh(armature, vertex_count, group_count):
+  scene = bpy.context.scene
+  side  = max(1, int(math.sqrt(vertex_count)))
+
+  vertices = []
+  for vertex_index in range(0, vertex_count):
+    vertices.append((float(vertex_index % side), float(vertex_index // side), 0.0))
+  #endfor
+
+  data = bpy.data.meshes.new("BenchmarkMesh")
+  data.from_pydata(vertices, [], [])
+  data.update()
+
+  mesh = bpy.data.objects.new("BenchmarkMesh", data)
+  scene.objects.link(mesh)
+  mesh.parent = armature
+
+  bone_count   = len(armature.pose.bones)
+  memberships  = min(4, group_count)
+  weights      = [0.4, 0.3, 0.2, 0.1]
+  groups       = []
+  for group_index in range(0, group_count):
+    groups.append(mesh.vertex_groups.new("bone%d" % (group_index % bone_count)))
+  #endfor
+
+  for membership in range(0, memberships):
+    indices = [[] for group in groups]
+    for vertex_index in range(0, vertex_count):
+      indices[(vertex_index + membership) % group_count].append(vertex_index)
+    #endfor
+    for group, group_indices in zip(groups, indices):
+      if len(group_indices) > 0:
+        group.add(group_indices, weights[membership], 'REPLACE')
+      #endif
+    #endfor
+  #endfor
+  return mesh
+#end
+
+def buildCase(case):
+  clearScene()
+  generator = random.Random(case["name"])
+  armature  = buildArmature(case["bones"], case["depth"])
+  for action_index in range(0, case["actions"]):
+    buildAction(armature, action_index, case["keys"], generator)
+  #endfor
+  if case["vertices"] > 0 and case["groups"] > 0:
+    buildMesh(armature, case["vertices"], case["groups"])
+  #endif
+  return armature
+#end
+
+#
+# Export the given case the given number of times, and return the median
+# total time, the median time of each phase, and the size of the output.
+#
+
+def runCase(export, case, repeat, directory):
+  print("benchmark: %s: building" % case["name"])
+  armature = buildCase(case)
+
+  options = export.defaultOptions()
+  options.update(case.get("options", {}))
+
+  suffix = ".ca"
+  if options["format"] == "binary":
+    suffix = ".cab"
+  #endif
+  path = os.path.join(directory, case["name"] + suffix)
+
+  totals = []
+  phases = {}
+  for run in range(0, repeat):
+    export.CalciumExporter(options).writeArmature(path, armature)
+    with open(path + ".profile.json", "rt") as profile_file:
+      profile = json.load(profile_file)
+    #endwith
+
+    totals.append(profile["seconds"])
+    for name, phase in profile["phases"].items():
+      phases.setdefault(name, []).append(phase["seconds"])
+    #endfor
+    print("benchmark: %s: run %d: %.3fs" % (case["name"], run, profile["seconds"]))
+  #endfor
+
+  medians = {}
+  for name, seconds in phases.items():
+    medians[name] = statistics.median(seconds)
+  #endfor
+
+  return {
+    "parameters" : case,
+    "seconds"    : statistics.median(totals),
+    "runs"       : totals,
+    "phases"     : medians,
+    "size"       : os.path.getsize(path)
+  }
+#end
+
+#
+# Compare the results against the baseline, and return a list of
+# regressions.
+#
+
+def compareResults(results, baseline, threshold):
+  regressions = []
+  for name, result in results["cases"].items():
+    base = baseline["cases"].get(name, None)
+    if base == None:
+      continue
+    #endif
+
+    measured = [("total", result["seconds"], base["seconds"])]
+    for phase, seconds in sorted(result["phases"].items()):
+      base_seconds = base["phases"].get(phase, None)
+      if base_seconds != None and base_seconds >= BENCHMARK_MINIMUM_PHASE_SECONDS:
+        measured.append((phase, seconds, base_seconds))
+      #endif
+    #endfor
+
+    for what, seconds, base_seconds in measured:
+      if seconds > base_seconds * (1.0 + threshold):
+        regressions.append("%s: %s took %.3fs, baseline %.3fs (+%.0f%%)" %
+          (name, what, seconds, base_seconds, 100.0 * (seconds / base_seconds - 1.0)))
+      #endif
+    #endfor
+  #endfor
+  return regressions
+#end
+
+def main(argv):
+  default_package = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+  parser = argparse.ArgumentParser(prog="benchmark.py", description="Benchmark the Calcium exporter on synthetic rigs.")
+  parser.add_argument("--cases", default=None, help="A JSON file holding a list of cases (default: the built-in cases)")
+  parser.add_argument("--repeat", type=int, default=3, help="The number of exports of each case")
+  parser.add_argument("--output", default="benchmark-results.json", help="The file to which the results are written")
+  parser.add_argument("--baseline", default=None, help="The results of an earlier run to compare against")
+  parser.add_argument("--threshold", type=float, default=0.25, help="The allowed slowdown relative to the baseline")
+  parser.add_argument("--package", default=default_package, help="The directory of the exporter package")
+  arguments = parser.parse_args(argv)
+
+  export = importExporter(arguments.package)
+
+  cases = BENCHMARK_CASES
+  if arguments.cases != None:
+    with open(arguments.cases, "rt") as cases_file:
+      cases = json.load(cases_file)
+    #endwith
+  #endif
+
+  results = {
+    "version"  : BENCHMARK_VERSION,
+    "blender"  : bpy.app.version_string,
+    "platform" : platform.platform(),
+    "repeat"   : arguments.repeat,
+    "cases"    : {}
+  }
+
+  with tempfile.TemporaryDirectory(prefix="calcium-benchmark-") as directory:
+    for case in cases:
+      results["cases"][case["name"]] = runCase(export, case, arguments.repeat, directory)
+    #endfor
+  #endwith
+  clearScene()
+
+  with open(arguments.output, "wt") as output_file:
+    json.dump(results, output_file, indent=2, sort_keys=True)
+  #endwith
+  print("benchmark: results in %s" % arguments.output)
+
+  if arguments.baseline == None:
+    return 0
+  #endif
+
+  with open(arguments.baseline, "rt") as baseline_file:
+    baseline = json.load(baseline_file)
+  #endwith
+
+  regressions = compareResults(results, baseline, arguments.threshold)
+  for regression in regressions:
+    print("benchmark: regression: %s" % regression)
+  #endfor
+  print("benchmark: %d regressions against %s" % (len(regressions), arguments.baseline))
+  return 0 if len(regressions) == 0 else 1
+#end
+
+if __name__ == "__main__":
+  sys.exit(main(scriptArguments(sys.argv)))
+#endif
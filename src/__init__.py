@@ -19,7 +19,7 @@ bl_info = {
   "author":      "io7m",
   "version":     (0, 0, 2),
   "blender":     (2, 66, 0),
-  "location":    "File > Export > Calcium (.ca)",
+  "location":    "File > Export > Calcium (.ca/.cab)",
   "description": "Export armatures and actions.",
   "warning":     "",
   "wiki_url":    "",
@@ -28,6 +28,7 @@ bl_info = {
 }
 
 import bpy
+import time
 
 class ExportCalcium(bpy.types.Operator):
   bl_idname = "export_scene.ca"
@@ -36,9 +37,94 @@ class ExportCalcium(bpy.types.Operator):
   filepath                  = bpy.props.StringProperty(subtype='FILE_PATH')
   verbose                   = bpy.props.BoolProperty(name="Verbose logging",description="Enable verbose debug logging",default=True)
   export_child_mesh_weights = bpy.props.BoolProperty(name="Export child meshes",description="Export the vertex weights of the child meshes of the armature",default=True)
+  format                    = bpy.props.EnumProperty(name="Format",description="The format of the exported file",default='TEXT',items=[
+    ('TEXT',   "Text (.ca)",    "Export the text format"),
+    ('BINARY', "Binary (.cab)", "Export the memory-mappable binary format")
+  ])
+  weight_layout             = bpy.props.EnumProperty(name="Weight layout",description="The layout of exported mesh weights",default='ARRAYS',items=[
+    ('ARRAYS',     "Weight arrays", "Export one array of weights per vertex group"),
+    ('INFLUENCES', "Influences",    "Export the largest bone influences of each vertex, renormalized")
+  ])
+  influence_count           = bpy.props.IntProperty(name="Influences per vertex",description="The number of bone influences exported for each vertex",default=4,min=1,max=16)
+  float_precision           = bpy.props.IntProperty(name="Float precision",description="The number of decimal places written for floating point values in the text format",default=6,min=1,max=17)
+  worker_count              = bpy.props.IntProperty(name="Worker processes",description="The number of processes used to format the text format on Linux (0 uses one per processor, 1 formats on the main thread)",default=1,min=0)
+  use_cache                 = bpy.props.BoolProperty(name="Incremental export",description="Reuse the exported form of unchanged actions from a cache file next to the output",default=False)
+  direct_evaluation         = bpy.props.BoolProperty(name="Evaluate F-curves directly",description="Calculate bones that are not driven or constrained from their F-curves instead of evaluating the scene",default=True)
+  reduce_keyframes          = bpy.props.BoolProperty(name="Reduce keyframes",description="Remove keyframes that the remaining keyframes reproduce within the given errors",default=False)
+  reduction_translation     = bpy.props.FloatProperty(name="Translation error",description="The largest allowed translation error of a removed keyframe",default=0.0001,min=0.0,precision=5)
+  reduction_scale           = bpy.props.FloatProperty(name="Scale error",description="The largest allowed scale error of a removed keyframe",default=0.0001,min=0.0,precision=5)
+  reduction_angle           = bpy.props.FloatProperty(name="Angular error",description="The largest allowed orientation error of a removed keyframe",default=0.0001,min=0.0,precision=5,subtype='ANGLE')
+  curve_encoding            = bpy.props.EnumProperty(name="Curve values",description="The encoding of curve values in the binary format",default='FLOAT',items=[
+    ('FLOAT',     "Float",     "Store every curve value as floats"),
+    ('QUANTIZED', "Quantized", "Store constant curves once, orientations in 48 bits, and translations and scales as 16-bit values")
+  ])
+  compression               = bpy.props.EnumProperty(name="Compression",description="Compress the exported file as it is written",default='NONE',items=[
+    ('NONE', "None",      "Do not compress the exported file"),
+    ('GZIP', "gzip (.gz)", "Compress the exported file with gzip"),
+    ('XZ',   "xz (.xz)",   "Compress the exported file with xz")
+  ])
+  compression_level         = bpy.props.IntProperty(name="Compression level",description="The gzip compression level, or the xz preset",default=6,min=0,max=9)
+  multiple_armatures        = bpy.props.EnumProperty(name="Multiple armatures",description="How several selected armatures are exported",default='SEPARATE',items=[
+    ('SEPARATE', "Separate files", "Write each armature to a file named after the armature"),
+    ('COMBINED', "Combined file",  "Write all of the armatures, one after the other, to a single file")
+  ])
+  action_source             = bpy.props.EnumProperty(name="Actions",description="The actions considered for export",default='ALL',items=[
+    ('ALL', "All actions", "Consider every action in the file"),
+    ('NLA', "NLA tracks",  "Only consider the actions used by the NLA strips of the armature")
+  ])
+  action_filter             = bpy.props.StringProperty(name="Action filter",description="Only export actions whose names match this pattern (* and ? are wildcards)",default="*")
+  bone_references           = bpy.props.EnumProperty(name="Bone references",description="How curves and weights refer to bones",default='NAMES',items=[
+    ('NAMES',   "Names",   "Refer to bones by name, in the order of the armature"),
+    ('INDICES', "Indices", "Sort bones so that parents come before their children, and refer to bones by index")
+  ])
+  sampling                  = bpy.props.EnumProperty(name="Sampling",description="How actions are sampled",default='KEYFRAMES',items=[
+    ('KEYFRAMES', "Keyframes", "Export the keyframes of the curves of each action"),
+    ('BAKED',     "Baked",     "Sample every bone at a fixed rate and export dense tracks")
+  ])
+  bake_rate                 = bpy.props.FloatProperty(name="Bake rate",description="Samples per second of baked actions (0 uses the frame rate of the scene)",default=0.0,min=0.0)
+  collapse_constant_curves  = bpy.props.BoolProperty(name="Collapse constant curves",description="Export curves whose keyframes all have the same value as a single keyframe",default=False)
+  omit_rest_pose_curves     = bpy.props.BoolProperty(name="Omit rest pose curves",description="Do not export curves that hold the rest pose of their bone at every keyframe",default=False)
+  share_curves              = bpy.props.BoolProperty(name="Share identical curves",description="Store the keyframes of identical curves once, and refer to them from every action that uses them (not used for baked actions)",default=False)
+  write_index               = bpy.props.BoolProperty(name="Write table of contents",description="Write the offset, length and counts of every element of the file to a JSON file alongside it",default=False)
+  async_write               = bpy.props.BoolProperty(name="Write in the background",description="Write and compress text output on a background thread while the scene is evaluated (binary output is always written once complete)",default=False)
+  trace_memory              = bpy.props.BoolProperty(name="Trace memory",description="Record the peak memory used by the export in the profile report (slow)",default=False)
+  influence_quantization    = bpy.props.EnumProperty(name="Influence weights",description="The storage of exported influence weights",default='NONE',items=[
+    ('NONE',   "Float",  "Export weights as floating point values"),
+    ('UINT8',  "UInt8",  "Export weights quantized to 8-bit unsigned integers"),
+    ('UINT16', "UInt16", "Export weights quantized to 16-bit unsigned integers")
+  ])
+  interactive               = bpy.props.BoolProperty(name="Interactive",description="Export in steps while Blender stays responsive, showing progress and allowing Esc to cancel the export",default=False,options={'HIDDEN', 'SKIP_SAVE'})
+
+  #
+  # An export started from the file browser is interactive: it runs as a
+  # modal operator that takes steps of the export (a mesh or an action at a
+  # time) on a timer, for at most the slice time per timer event, so that
+  # Blender stays responsive and shows the progress of the export. Esc
+  # cancels the export and removes its partial output. Exports started from
+  # scripts run to completion in execute.
+  #
+
+  __timer_interval = 0.01
+  __slice_seconds  = 0.1
+
+  __suffixes = {
+    'TEXT'   : ".ca",
+    'BINARY' : ".cab"
+  }
+
+  __compression_suffixes = {
+    'NONE' : "",
+    'GZIP' : ".gz",
+    'XZ'   : ".xz"
+  }
 
   def execute(self, context):
-    self.filepath = bpy.path.ensure_ext(self.filepath, ".ca")
+    filepath = self.filepath
+    compression_suffix = self.__compression_suffixes[self.compression]
+    if compression_suffix != "" and filepath.lower().endswith(compression_suffix):
+      filepath = filepath[:-len(compression_suffix)]
+    #endif
+    self.filepath = bpy.path.ensure_ext(filepath, self.__suffixes[self.format]) + compression_suffix
 
     args = {}
     args['verbose'] = self.verbose
@@ -47,15 +133,109 @@ class ExportCalcium(bpy.types.Operator):
     args['export_child_mesh_weights'] = self.export_child_mesh_weights
     assert type(args['export_child_mesh_weights']) == bool
 
+    args['format'] = self.format.lower()
+    assert type(args['format']) == str
+
+    args['weight_layout'] = self.weight_layout.lower()
+    assert type(args['weight_layout']) == str
+
+    args['influence_count'] = self.influence_count
+    assert type(args['influence_count']) == int
+
+    args['influence_quantization'] = self.influence_quantization.lower()
+    assert type(args['influence_quantization']) == str
+
+    args['float_precision'] = self.float_precision
+    assert type(args['float_precision']) == int
+
+    args['worker_count'] = self.worker_count
+    assert type(args['worker_count']) == int
+
+    args['use_cache'] = self.use_cache
+    assert type(args['use_cache']) == bool
+
+    args['direct_evaluation'] = self.direct_evaluation
+    assert type(args['direct_evaluation']) == bool
+
+    args['reduce_keyframes'] = self.reduce_keyframes
+    assert type(args['reduce_keyframes']) == bool
+
+    args['reduction_translation'] = self.reduction_translation
+    assert type(args['reduction_translation']) == float
+
+    args['reduction_scale'] = self.reduction_scale
+    assert type(args['reduction_scale']) == float
+
+    args['reduction_angle'] = self.reduction_angle
+    assert type(args['reduction_angle']) == float
+
+    args['curve_encoding'] = self.curve_encoding.lower()
+    assert type(args['curve_encoding']) == str
+
+    args['trace_memory'] = self.trace_memory
+    assert type(args['trace_memory']) == bool
+
+    args['compression'] = self.compression.lower()
+    assert type(args['compression']) == str
+
+    args['compression_level'] = self.compression_level
+    assert type(args['compression_level']) == int
+
+    args['multiple_armatures'] = self.multiple_armatures.lower()
+    assert type(args['multiple_armatures']) == str
+
+    args['action_source'] = self.action_source.lower()
+    assert type(args['action_source']) == str
+
+    args['action_filter'] = self.action_filter
+    assert type(args['action_filter']) == str
+
+    args['bone_references'] = self.bone_references.lower()
+    assert type(args['bone_references']) == str
+
+    args['sampling'] = self.sampling.lower()
+    assert type(args['sampling']) == str
+
+    args['bake_rate'] = self.bake_rate
+    assert type(args['bake_rate']) == float
+
+    args['collapse_constant_curves'] = self.collapse_constant_curves
+    assert type(args['collapse_constant_curves']) == bool
+
+    args['omit_rest_pose_curves'] = self.omit_rest_pose_curves
+    assert type(args['omit_rest_pose_curves']) == bool
+
+    args['share_curves'] = self.share_curves
+    assert type(args['share_curves']) == bool
+
+    args['write_index'] = self.write_index
+    assert type(args['write_index']) == bool
+
+    args['async_write'] = self.async_write
+    assert type(args['async_write']) == bool
+
     from . import export
     e = export.CalciumExporter(args)
 
+    if self.interactive:
+      try:
+        self.__steps = e.writeInSteps(self.filepath)
+      except export.CalciumNoArmatureSelected as ex:
+        self.report({'ERROR'}, ex.value)
+        return {'FINISHED'}
+      #endtry
+
+      window_manager = context.window_manager
+      self.__timer = window_manager.event_timer_add(self.__timer_interval, context.window)
+      window_manager.progress_begin(0.0, 1.0)
+      window_manager.modal_handler_add(self)
+      return {'RUNNING_MODAL'}
+    #endif
+
     try:
       e.write(self.filepath)
     except export.CalciumNoArmatureSelected as ex:
       self.report({'ERROR'}, ex.value)
-    except export.CalciumTooManyArmaturesSelected as ex:
-      self.report({'ERROR'}, ex.value)
     except export.CalciumExportFailed as ex:
       self.report({'ERROR'}, ex.value)
     #endtry
@@ -63,25 +243,107 @@ class ExportCalcium(bpy.types.Operator):
     return {'FINISHED'}
   #end
 
+  def __finishModal(self, context):
+    window_manager = context.window_manager
+    window_manager.event_timer_remove(self.__timer)
+    window_manager.progress_end()
+  #end
+
+  def modal(self, context, event):
+    from . import export
+
+    if event.type == 'ESC':
+      self.__steps.close()
+      self.__finishModal(context)
+      self.report({'WARNING'}, "Export cancelled")
+      return {'CANCELLED'}
+    #endif
+
+    if event.type != 'TIMER':
+      return {'PASS_THROUGH'}
+    #endif
+
+    time_start = time.perf_counter()
+    try:
+      while True:
+        completed, total = next(self.__steps)
+        context.window_manager.progress_update(completed / total)
+        if time.perf_counter() - time_start >= self.__slice_seconds:
+          break
+        #endif
+      #endwhile
+    except StopIteration:
+      self.__finishModal(context)
+      return {'FINISHED'}
+    except export.CalciumExportFailed as ex:
+      self.__finishModal(context)
+      self.report({'ERROR'}, ex.value)
+      return {'FINISHED'}
+    except Exception:
+      self.__finishModal(context)
+      raise
+    #endtry
+
+    return {'RUNNING_MODAL'}
+  #end
+
   def invoke(self, context, event):
     if not self.filepath:
-      self.filepath = bpy.path.ensure_ext(bpy.data.filepath, ".ca")
+      self.filepath = bpy.path.ensure_ext(bpy.data.filepath, self.__suffixes[self.format])
+    self.interactive = True
     context.window_manager.fileselect_add(self)
     return {'RUNNING_MODAL'}
   #end
 #endclass
 
+#
+# Check that the actions of the selected armatures can be exported, without
+# evaluating the scene or writing any files.
+#
+
+class ValidateCalcium(bpy.types.Operator):
+  bl_idname = "export_scene.ca_validate"
+  bl_label = "Validate Calcium"
+
+  def execute(self, context):
+    from . import export
+    args = export.defaultOptions()
+    e = export.CalciumExporter(args)
+
+    try:
+      errors = e.validate()
+    except export.CalciumNoArmatureSelected as ex:
+      self.report({'ERROR'}, ex.value)
+      return {'CANCELLED'}
+    #endtry
+
+    if len(errors) > 0:
+      for error in errors:
+        print("calcium: %s" % error)
+      #endfor
+      self.report({'ERROR'}, "Validation failed with %d errors. The first error is:\n%s" % (len(errors), errors[0]))
+    else:
+      self.report({'INFO'}, "All actions are valid")
+    #endif
+
+    return {'FINISHED'}
+  #end
+#endclass
+
 def menuFunction(self, context):
   self.layout.operator(ExportCalcium.bl_idname, text="Calcium (.ca)")
+  self.layout.operator(ValidateCalcium.bl_idname, text="Calcium (validate only)")
 #end
 
 def register():
   bpy.utils.register_class(ExportCalcium)
+  bpy.utils.register_class(ValidateCalcium)
   bpy.types.INFO_MT_file_export.append(menuFunction)
 #end
 
 def unregister():
   bpy.utils.unregister_class(ExportCalcium)
+  bpy.utils.unregister_class(ValidateCalcium)
   bpy.types.INFO_MT_file_export.remove(menuFunction)
 #end
 
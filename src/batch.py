@@ -0,0 +1,443 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+#
+# Headless batch export of many .blend files.
+#
+# Usage:
+#
+#   blender -b --python batch.py -- [--jobs N] [--summary FILE] [--validate]
+#     [--compression none|gzip|xz] [--compression-level L] MANIFEST
+#
+# The manifest is a JSON file:
+#
+#   {
+#     "options": { "format": "binary", ... },
+#     "assets": [
+#       { "blend": "rigs/a.blend", "armature": "Armature", "output": "out/a.cab" },
+#       ...
+#     ]
+#   }
+#
+# The options are exporter options, and override the defaults of
+# export.defaultOptions(). An asset may also have its own "options".
+# The "armature" of an asset may also be a list of armature names, in
+# which case the armatures are exported together, as given by the
+# "multiple_armatures" option.
+# Relative paths are resolved against the directory of the manifest.
+# The --compression and --compression-level arguments override the
+# compression options of every asset.
+#
+# Each asset is exported by a separate headless Blender process, and up to
+# N processes run at once. A JSON summary with the outcome and timing of
+# each asset is written at the end, and the exit code is non-zero if any
+# asset failed. The summary entry of each exported asset names the
+# profile report written next to its output.
+#
+# With --validate, the actions of each asset are only validated: nothing
+# is evaluated or written, and assets do not need an "output". This is
+# fast enough to be used as a pre-commit check.
+#
+# This script runs itself inside each of those processes with the
+# --export-one or --validate-one arguments; those modes are not intended
+# to be used directly.
+#
+
+import argparse
+import concurrent.futures
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+#
+# The arguments after "--" on the Blender command line, or all arguments
+# if the script is run by a plain Python interpreter.
+#
+
+def scriptArguments(argv):
+  if "--" in argv:
+    return argv[argv.index("--") + 1:]
+  #endif
+  return argv[1:]
+#end
+
+#
+# Import the add-on package that contains this script. The package
+# directory may have any name, so it is imported by the name of the
+# directory.
+#
+
+def importPackage():
+  package_dir = os.path.dirname(os.path.abspath(__file__))
+  package_parent = os.path.dirname(package_dir)
+  if not (package_parent in sys.path):
+    sys.path.insert(0, package_parent)
+  #endif
+  return importlib.import_module(os.path.basename(package_dir))
+#end
+
+def loadManifest(manifest_path, overrides):
+  with open(manifest_path, "rt") as manifest_file:
+    manifest = json.load(manifest_file)
+  #endwith
+
+  base = os.path.dirname(os.path.abspath(manifest_path))
+  options = manifest.get("options", {})
+  assets = []
+  for asset in manifest["assets"]:
+    asset_options = dict(options)
+    asset_options.update(asset.get("options", {}))
+    asset_options.update(overrides)
+
+    blend = asset.get("blend", None)
+    if blend != None:
+      blend = os.path.join(base, blend)
+    #endif
+
+    output = asset.get("output", None)
+    if output != None:
+      output = os.path.join(base, output)
+    #endif
+
+    assets.append({
+      "blend"    : blend,
+      "armature" : asset.get("armature", []),
+      "output"   : output,
+      "options"  : asset_options
+    })
+  #endfor
+  return assets
+#end
+
+#
+# The names of the armatures of an asset.
+#
+
+def assetArmatures(asset):
+  if type(asset["armature"]) == list:
+    return asset["armature"]
+  #endif
+  return [asset["armature"]]
+#end
+
+#
+# The entry for the summary of an asset that has not yet been exported.
+#
+
+def assetSummary(asset):
+  return {
+    "blend"    : asset["blend"],
+    "armature" : asset["armature"],
+    "output"   : asset["output"],
+    "status"   : "failed",
+    "error"    : None,
+    "seconds"  : 0.0
+  }
+#end
+
+#
+# Export or validate a single asset in a child Blender process, and return
+# the entry for the summary. An asset that cannot be exported as given in
+# the manifest fails without starting Blender.
+#
+
+def runAsset(blender, asset, timeout, validate_only):
+  summary = assetSummary(asset)
+  if asset["blend"] == None:
+    summary["error"] = "Asset has no blend file"
+    return summary
+  #endif
+  if len(assetArmatures(asset)) == 0:
+    summary["error"] = "Asset %s has no armature" % asset["blend"]
+    return summary
+  #endif
+  if not validate_only and asset["output"] == None:
+    summary["error"] = "Asset %s:%s has no output" % (asset["blend"], ",".join(assetArmatures(asset)))
+    return summary
+  #endif
+
+  result_fd, result_path = tempfile.mkstemp(prefix="calcium-", suffix=".json")
+  os.close(result_fd)
+
+  command = [
+    blender,
+    "-b",
+    asset["blend"],
+    "--python",
+    os.path.abspath(__file__),
+    "--",
+    "--options", json.dumps(asset["options"]),
+    "--result", result_path
+  ]
+
+  for armature_name in assetArmatures(asset):
+    command.extend(["--armature", armature_name])
+  #endfor
+
+  if validate_only:
+    command.append("--validate-one")
+  else:
+    command.extend(["--export-one", "--output", asset["output"]])
+  #endif
+
+  time_start = time.perf_counter()
+  try:
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+    summary["seconds"] = time.perf_counter() - time_start
+
+    result = None
+    if os.path.getsize(result_path) > 0:
+      with open(result_path, "rt") as result_file:
+        result = json.load(result_file)
+      #endwith
+    #endif
+
+    if result == None:
+      output = process.stdout.decode("utf-8", "replace")
+      summary["error"] = "Blender exited with code %d without exporting.\n%s" % (process.returncode, output[-4096:])
+    else:
+      summary.update(result)
+    #endif
+  except subprocess.TimeoutExpired:
+    summary["seconds"] = time.perf_counter() - time_start
+    summary["error"] = "Timed out after %d seconds" % timeout
+  finally:
+    os.remove(result_path)
+  #endtry
+
+  return summary
+#end
+
+def runManifest(arguments):
+  blender = arguments.blender
+  if blender == None:
+    import bpy
+    blender = bpy.app.binary_path
+  #endif
+
+  overrides = {}
+  if arguments.compression != None:
+    overrides["compression"] = arguments.compression
+  #endif
+  if arguments.compression_level != None:
+    overrides["compression_level"] = arguments.compression_level
+  #endif
+
+  assets = loadManifest(arguments.manifest, overrides)
+  jobs   = arguments.jobs or os.cpu_count() or 1
+  if arguments.validate:
+    print("calcium-batch: validating %d assets with %d processes" % (len(assets), jobs))
+  else:
+    print("calcium-batch: exporting %d assets with %d processes" % (len(assets), jobs))
+  #endif
+
+  time_start = time.perf_counter()
+  with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+    futures = []
+    for asset in assets:
+      futures.append(executor.submit(runAsset, blender, asset, arguments.timeout, arguments.validate))
+    #endfor
+
+    #
+    # An asset that could not be run at all, for example because Blender
+    # could not be started, fails on its own without aborting the batch.
+    #
+
+    results = []
+    for asset, future in zip(assets, futures):
+      try:
+        result = future.result()
+      except Exception:
+        result = assetSummary(asset)
+        result["error"] = traceback.format_exc()
+      #endtry
+      print("calcium-batch: %s %s:%s (%.3fs)" % (result["status"], result["blend"], ",".join(assetArmatures(result)), result["seconds"]))
+      for error in result.get("errors", []):
+        print(error)
+      #endfor
+      results.append(result)
+    #endfor
+  #endwith
+
+  failed = 0
+  for result in results:
+    if result["status"] != "ok":
+      failed += 1
+    #endif
+  #endfor
+
+  summary = {
+    "assets"    : results,
+    "succeeded" : len(results) - failed,
+    "failed"    : failed,
+    "seconds"   : time.perf_counter() - time_start
+  }
+
+  with open(arguments.summary, "wt") as summary_file:
+    json.dump(summary, summary_file, indent=2)
+  #endwith
+
+  print("calcium-batch: %d succeeded, %d failed, summary in %s" % (summary["succeeded"], failed, arguments.summary))
+  return 0 if failed == 0 else 1
+#end
+
+#
+# The armatures of the currently loaded .blend file named by the
+# --armature arguments.
+#
+
+def findArmatures(export, arguments):
+  import bpy
+
+  armatures = []
+  for armature_name in arguments.armature:
+    armature = bpy.data.objects.get(armature_name)
+    if armature == None or armature.type != 'ARMATURE':
+      raise export.CalciumNoArmatureSelected("No armature named %s exists" % armature_name)
+    #endif
+    armatures.append(armature)
+  #endfor
+  return armatures
+#end
+
+#
+# Export the armatures of one asset from the currently loaded .blend file.
+# This runs inside a child Blender process started by runAsset.
+#
+
+def runExportOne(arguments):
+  export = importlib.import_module(importPackage().__name__ + ".export")
+
+  result = {
+    "status"         : "failed",
+    "error"          : None,
+    "export_seconds" : 0.0
+  }
+
+  time_start = time.perf_counter()
+  try:
+    armatures = findArmatures(export, arguments)
+
+    options = export.defaultOptions()
+    options.update(json.loads(arguments.options))
+
+    output_dir = os.path.dirname(os.path.abspath(arguments.output))
+    os.makedirs(output_dir, exist_ok=True)
+
+    export.CalciumExporter(options).writeArmatures(arguments.output, armatures)
+    result["status"] = "ok"
+    result["profile"] = arguments.output + ".profile.json"
+  except (export.CalciumNoArmatureSelected, export.CalciumExportFailed) as ex:
+    result["error"] = ex.value
+  except Exception:
+    result["error"] = traceback.format_exc()
+  #endtry
+  result["export_seconds"] = time.perf_counter() - time_start
+
+  with open(arguments.result, "wt") as result_file:
+    json.dump(result, result_file)
+  #endwith
+  return 0 if result["status"] == "ok" else 1
+#end
+
+#
+# Validate the armatures of one asset from the currently loaded .blend
+# file. This runs inside a child Blender process started by runAsset.
+#
+
+def runValidateOne(arguments):
+  export = importlib.import_module(importPackage().__name__ + ".export")
+
+  result = {
+    "status"         : "failed",
+    "error"          : None,
+    "errors"         : [],
+    "export_seconds" : 0.0
+  }
+
+  time_start = time.perf_counter()
+  try:
+    armatures = findArmatures(export, arguments)
+
+    options = export.defaultOptions()
+    options.update(json.loads(arguments.options))
+
+    exporter = export.CalciumExporter(options)
+    for armature in armatures:
+      for error in exporter.validateArmature(armature):
+        if len(armatures) > 1:
+          error = "Armature %s: %s" % (armature.name, error)
+        #endif
+        result["errors"].append(error)
+      #endfor
+    #endfor
+    if len(result["errors"]) == 0:
+      result["status"] = "ok"
+    else:
+      result["error"] = "Validation failed with %d errors" % len(result["errors"])
+    #endif
+  except export.CalciumNoArmatureSelected as ex:
+    result["error"] = ex.value
+  except Exception:
+    result["error"] = traceback.format_exc()
+  #endtry
+  result["export_seconds"] = time.perf_counter() - time_start
+
+  with open(arguments.result, "wt") as result_file:
+    json.dump(result, result_file)
+  #endwith
+  return 0 if result["status"] == "ok" else 1
+#end
+
+def main(argv):
+  parser = argparse.ArgumentParser(prog="batch.py", description="Export Calcium files from many .blend files.")
+  parser.add_argument("--jobs", type=int, default=0, help="The number of Blender processes to run at once (default: one per processor)")
+  parser.add_argument("--summary", default="calcium-summary.json", help="The file to which the summary is written")
+  parser.add_argument("--timeout", type=int, default=None, help="The maximum number of seconds allowed for each asset")
+  parser.add_argument("--blender", default=None, help="The Blender executable (default: the running Blender)")
+  parser.add_argument("--validate", action="store_true", help="Only validate the assets, without exporting them")
+  parser.add_argument("--compression", choices=["none", "gzip", "xz"], default=None, help="Compress the exported files as they are written")
+  parser.add_argument("--compression-level", type=int, choices=range(0, 10), default=None, metavar="L", help="The gzip compression level, or the xz preset")
+  parser.add_argument("--export-one", action="store_true", help=argparse.SUPPRESS)
+  parser.add_argument("--validate-one", action="store_true", help=argparse.SUPPRESS)
+  parser.add_argument("--armature", action="append", default=[], help=argparse.SUPPRESS)
+  parser.add_argument("--output", help=argparse.SUPPRESS)
+  parser.add_argument("--options", help=argparse.SUPPRESS)
+  parser.add_argument("--result", help=argparse.SUPPRESS)
+  parser.add_argument("manifest", nargs="?")
+  arguments = parser.parse_args(argv)
+
+  if arguments.export_one:
+    return runExportOne(arguments)
+  #endif
+  if arguments.validate_one:
+    return runValidateOne(arguments)
+  #endif
+
+  if arguments.manifest == None:
+    parser.error("A manifest is required")
+  #endif
+  return runManifest(arguments)
+#end
+
+if __name__ == "__main__":
+  sys.exit(main(scriptArguments(sys.argv)))
+#endif
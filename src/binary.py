@@ -0,0 +1,611 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+#
+# The binary Calcium format (.cab).
+#
+# All integers and floats are little-endian. All offsets are absolute
+# octet offsets from the start of the file, and every table and array
+# begins at an offset that is a multiple of 16, so that a reader can map
+# the file into memory and use the arrays in place. Names are stored once
+# in a string table and referred to by index.
+#
+# Several files may be concatenated into one combined file. Each file is
+# then padded with zeros to a multiple of 16 octets, and its offsets are
+# relative to its own start; the next file begins at the size recorded in
+# the header, rounded up to a multiple of 16.
+#
+# Header (64 octets):
+#   octet[8]  magic "\x89CAB\r\n\x1a\n"
+#   uint32    major version (1)
+#   uint32    minor version (4)
+#   int32     frames per second
+#   uint32    flags (bit 0: bones are referred to by index)
+#   uint64    offset of the string table
+#   uint64    offset of the skeleton table
+#   uint64    offset of the mesh table
+#   uint64    offset of the action table
+#   uint64    size of the file
+#
+# String table:
+#   uint32          string count N
+#   uint32          size of the string data
+#   uint32[N + 1]   start of each string within the string data, followed
+#                   by the size of the string data
+#   octet[]         UTF-8 string data
+#
+# Skeleton table (48 octets):
+#   uint32    skeleton name
+#   uint32    bone count B
+#   uint64    offset of int32[B] bone names
+#   uint64    offset of int32[B] parent bone indices (-1 for root bones)
+#   uint64    offset of float32[B * 3] translations (x, y, z)
+#   uint64    offset of float32[B * 3] scales (x, y, z)
+#   uint64    offset of float32[B * 4] orientations (x, y, z, w)
+#
+# Mesh table:
+#   uint32    mesh count M
+#   uint32    reserved
+#   M mesh records (24 octets):
+#     uint32    mesh name
+#     uint32    vertex count V
+#     uint32    weight array count W, or influences per vertex N
+#     uint32    weight layout (0 weight arrays, 1 influences)
+#     uint64    offset of W weight array records (16 octets):
+#       uint32    bone
+#       uint32    reserved
+#       uint64    offset of float32[V] weights
+#     or offset of an influence record (24 octets):
+#       uint32    quantization (0 float32, 1 uint8, 2 uint16)
+#       uint32    reserved
+#       uint64    offset of uint16[V * N] bone indices
+#       uint64    offset of float32[V * N], uint8[V * N] or uint16[V * N] weights
+#
+# Action table:
+#   uint32    action count A
+#   uint32    reserved
+#   A action records (24 octets):
+#     uint32    action name
+#     int32     action length
+#     uint32    curve count C, or sample count T
+#     uint32    action kind (0 curves, 1 baked)
+#     uint64    offset of C curve records (40 octets):
+#       uint32    bone
+#       uint32    curve type (0 translation, 1 scale, 2 orientation)
+#       uint32    keyframe count K
+#       uint32    value encoding (0 float, 1 constant, 2 quantized)
+#       uint64    offset of int32[K] keyframe indices
+#       uint64    offset of int32[K] keyframe modes (interpolation | easing << 8)
+#       uint64    offset of the values
+#     or offset of a baked record (32 octets):
+#       float32   sample rate, in samples per second
+#       uint32    bone count B
+#       uint64    offset of float32[T * B * 3] translations (x, y, z)
+#       uint64    offset of float32[T * B * 4] orientations (x, y, z, w)
+#       uint64    offset of float32[T * B * 3] scales (x, y, z)
+#
+# The tracks of a baked action are frame-major: the value of bone b at
+# sample t begins at element (t * B + b) * 3 (or * 4 for orientations),
+# and bone b is bone b of the skeleton.
+#
+# If curves are shared, curves with the same type and keyframes, in any
+# action, are stored once: their curve records all refer to the same
+# keyframe indices, modes and values. Readers need not distinguish shared
+# curves, but must not assume that arrays are referred to only once.
+#
+# A bone is referred to by its name, or, if bit 0 of the flags is set, by
+# its index in the skeleton. A weight array whose vertex group names no
+# bone then refers to bone 0xffffffff. When bones are referred to by index,
+# the skeleton is sorted so that every parent comes before its children.
+#
+# Interpolation codes are 0 (constant), 1 (linear) and 2 (exponential).
+# Easing codes are 0 (in), 1 (out) and 2 (in-out).
+#
+# The values of a curve with N components (3 for translation and scale
+# curves, 4 (x, y, z, w) for orientation curves) are stored as:
+#
+#   float:      float32[K * N]
+#   constant:   float32[N], the value of every keyframe
+#   quantized:  for translation and scale curves, a header of float32[3]
+#               minimum and float32[3] maximum of each component, followed
+#               by uint16[K * 3] values q, where a component is
+#               minimum + (maximum - minimum) * q / 65535. For orientation
+#               curves, uint16[K * 3] smallest-three encoded quaternions
+#               (see quantize.py).
+#
+
+import array
+import struct
+import sys
+import time
+
+from . import quantize
+from .index import actionCounts, meshCounts, skeletonCounts
+from .model import CALCIUM_BONE_REFERENCES, CALCIUM_EASINGS, CALCIUM_INTERPOLATIONS, CalciumAction, CalciumBakedAction, CalciumBone, CalciumCurve, CalciumInfluences, CalciumMesh, CalciumSkeleton, CalciumWeightArray
+
+CALCIUM_BINARY_MAGIC         = b"\x89CAB\r\n\x1a\n"
+CALCIUM_BINARY_VERSION_MAJOR = 1
+CALCIUM_BINARY_VERSION_MINOR = 4
+CALCIUM_BINARY_ALIGNMENT     = 16
+
+CALCIUM_BINARY_FLAG_BONE_INDICES = 0x1
+CALCIUM_BINARY_NO_BONE           = 0xffffffff
+
+CALCIUM_BINARY_CURVE_TYPES = {
+  "translation" : 0,
+  "scale"       : 1,
+  "orientation" : 2
+}
+
+CALCIUM_BINARY_INTERPOLATIONS = {
+  "constant"    : 0,
+  "linear"      : 1,
+  "exponential" : 2
+}
+
+CALCIUM_BINARY_QUANTIZATIONS = {
+  "none"   : 0,
+  "uint8"  : 1,
+  "uint16" : 2
+}
+
+CALCIUM_BINARY_EASINGS = {
+  "in"     : 0,
+  "out"    : 1,
+  "in-out" : 2
+}
+
+CALCIUM_BINARY_ACTION_KINDS = {
+  "curves" : 0,
+  "baked"  : 1
+}
+
+CALCIUM_BINARY_CURVE_ENCODINGS = {
+  "float"     : 0,
+  "constant"  : 1,
+  "quantized" : 2
+}
+
+#
+# Write a complete binary file. The layout of the file is calculated in
+# memory and then written sequentially, so the output file does not need
+# to be seekable. The values of curves are stored with the given encoding
+# (see quantize.py), and the encoding and reconstruction error of each
+# curve are available from curveReports() after writing. Bones are referred
+# to by name or by index, as given by the bone references; the skeleton
+# must already be sorted if they are referred to by index. If curves are
+# shared, identical keyframes are written once. If a profiler is given, the
+# time spent laying out and writing the file is recorded as the
+# "formatting" and "write" phases, along with the size of each section and
+# the number of shared curves. If contents are given, the span and counts
+# of the skeleton, each mesh and each action are added to them (see
+# index.py).
+#
+
+class CalciumBinaryWriter:
+  HEADER_STRUCT       = struct.Struct("<8sIIiIQQQQQ")
+  SKELETON_STRUCT     = struct.Struct("<IIQQQQQ")
+  TABLE_STRUCT        = struct.Struct("<II")
+  MESH_STRUCT         = struct.Struct("<IIIIQ")
+  WEIGHT_ARRAY_STRUCT = struct.Struct("<IIQ")
+  INFLUENCES_STRUCT   = struct.Struct("<IIQQ")
+  ACTION_STRUCT       = struct.Struct("<IiIIQ")
+  CURVE_STRUCT        = struct.Struct("<IIIIQQQ")
+  BAKED_STRUCT        = struct.Struct("<fIQQQ")
+
+  def __init__(self, out_file, curve_encoding, bone_references, share_curves, profiler, contents):
+    assert curve_encoding in quantize.CALCIUM_CURVE_ENCODINGS
+    assert bone_references in CALCIUM_BONE_REFERENCES
+    assert type(share_curves) == bool
+
+    self.__out_file = out_file
+    self.__chunks   = []
+    self.__position = CalciumBinaryWriter.HEADER_STRUCT.size
+    self.__strings  = {}
+    self.__string_list = []
+    self.__curve_encoding = curve_encoding
+    self.__curve_reports  = []
+    self.__profiler       = profiler
+    self.__bone_references = bone_references
+    self.__bone_indices    = {}
+    self.__share_curves    = share_curves
+    self.__shared_curves   = {}
+    self.__contents        = contents
+  #end
+
+  def __string(self, text):
+    assert type(text) == str
+    index = self.__strings.get(text, None)
+    if index == None:
+      index = len(self.__string_list)
+      self.__strings[text] = index
+      self.__string_list.append(text)
+    #endif
+    return index
+  #end
+
+  #
+  # Append the given data to the file, aligned to the required boundary,
+  # and return the offset at which it will be written.
+  #
+
+  def __append(self, data):
+    padding = (-self.__position) % CALCIUM_BINARY_ALIGNMENT
+    if padding > 0:
+      self.__chunks.append(bytes(padding))
+      self.__position += padding
+    #endif
+
+    offset = self.__position
+    self.__chunks.append(data)
+    self.__position += len(data)
+    return offset
+  #end
+
+  #
+  # The reference to the bone with the given name.
+  #
+
+  def __bone(self, bone_name):
+    if self.__bone_references == "indices":
+      return self.__bone_indices.get(bone_name, CALCIUM_BINARY_NO_BONE)
+    #endif
+    return self.__string(bone_name)
+  #end
+
+  #
+  # The offset at which the next appended data will begin, and the span of
+  # everything appended since then.
+  #
+
+  def __spanStart(self):
+    return self.__position + ((-self.__position) % CALCIUM_BINARY_ALIGNMENT)
+  #end
+
+  def __span(self, start):
+    return (start, self.__position - start)
+  #end
+
+  def __arrayBytes(self, values):
+    assert type(values) == array.array
+    if sys.byteorder != "little":
+      values = array.array(values.typecode, values)
+      values.byteswap()
+    #endif
+    return values.tobytes()
+  #end
+
+  def __appendArray(self, values):
+    return self.__append(self.__arrayBytes(values))
+  #end
+
+  def __appendSkeleton(self, skeleton):
+    assert type(skeleton) == CalciumSkeleton
+
+    start = self.__spanStart()
+
+    bone_indices = {}
+    for bone in skeleton.bones:
+      bone_indices[bone.name] = len(bone_indices)
+    #endfor
+    self.__bone_indices = bone_indices
+
+    names        = array.array('i')
+    parents      = array.array('i')
+    translations = array.array('f')
+    scales       = array.array('f')
+    orientations = array.array('f')
+
+    for bone in skeleton.bones:
+      assert type(bone) == CalciumBone
+      names.append(self.__string(bone.name))
+      if bone.parent != None:
+        parents.append(bone_indices[bone.parent])
+      else:
+        parents.append(-1)
+      #endif
+      translations.extend(bone.translation)
+      scales.extend(bone.scale)
+      orientations.extend(bone.orientation)
+    #endfor
+
+    names_offset        = self.__appendArray(names)
+    parents_offset      = self.__appendArray(parents)
+    translations_offset = self.__appendArray(translations)
+    scales_offset       = self.__appendArray(scales)
+    orientations_offset = self.__appendArray(orientations)
+
+    offset = self.__append(CalciumBinaryWriter.SKELETON_STRUCT.pack(
+      self.__string(skeleton.name),
+      len(skeleton.bones),
+      names_offset,
+      parents_offset,
+      translations_offset,
+      scales_offset,
+      orientations_offset))
+
+    if self.__contents != None:
+      self.__contents.setSkeleton(self.__span(start), skeletonCounts(skeleton))
+    #endif
+    return offset
+  #end
+
+  def __appendInfluences(self, mesh):
+    assert type(mesh) == CalciumMesh
+    assert type(mesh.influences) == CalciumInfluences
+
+    mesh_influences = mesh.influences
+    record = CalciumBinaryWriter.INFLUENCES_STRUCT.pack(
+      CALCIUM_BINARY_QUANTIZATIONS[mesh_influences.quantization],
+      0,
+      self.__appendArray(mesh_influences.bones),
+      self.__appendArray(mesh_influences.weights))
+
+    return CalciumBinaryWriter.MESH_STRUCT.pack(
+      self.__string(mesh.name),
+      mesh.vertex_count,
+      mesh_influences.count,
+      1,
+      self.__append(record))
+  #end
+
+  def __appendWeightArrays(self, mesh):
+    assert type(mesh) == CalciumMesh
+
+    weight_records = []
+    for weight_array in mesh.weight_arrays:
+      assert type(weight_array) == CalciumWeightArray
+
+      weights = array.array('f', bytes(4 * mesh.vertex_count))
+      for index, weight in zip(weight_array.indices, weight_array.weights):
+        weights[index] = weight
+      #endfor
+
+      weight_records.append(CalciumBinaryWriter.WEIGHT_ARRAY_STRUCT.pack(
+        self.__bone(weight_array.bone_name), 0, self.__appendArray(weights)))
+    #endfor
+
+    return CalciumBinaryWriter.MESH_STRUCT.pack(
+      self.__string(mesh.name),
+      mesh.vertex_count,
+      len(mesh.weight_arrays),
+      0,
+      self.__append(b"".join(weight_records)))
+  #end
+
+  def __appendMeshes(self, meshes):
+    records = []
+    for mesh in meshes:
+      assert type(mesh) == CalciumMesh
+
+      start = self.__spanStart()
+      if mesh.influences != None:
+        records.append(self.__appendInfluences(mesh))
+      else:
+        records.append(self.__appendWeightArrays(mesh))
+      #endif
+
+      if self.__contents != None:
+        self.__contents.addMesh(self.__span(start), meshCounts(mesh))
+      #endif
+    #endfor
+
+    return self.__append(CalciumBinaryWriter.TABLE_STRUCT.pack(len(meshes), 0) + b"".join(records))
+  #end
+
+  #
+  # Append the keyframes of the given curve, and return the encoding, the
+  # error of the encoding, and the offsets of the keyframe indices, modes
+  # and values. If curves are shared, the keyframes of identical curves
+  # are only appended once.
+  #
+
+  def __appendKeyframes(self, curve):
+    assert type(curve) == CalciumCurve
+
+    key = None
+    if self.__share_curves:
+      key = curve.keyframesHash()
+      if key in self.__shared_curves:
+        if self.__profiler != None:
+          self.__profiler.count("curves_shared", 1)
+        #endif
+        return self.__shared_curves[key]
+      #endif
+    #endif
+
+    indices = array.array('i', curve.indices)
+    modes   = array.array('i')
+    for interpolation, easing in zip(curve.interpolations, curve.easings):
+      modes.append(
+        CALCIUM_BINARY_INTERPOLATIONS[CALCIUM_INTERPOLATIONS[interpolation]] |
+        (CALCIUM_BINARY_EASINGS[CALCIUM_EASINGS[easing]] << 8))
+    #endfor
+
+    encoded  = quantize.encodeCurve(curve, self.__curve_encoding)
+    appended = (
+      encoded.encoding,
+      encoded.error,
+      self.__appendArray(indices),
+      self.__appendArray(modes),
+      self.__append(self.__arrayBytes(encoded.header) + self.__arrayBytes(encoded.values)))
+
+    if key != None:
+      self.__shared_curves[key] = appended
+    #endif
+    return appended
+  #end
+
+  def __appendCurve(self, action, curve):
+    assert type(curve) == CalciumCurve
+
+    encoding, error, indices_offset, modes_offset, values_offset = self.__appendKeyframes(curve)
+    self.__curve_reports.append((action.name, curve.bone_name, curve.type, encoding, error))
+
+    return CalciumBinaryWriter.CURVE_STRUCT.pack(
+      self.__bone(curve.bone_name),
+      CALCIUM_BINARY_CURVE_TYPES[curve.type],
+      curve.size(),
+      CALCIUM_BINARY_CURVE_ENCODINGS[encoding],
+      indices_offset,
+      modes_offset,
+      values_offset)
+  #end
+
+  def __appendBakedAction(self, action):
+    assert type(action) == CalciumBakedAction
+
+    record = CalciumBinaryWriter.BAKED_STRUCT.pack(
+      action.rate,
+      action.bone_count,
+      self.__appendArray(array.array('f', action.translations)),
+      self.__appendArray(array.array('f', action.orientations)),
+      self.__appendArray(array.array('f', action.scales)))
+
+    return CalciumBinaryWriter.ACTION_STRUCT.pack(
+      self.__string(action.name),
+      action.length,
+      action.frame_count,
+      CALCIUM_BINARY_ACTION_KINDS["baked"],
+      self.__append(record))
+  #end
+
+  def __appendCurveAction(self, action):
+    assert type(action) == CalciumAction
+
+    curve_records = []
+    for curve in action.curves:
+      curve_records.append(self.__appendCurve(action, curve))
+    #endfor
+
+    return CalciumBinaryWriter.ACTION_STRUCT.pack(
+      self.__string(action.name),
+      action.length,
+      len(action.curves),
+      CALCIUM_BINARY_ACTION_KINDS["curves"],
+      self.__append(b"".join(curve_records)))
+  #end
+
+  def __appendActions(self, actions):
+    records = []
+    for action in actions:
+      start = self.__spanStart()
+      if type(action) == CalciumBakedAction:
+        records.append(self.__appendBakedAction(action))
+      else:
+        records.append(self.__appendCurveAction(action))
+      #endif
+
+      if self.__contents != None:
+        self.__contents.addAction(self.__span(start), actionCounts(action))
+      #endif
+    #endfor
+
+    return self.__append(CalciumBinaryWriter.TABLE_STRUCT.pack(len(actions), 0) + b"".join(records))
+  #end
+
+  def __appendStrings(self):
+    offsets = array.array('I')
+    data    = []
+    size    = 0
+    for text in self.__string_list:
+      encoded = text.encode("utf-8")
+      offsets.append(size)
+      data.append(encoded)
+      size += len(encoded)
+    #endfor
+    offsets.append(size)
+
+    if sys.byteorder != "little":
+      offsets.byteswap()
+    #endif
+
+    header = CalciumBinaryWriter.TABLE_STRUCT.pack(len(self.__string_list), size)
+    return self.__append(header + offsets.tobytes() + b"".join(data))
+  #end
+
+  def write(self, fps, skeleton, meshes, actions):
+    assert type(fps) == int
+    assert type(skeleton) == CalciumSkeleton
+    assert type(meshes) == list
+    assert type(actions) == list
+
+    time_start = time.perf_counter()
+
+    skeleton_offset = self.__appendSkeleton(skeleton)
+    skeleton_end    = self.__position
+    meshes_offset   = self.__appendMeshes(meshes)
+    meshes_end      = self.__position
+    actions_offset  = self.__appendActions(actions)
+    actions_end     = self.__position
+    strings_offset  = self.__appendStrings()
+
+    #
+    # The size of each section includes the padding that precedes it.
+    #
+
+    sizes = {
+      "header"   : CalciumBinaryWriter.HEADER_STRUCT.size,
+      "skeleton" : skeleton_end - CalciumBinaryWriter.HEADER_STRUCT.size,
+      "meshes"   : meshes_end - skeleton_end,
+      "actions"  : actions_end - meshes_end,
+      "strings"  : self.__position - actions_end
+    }
+
+    flags = 0
+    if self.__bone_references == "indices":
+      flags |= CALCIUM_BINARY_FLAG_BONE_INDICES
+    #endif
+
+    time_written = time.perf_counter()
+    self.__out_file.write(CalciumBinaryWriter.HEADER_STRUCT.pack(
+      CALCIUM_BINARY_MAGIC,
+      CALCIUM_BINARY_VERSION_MAJOR,
+      CALCIUM_BINARY_VERSION_MINOR,
+      fps,
+      flags,
+      strings_offset,
+      skeleton_offset,
+      meshes_offset,
+      actions_offset,
+      self.__position))
+
+    for chunk in self.__chunks:
+      self.__out_file.write(chunk)
+    #endfor
+
+    if self.__contents != None:
+      self.__contents.setLength(self.__position)
+    #endif
+
+    if self.__profiler != None:
+      self.__profiler.addTime("formatting", time_written - time_start, 1)
+      self.__profiler.addTime("write", time.perf_counter() - time_written, 1)
+      for section, size in sizes.items():
+        self.__profiler.addBytes(section, size)
+      #endfor
+    #endif
+  #end
+
+  #
+  # The (action name, bone name, curve type, encoding, error) of each
+  # written curve.
+  #
+
+  def curveReports(self):
+    return self.__curve_reports
+  #end
+#endclass
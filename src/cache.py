@@ -0,0 +1,208 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import array
+import base64
+import json
+import os
+import sys
+
+from .model import CalciumAction, CalciumBakedAction, CalciumCurve
+
+#
+# A sidecar cache of exported actions, keyed by a hash of everything that
+# the exported action depends on. Entries are loaded from the cache file,
+# and when the cache is saved, only the entries that were used or added
+# during the export are kept, so entries for deleted or changed actions do
+# not accumulate. An unreadable cache file is treated as empty.
+#
+# The cache file is JSON, so that loading it can only produce data: the
+# file sits next to the output, and must not be able to run code. Each
+# value is a string, number, boolean, None, list, or one of the tagged
+# objects
+#
+#   {"dict"   : {...}}                 a dictionary with string keys
+#   {"array"  : typecode, "data" : s}  an array, as base64 little-endian
+#                                      octets
+#   {"curve"  : [...]}                 the fields of a CalciumCurve
+#   {"action" : [...]}                 the fields of a CalciumAction
+#   {"baked"  : [...]}                 the fields of a CalciumBakedAction
+#
+# Tuples are stored as lists.
+#
+
+def encodeValue(value):
+  if value == None or type(value) in [str, int, float, bool]:
+    return value
+  #endif
+  if type(value) in [list, tuple]:
+    return [encodeValue(item) for item in value]
+  #endif
+  if type(value) == dict:
+    result = {}
+    for key, item in value.items():
+      assert type(key) == str
+      result[key] = encodeValue(item)
+    #endfor
+    return {"dict" : result}
+  #endif
+  if type(value) == array.array:
+    if sys.byteorder != "little":
+      value = array.array(value.typecode, value)
+      value.byteswap()
+    #endif
+    return {"array" : value.typecode, "data" : base64.b64encode(value.tobytes()).decode("ascii")}
+  #endif
+  if type(value) == CalciumCurve:
+    return {"curve" : encodeValue([value.bone_name, value.type, value.indices, value.interpolations, value.easings, value.values])}
+  #endif
+  if type(value) == CalciumAction:
+    return {"action" : encodeValue([value.name, value.length, value.curves])}
+  #endif
+  assert type(value) == CalciumBakedAction
+  return {"baked" : encodeValue([value.name, value.length, value.rate, value.frame_count, value.bone_count, value.translations, value.orientations, value.scales])}
+#end
+
+#
+# Decode a value written by encodeValue(). Raises ValueError if the value
+# is not a valid encoded value.
+#
+
+def decodeValue(value):
+  if value == None or type(value) in [str, int, float, bool]:
+    return value
+  #endif
+  if type(value) == list:
+    return [decodeValue(item) for item in value]
+  #endif
+  if type(value) != dict or len(value) == 0:
+    raise ValueError("Unrecognized cache value")
+  #endif
+
+  if "dict" in value:
+    if type(value["dict"]) != dict:
+      raise ValueError("Unrecognized cache value")
+    #endif
+    result = {}
+    for key, item in value["dict"].items():
+      result[key] = decodeValue(item)
+    #endfor
+    return result
+  #endif
+
+  if "array" in value:
+    typecode = value["array"]
+    if typecode not in ["B", "H", "i", "I", "f", "d"] or type(value.get("data")) != str:
+      raise ValueError("Unrecognized cache array")
+    #endif
+    result = array.array(typecode)
+    result.frombytes(base64.b64decode(value["data"].encode("ascii"), validate=True))
+    if sys.byteorder != "little":
+      result.byteswap()
+    #endif
+    return result
+  #endif
+
+  try:
+    if "curve" in value:
+      return CalciumCurve(*decodeValue(value["curve"]))
+    #endif
+    if "action" in value:
+      name, length, curves = decodeValue(value["action"])
+      for curve in curves:
+        if type(curve) != CalciumCurve:
+          raise ValueError("Unrecognized cache curve")
+        #endif
+      #endfor
+      return CalciumAction(name, length, curves)
+    #endif
+    if "baked" in value:
+      return CalciumBakedAction(*decodeValue(value["baked"]))
+    #endif
+  except (AssertionError, TypeError) as ex:
+    raise ValueError("Invalid cache value: %s" % ex)
+  #endtry
+  raise ValueError("Unrecognized cache value")
+#end
+
+class CalciumExportCache:
+  VERSION = 2
+
+  def __init__(self, path):
+    assert type(path) == str
+
+    self.__path    = path
+    self.__loaded  = {}
+    self.__entries = {}
+
+    try:
+      with open(path, "rt", encoding="utf-8") as cache_file:
+        document = json.load(cache_file)
+      #endwith
+      if type(document) == dict and document.get("version") == CalciumExportCache.VERSION and type(document.get("entries")) == dict:
+        loaded = {}
+        for key, value in document["entries"].items():
+          loaded[key] = decodeValue(value)
+        #endfor
+        self.__loaded = loaded
+      #endif
+    except (OSError, ValueError, RecursionError):
+      self.__loaded = {}
+    #endtry
+  #end
+
+  def contains(self, key):
+    assert type(key) == str
+    return key in self.__entries or key in self.__loaded
+  #end
+
+  def get(self, key):
+    assert type(key) == str
+    if key in self.__entries:
+      return self.__entries[key]
+    #endif
+    value = self.__loaded[key]
+    self.__entries[key] = value
+    return value
+  #end
+
+  def put(self, key, value):
+    assert type(key) == str
+    self.__entries[key] = value
+  #end
+
+  def loadedCount(self):
+    return len(self.__loaded)
+  #end
+
+  #
+  # Save the used and added entries. The cache file is replaced atomically
+  # so that an interrupted save cannot leave a truncated cache behind.
+  #
+
+  def save(self):
+    entries = {}
+    for key, value in self.__entries.items():
+      entries[key] = encodeValue(value)
+    #endfor
+
+    temporary_path = self.__path + ".tmp"
+    with open(temporary_path, "wt", encoding="utf-8") as cache_file:
+      json.dump({"version" : CalciumExportCache.VERSION, "entries" : entries}, cache_file)
+    #endwith
+    os.replace(temporary_path, self.__path)
+  #end
+#endclass
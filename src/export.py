@@ -14,12 +14,36 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #
 
+import array
 import bpy
-import bpy_extras.io_utils
 import bpy_types
+import collections
+import concurrent.futures
 import datetime
+import fnmatch
+import gzip
+import hashlib
 import io
+import lzma
+import math
 import mathutils
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from . import binary
+from . import cache
+from . import influences
+from . import profiling
+from . import quantize
+from . import reduce
+from . import text
+from . import validate
+from .index import CalciumContents, actionCounts, curvesCounts, meshCounts, skeletonCounts, writeIndex
+from .model import CALCIUM_BONE_REFERENCES, CalciumAction, CalciumBakedAction, CalciumBone, CalciumCurveBuilder, CalciumMesh, CalciumSkeleton, CalciumWeightArray
+from .output import CalciumOutputThread
 
 class CalciumNoArmatureSelected(Exception):
   def __init__(self, value):
@@ -30,15 +54,6 @@ class CalciumNoArmatureSelected(Exception):
   #end
 #endclass
 
-class CalciumTooManyArmaturesSelected(Exception):
-  def __init__(self, value):
-    self.value = value
-  #end
-  def __str__(self):
-    return repr(self.value)
-  #end
-#endclass
-
 class CalciumExportFailed(Exception):
   def __init__(self, value):
     self.value = value
@@ -48,22 +63,156 @@ class CalciumExportFailed(Exception):
   #end
 #endclass
 
-class CalciumKeyframe:
-  index         = 0
-  interpolation = 'LINEAR'
-  easing        = 'IN_OUT'
+#
+# The version of the data hashed for the incremental export cache. This
+# must be incremented whenever the exported form of an action changes.
+#
 
-  def __init__(self, _index, _interpolation, _easing):
-    self.index         = _index
-    self.interpolation = _interpolation
-    self.easing        = _easing
-  #end
-#endclass
+CALCIUM_CACHE_VERSION = 5
+
+#
+# The default exporter options. The export operator and the batch driver
+# both start from these.
+#
+
+def defaultOptions():
+  return {
+    'verbose'                   : False,
+    'export_child_mesh_weights' : True,
+    'format'                    : "text",
+    'weight_layout'             : "arrays",
+    'influence_count'           : 4,
+    'influence_quantization'    : "none",
+    'float_precision'           : 6,
+    'worker_count'              : 1,
+    'use_cache'                 : False,
+    'direct_evaluation'         : True,
+    'reduce_keyframes'          : False,
+    'reduction_translation'     : 0.0001,
+    'reduction_scale'           : 0.0001,
+    'reduction_angle'           : 0.0001,
+    'curve_encoding'            : "float",
+    'trace_memory'              : False,
+    'compression'               : "none",
+    'compression_level'         : 6,
+    'multiple_armatures'        : "separate",
+    'action_source'             : "all",
+    'action_filter'             : "*",
+    'bone_references'           : "names",
+    'sampling'                  : "keyframes",
+    'bake_rate'                 : 0.0,
+    'collapse_constant_curves'  : False,
+    'omit_rest_pose_curves'     : False,
+    'share_curves'              : False,
+    'write_index'               : False,
+    'async_write'               : False
+  }
+#end
 
 class CalciumExporter:
-  __verbose     = False
-  __axis_matrix = bpy_extras.io_utils.axis_conversion(to_forward='-Z', to_up='Y').to_4x4()
-  __errors      = []
+  __verbose = False
+  __errors  = []
+
+  __supported_formats = ["text", "binary"]
+
+  #
+  # The output file may be compressed as it is written, with gzip or with
+  # xz. The level is the gzip compression level or the xz preset.
+  #
+
+  __supported_compressions = ["none", "gzip", "xz"]
+
+  #
+  # When several armatures are exported at once, each is either written to
+  # a file of its own, or all of them are written to a single file.
+  #
+
+  __supported_multiple_armatures = ["separate", "combined"]
+
+  #
+  # The actions considered for export are either all of the actions in the
+  # file, or only those used by the NLA strips of the armature. Either way,
+  # only actions whose names match the action filter, a shell-style
+  # pattern, are considered, and actions that do not animate any exported
+  # channel of the armature are skipped.
+  #
+
+  __supported_action_sources = ["all", "nla"]
+
+  #
+  # Actions are either exported as the keyframes of their curves, or baked:
+  # every bone is sampled at a fixed rate, in samples per second, which is
+  # the frame rate of the scene if the bake rate is zero. Baked actions are
+  # not validated, reduced or quantized, since they do not depend on the
+  # interpolation of keyframes.
+  #
+
+  __supported_samplings = ["keyframes", "baked"]
+
+  #
+  # The amount of formatted text that is collected before it is written.
+  #
+
+  __buffer_size = 4 * 1024 * 1024
+
+  #
+  # The number of blocks of the buffer size that may wait to be written by
+  # the output thread, if writes are asynchronous.
+  #
+
+  __write_queue_size = 8
+
+  #
+  # Mesh weights are either exported as one array of weights per vertex
+  # group, or as a fixed number of (bone, weight) influences per vertex.
+  #
+
+  __supported_weight_layouts = ["arrays", "influences"]
+
+  #
+  # The options that do not affect the exported data, and so are not part
+  # of the hashes of cached actions.
+  #
+
+  __options_not_hashed = ["verbose", "worker_count", "use_cache", "trace_memory", "compression", "compression_level", "multiple_armatures", "action_source", "action_filter", "write_index", "async_write"]
+  __cache               = None
+
+  #
+  # The evaluation path used for the bones of each calculated action, as
+  # (armature name, action name, directly evaluated bones, bones evaluated
+  # by the scene) tuples. These are recorded by __calculateActions.
+  #
+
+  __evaluation_paths = []
+
+  #
+  # The keyframe reduction report of each calculated action, as (armature
+  # name, action name, report) tuples.
+  #
+
+  __reduction_reports = []
+
+  #
+  # The encoding and reconstruction error of each curve written to the
+  # binary format, as (armature name, action name, bone name, curve type,
+  # encoding, error) tuples.
+  #
+
+  __curve_reports = []
+
+  #
+  # The F-curve index of each action, by action name, built once per
+  # export by __indexAction.
+  #
+
+  __fcurve_indices = {}
+
+  #
+  # The profiler of the current export. Its report is written next to the
+  # log file.
+  #
+
+  __profiler = None
 
   def __init__(self, options):
     assert type(options) == type({})
@@ -75,6 +224,151 @@ class CalciumExporter:
     self.__export_child_mesh_weights = options['export_child_mesh_weights']
     assert type(self.__export_child_mesh_weights) == bool
     self.__log("exporting child mesh weights enabled")
+
+    self.__format = options['format']
+    assert self.__format in self.__supported_formats
+    self.__log("format: %s", self.__format)
+
+    self.__weight_layout = options['weight_layout']
+    assert self.__weight_layout in self.__supported_weight_layouts
+    self.__log("weight layout: %s", self.__weight_layout)
+
+    self.__influence_count = options['influence_count']
+    assert type(self.__influence_count) == int
+    assert self.__influence_count > 0
+
+    self.__influence_quantization = options['influence_quantization']
+    assert self.__influence_quantization in influences.CALCIUM_INFLUENCE_QUANTIZATIONS
+    if self.__weight_layout == "influences":
+      self.__log("influences: %d per vertex, quantization %s", self.__influence_count, self.__influence_quantization)
+    #endif
+
+    self.__float_precision = options['float_precision']
+    assert type(self.__float_precision) == int
+    assert self.__float_precision >= 1 and self.__float_precision <= 17
+    self.__log("float precision: %d", self.__float_precision)
+
+    self.__worker_count = options['worker_count']
+    assert type(self.__worker_count) == int
+    assert self.__worker_count >= 0
+
+    self.__use_cache = options['use_cache']
+    assert type(self.__use_cache) == bool
+    if self.__use_cache:
+      self.__log("incremental export cache enabled")
+    #endif
+
+    self.__direct_evaluation = options['direct_evaluation']
+    assert type(self.__direct_evaluation) == bool
+    if self.__direct_evaluation:
+      self.__log("direct F-curve evaluation enabled")
+    #endif
+
+    self.__reduce_keyframes = options['reduce_keyframes']
+    assert type(self.__reduce_keyframes) == bool
+
+    self.__reduction_tolerances = {
+      "translation" : options['reduction_translation'],
+      "scale"       : options['reduction_scale'],
+      "orientation" : options['reduction_angle']
+    }
+    for tolerance in self.__reduction_tolerances.values():
+      assert type(tolerance) == float
+      assert tolerance >= 0.0
+    #endfor
+    if self.__reduce_keyframes:
+      self.__log("keyframe reduction: translation %f, scale %f, angle %f",
+        options['reduction_translation'], options['reduction_scale'], options['reduction_angle'])
+    #endif
+
+    self.__curve_encoding = options['curve_encoding']
+    assert self.__curve_encoding in quantize.CALCIUM_CURVE_ENCODINGS
+    self.__log("curve encoding: %s", self.__curve_encoding)
+
+    self.__trace_memory = options['trace_memory']
+    assert type(self.__trace_memory) == bool
+    if self.__trace_memory:
+      self.__log("memory tracing enabled")
+    #endif
+
+    self.__compression = options['compression']
+    assert self.__compression in self.__supported_compressions
+    self.__compression_level = options['compression_level']
+    assert type(self.__compression_level) == int
+    assert self.__compression_level >= 0 and self.__compression_level <= 9
+    if self.__compression != "none":
+      self.__log("compression: %s, level %d", self.__compression, self.__compression_level)
+    #endif
+
+    self.__multiple_armatures = options['multiple_armatures']
+    assert self.__multiple_armatures in self.__supported_multiple_armatures
+    self.__log("multiple armatures: %s", self.__multiple_armatures)
+
+    self.__action_source = options['action_source']
+    assert self.__action_source in self.__supported_action_sources
+    self.__action_filter = options['action_filter']
+    assert type(self.__action_filter) == str
+    self.__log("actions: %s, filter %s", self.__action_source, self.__action_filter)
+
+    self.__bone_references = options['bone_references']
+    assert self.__bone_references in CALCIUM_BONE_REFERENCES
+    self.__log("bone references: %s", self.__bone_references)
+
+    self.__sampling = options['sampling']
+    assert self.__sampling in self.__supported_samplings
+    self.__bake_rate = options['bake_rate']
+    assert type(self.__bake_rate) == float
+    assert self.__bake_rate >= 0.0
+    if self.__sampling == "baked":
+      self.__log("baking actions at %f samples per second (0 is the scene frame rate)", self.__bake_rate)
+    #endif
+
+    self.__collapse_constant_curves = options['collapse_constant_curves']
+    assert type(self.__collapse_constant_curves) == bool
+    if self.__collapse_constant_curves:
+      self.__log("collapsing constant curves to one keyframe")
+    #endif
+
+    self.__omit_rest_pose_curves = options['omit_rest_pose_curves']
+    assert type(self.__omit_rest_pose_curves) == bool
+    if self.__omit_rest_pose_curves:
+      self.__log("omitting curves that hold the rest pose")
+    #endif
+
+    self.__share_curves = options['share_curves']
+    assert type(self.__share_curves) == bool
+    if self.__share_curves and self.__sampling == "baked":
+      self.__log("not sharing curves, since baked actions have no curves")
+      self.__share_curves = False
+    #endif
+    if self.__share_curves:
+      self.__log("sharing identical curves")
+    #endif
+
+    self.__write_index = options['write_index']
+    assert type(self.__write_index) == bool
+    if self.__write_index:
+      self.__log("writing a table of contents")
+    #endif
+
+    #
+    # The binary format is only written once the whole file has been laid
+    # out, since its header holds the offsets of the sections that follow
+    # it, so asynchronous writes only apply to the text format.
+    #
+
+    self.__async_write = options['async_write']
+    assert type(self.__async_write) == bool
+    if self.__async_write and self.__format == "binary":
+      self.__log("not writing from a background thread, since binary files are written once complete")
+      self.__async_write = False
+    #endif
+    if self.__async_write:
+      self.__log("writing from a background thread")
+    #endif
+
+    self.__options   = dict(options)
+    self.__validator = validate.CalciumValidator()
   #end
 
   def __log(self, fmt, *args):
@@ -83,696 +377,1970 @@ class CalciumExporter:
     #endif
   #end
 
+  #
+  # Transform values to the exported coordinate system: -Z forward and Y
+  # up, as given by axis_conversion(to_forward='-Z', to_up='Y'). The basis
+  # change only permutes and negates components, so it is applied to the
+  # components directly rather than by multiplying by the conversion
+  # matrix: (x, y, z) becomes (x, z, -y). Adding zero turns negative zeros
+  # into positive zeros, exactly as the matrix product does. Orientations
+  # are normalized and returned as (x, y, z, w) tuples; rotating the
+  # vector part of a unit quaternion is equivalent to rotating its axis,
+  # and avoids the conversion to an axis and angle, which is unstable near
+  # the identity.
+  #
+
   def __transformScaleToExport(self, v):
-    assert type(v) == mathutils.Vector
-    return mathutils.Vector((v.x, v.z, v.y))
+    return (v[0], v[2], v[1])
   #end
 
   def __transformTranslationToExport(self, v):
-    assert type(v) == mathutils.Vector
-    return self.__axis_matrix * v
+    return (v[0] + 0.0, v[2] + 0.0, 0.0 - v[1])
   #end
 
   def __transformOrientationToExport(self, q):
-    assert type(q) == mathutils.Quaternion
-
-    aa = q.to_axis_angle()
-    axis = aa[0]
-    axis = self.__axis_matrix * axis
-    return mathutils.Quaternion(axis, aa[1])
+    w, x, y, z = q
+    length = math.sqrt(w * w + x * x + y * y + z * z)
+    return (x / length + 0.0, z / length + 0.0, 0.0 - y / length, w / length + 0.0)
   #end
 
-  __supported_interpolation = {
-    "CONSTANT" : "constant",
-    "LINEAR"   : "linear",
-    "EXPO"     : "exponential"
-  }
+  #
+  # The curve groups that are exported for each bone, in the order in
+  # which they are written. Each group names the pose bone property that
+  # is animated and the channels of that property.
+  #
 
-  def __transformInterpolation(self, i):
-    return self.__supported_interpolation.get(i, None)
-  #end
+  __curve_groups = [
+    ("translation", "location",            ["X", "Y", "Z"]),
+    ("scale",       "scale",               ["X", "Y", "Z"]),
+    ("orientation", "rotation_quaternion", ["W", "X", "Y", "Z"])
+  ]
 
-  __supported_easing = {
-    "EASE_IN"     : "in",
-    "EASE_OUT"    : "out",
-    "EASE_IN_OUT" : "in-out"
-  }
+  #
+  # Index the F-curves of the given action in a single pass. The result
+  # maps bone names to maps of animated pose bone properties to maps of
+  # array indices to F-curves. F-curves that do not animate a pose bone
+  # property are ignored. The index of each action is only built once per
+  # export, however many armatures share the action.
+  #
 
-  def __transformEasing(self, e):
-    return self.__supported_easing.get(e, None)
-  #end
+  __fcurve_path = re.compile(r'^pose\.bones\["((?:[^"\\]|\\.)*)"\]\.([a-z_]+)$')
 
   #
-  # Check that for all keyframes k in a channel c, there is a corresponding
-  # keyframe in all other channels at the same frame as k.
+  # Return the (bone name, property) pair animated by the given F-curve
+  # data path, or None if the path does not refer to a pose bone property.
   #
 
-  def __checkKeyframesCorresponding(self, action, group_name, group_channels):
-    assert type(action) == bpy.types.Action
-    assert type(group_name) == str
-    assert type(group_channels) == type({})
+  def __parseFCurvePath(self, data_path):
+    match = self.__fcurve_path.match(data_path)
+    if match == None:
+      return None
+    #endif
+    return (re.sub(r'\\(.)', r'\1', match.group(1)), match.group(2))
+  #end
 
-    self.__log("[%s] __checkKeyframesCorresponding %s", action.name, group_name)
+  def __indexAction(self, action):
+    assert type(action) == bpy.types.Action
 
-    ok = True
-    for channel_name, channel_frames in group_channels.items():
-      for channel_name_other, channel_frames_other in group_channels.items():
+    index = self.__fcurve_indices.get(action.name, None)
+    if index != None:
+      return index
+    #endif
 
-        if channel_name_other == channel_name:
+    with self.__profiler.phase("fcurve_lookup"):
+      index = {}
+      for fcurve in action.fcurves:
+        parsed = self.__parseFCurvePath(fcurve.data_path)
+        if parsed == None:
           continue
         #endif
 
-        for frame_index in channel_frames.keys():
-          if not (frame_index in channel_frames_other):
-            text =  "A keyframe for a channel of a group is missing corresponding keyframes in the other group channels.\n"
-            text += "  Action:                        %s\n" % action.name
-            text += "  Group:                         %s\n" % group_name
-            text += "  Frame at:                      %d\n" % frame_index
-            text += "  Channel:                       %s\n" % channel_name
-            text += "  Channel with missing keyframe: %s\n" % channel_name_other
-            text += "  Possible solution: Create a keyframe at frame %d for channel %s of group %s\n" % (frame_index, channel_name_other, group_name)
-            self.__errors.append(text)
-            ok = False
-            continue
-          #endif
-        #endfor
+        bone_name, bone_property = parsed
+        properties = index.setdefault(bone_name, {})
+        properties.setdefault(bone_property, {})[fcurve.array_index] = fcurve
       #endfor
-    #endfor
-
-    return ok
+    #endwith
+    self.__fcurve_indices[action.name] = index
+    return index
   #end
 
   #
-  # Check that all of the given group channels have the same number of
-  # keyframes.
+  # Validate all of the exported curve groups of the given action, without
+  # evaluating the scene. The result maps bone names to maps of curve types
+  # to maps of frame indices to exported (interpolation, easing) pairs.
+  # Bones that have no F-curves in any exported group are omitted, as are
+  # groups that have no channels at all, or that failed validation. If no
+  # bone of the armature is animated by the action, None is returned.
+  # Errors are added to the given list. When actions are baked, the groups
+  # are not validated, and the curves of each animated bone are empty.
   #
 
-  def __checkKeyframesCountsEqual(self, action, group_name, group_channels):
+  def __validateAction(self, armature, action, errors):
+    assert type(armature) == bpy_types.Object
     assert type(action) == bpy.types.Action
-    assert type(group_name) == str
-    assert type(group_channels) == type({})
+    assert armature.type == 'ARMATURE'
+    assert type(errors) == list
 
-    self.__log("[%s] __checkKeyframesCountsEqual %s", action.name, group_name)
+    self.__log("[%s] __validateAction", action.name)
 
-    counts = {}
-    for channel_name, channel in group_channels.items():
-      assert type(channel_name) == str
-      assert type(channel) == bpy.types.FCurve
-      counts[channel_name] = len(channel.keyframe_points)
-    #endfor
+    fcurve_index   = self.__indexAction(action)
+    curves_by_bone = {}
+    for bone_name in armature.pose.bones.keys():
+      properties = fcurve_index.get(bone_name, None)
+      if properties == None:
+        continue
+      #endif
+      if not any(curve_property in properties for curve_type, curve_property, channel_names in self.__curve_groups):
+        continue
+      #endif
+
+      curves = {}
+      if self.__sampling == "baked":
+        curves_by_bone[bone_name] = curves
+        continue
+      #endif
 
-    uniques = len(set(counts.values()))
-    if uniques > 1:
-      text  = "The channels of a group have a different number of keyframes.\n"
-      text += "  Action:                      %s\n" % action.name
-      text += "  Group:                       %s\n" % group_name
+      for curve_type, curve_property, channel_names in self.__curve_groups:
+        fcurves = properties.get(curve_property, {})
+
+        channels = []
+        for channel_index, channel_name in enumerate(channel_names):
+          fcurve = fcurves.get(channel_index, None)
+          if fcurve == None:
+            channels.append((channel_name, None))
+          else:
+            keyframes = []
+            for point in fcurve.keyframe_points:
+              keyframes.append((int(point.co.x), point.interpolation, point.easing))
+            #endfor
+            channels.append((channel_name, keyframes))
+          #endif
+        #endfor
 
-      for channel_name, count in counts.items():
-        text += "  Keyframe count for channel %s: %d\n" % (channel_name, count)
+        group_name = 'pose.bones["%s"].%s' % (bone_name, curve_property)
+        frames = self.__validator.validateGroup(errors, action.name, group_name, channels)
+        if frames != None:
+          curves[curve_type] = frames
+        #endif
       #endfor
 
-      text += "  Solution: Create a matching number of keyframes for all channels in the group\n"
-      self.__errors.append(text)
-      return False
-    #endif
+      curves_by_bone[bone_name] = curves
+    #endfor
 
-    assert uniques == 1
-    return True
+    if len(curves_by_bone) == 0:
+      return None
+    #endif
+    return curves_by_bone
   #end
 
   #
-  # Check that all of the channels of a given group are present. If none
-  # of them are present, then the group is simply assumed not to exist and
-  # ignored.
+  # The actions that may be exported for the given armature: the given
+  # actions, or only those used by the NLA strips of the armature, whose
+  # names match the action filter.
   #
 
-  def __checkAllChannelsArePresent(self, action, group_name, group_channels):
-    assert type(action) == bpy.types.Action
-    assert type(group_name) == str
-    assert type(group_channels) == type({})
-
-    self.__log("[%s] __checkAllChannelsArePresent %s", action.name, group_name)
-
-    #
-    # If all of the channels are missing, then the group is simply assumed
-    # not to exist.
-    #
+  def __candidateActions(self, armature, actions):
+    assert type(armature) == bpy_types.Object
+    assert armature.type == 'ARMATURE'
 
-    missing = 0
-    for channel_name, channel in group_channels.items():
-      if channel == None:
-        missing += 1
+    nla_actions = None
+    if self.__action_source == "nla":
+      nla_actions = set()
+      if armature.animation_data is not None:
+        for track in armature.animation_data.nla_tracks:
+          for strip in track.strips:
+            if strip.action is not None:
+              nla_actions.add(strip.action.name)
+            #endif
+          #endfor
+        #endfor
       #endif
     #endif
 
-    self.__log("[%s] __checkAllChannelsArePresent %s: missing %d", action.name, group_name, missing)
-    if missing == len(group_channels):
-      self.__log("[%s] group %s has no keyframes, ignoring it", action.name, group_name)
-      return False
-    #endif
+    candidates = []
+    for action in actions:
+      if action.name == 'poses':
+        continue
+      #endif
+      if nla_actions != None and not (action.name in nla_actions):
+        continue
+      #endif
+      if not fnmatch.fnmatchcase(action.name, self.__action_filter):
+        continue
+      #endif
+      candidates.append(action)
+    #endfor
+    return candidates
+  #end
 
-    #
-    # However, if one or more channels are missing, then this is an error.
-    #
+  #
+  # Validate all of the given actions. The result is a list of (action,
+  # curves) pairs, where the curves are as returned by __validateAction.
+  # Actions that are not candidates for export, or that do not animate the
+  # armature, are skipped. Any errors are recorded as (armature name,
+  # error) pairs, and no action is evaluated.
+  #
 
-    if missing > 0:
-      for channel_name, channel in group_channels.items():
-        text =  "No keyframes are defined for a channel of a group.\n"
-        text += "  Action:   %s\n" % action.name
-        text += "  Group:    %s\n" % group_name
-        text += "  Channel:  %s\n" % channel_name
-        text += "  Solution: Create the same number of keyframes for all channels of the group\n"
-        self.__errors.append(text)
-      #endfor
-      return False
-    #endif
+  def __validateActions(self, armature, actions):
+    assert type(armature) == bpy_types.Object
+    assert armature.type == 'ARMATURE'
 
-    return True
+    validated = []
+    errors    = []
+    skipped   = 0
+    with self.__profiler.phase("validation"):
+      for action in self.__candidateActions(armature, actions):
+        curves_by_bone = self.__validateAction(armature, action, errors)
+        if curves_by_bone == None:
+          self.__log("[%s] skipped: the action does not animate %s", action.name, armature.name)
+          skipped += 1
+          continue
+        #endif
+        validated.append((action, curves_by_bone))
+      #endfor
+    #endwith
+    for error in errors:
+      self.__errors.append((armature.name, error))
+    #endfor
+    self.__profiler.count("actions", len(validated))
+    self.__profiler.count("actions_skipped", skipped)
+    return validated
   #end
 
   #
-  # For the given group, collect all of the keyframes.
+  # Determine whether the local transform of the given bone can be
+  # calculated directly from the F-curves of the action, without evaluating
+  # the scene. This is the case when nothing other than the F-curves of the
+  # action sets the channels of the bone. Returns None if the bone can be
+  # evaluated directly, or the reason why it cannot.
+  #
+  # Constraints do not change the local transform that is exported, but
+  # bones with constraints are still evaluated by the scene so that the
+  # exported values are exactly those shown by the rig.
+  #
+  # The evaluation is the (driven bones, armature reason) pair returned by
+  # __prepareEvaluation for the armature of the bone.
   #
 
-  def __calculateKeyframesCollect(self, action, group_name, group_channels):
-    assert type(action) == bpy.types.Action
-    assert type(group_name) == str
-    assert type(group_channels) == type({})
-
-    self.__log("[%s] __calculateKeyframesCollect %s", action.name, group_name)
+  def __sceneEvaluationReason(self, pose_bone, properties, evaluation):
+    assert type(pose_bone) == bpy_types.PoseBone
+    assert type(properties) == type({})
+    assert type(evaluation) == tuple
 
-    keyframes_by_channel = {}
-    for channel_name, channel in group_channels.items():
-      assert type(channel_name) == str
-      assert type(channel) == bpy.types.FCurve
+    driven_bones, armature_reason = evaluation
+    if armature_reason != None:
+      return armature_reason
+    #endif
+    if pose_bone.name in driven_bones:
+      return "the bone is driven"
+    #endif
+    if len(pose_bone.constraints) > 0:
+      return "the bone has constraints"
+    #endif
+    if pose_bone.rotation_mode != 'QUATERNION':
+      return "the rotation mode is %s" % pose_bone.rotation_mode
+    #endif
 
-      channel_frames = {}
-      for frame in channel.keyframe_points:
-        channel_frames[int(frame.co.x)] = frame
+    for curve_type, curve_property, channel_names in self.__curve_groups:
+      for fcurve in properties.get(curve_property, {}).values():
+        if fcurve.mute:
+          return "an F-curve of %s is muted" % curve_property
+        #endif
       #endfor
-      keyframes_by_channel[channel_name] = channel_frames
     #endfor
-
-    return keyframes_by_channel
+    return None
   #end
 
   #
-  # Collect all keyframes for export. This assumes that all of the other __calculateKeyframes
-  # preconditions have been evaluated.
+  # Calculate the local transform of the given bone at each of the given
+  # keyframe indices by evaluating its F-curves. Channels that the action
+  # does not animate keep the current value of the pose bone, exactly as
+  # they do when the scene is evaluated.
+  #
+  # The transform is decomposed from matrix_basis when the scene is
+  # evaluated, which only preserves the orientation for positive scales, so
+  # None is returned if any scale is not positive. The orientation is passed
+  # through a rotation matrix so that its sign matches the decomposed one.
   #
 
-  def __calculateKeyframesCollectForExport(self, action, group_name, keyframes_by_channel):
-    assert type(action) == bpy.types.Action
-    assert type(group_name) == str
-    assert type(keyframes_by_channel) == type({})
-
-    self.__log("[%s] __calculateKeyframesCollectForExport %s", action.name, group_name)
-
-    error = False
-    keyframes = {}
-    for channel_name, channel_keyframes in keyframes_by_channel.items():
-      for keyframe_index, keyframe in channel_keyframes.items():
-
-        self.__log("[%s][%s][keyframe %d]: interpolation %s", action.name, group_name, keyframe_index, keyframe.interpolation)
-        self.__log("[%s][%s][keyframe %d]: easing %s", action.name, group_name, keyframe_index, keyframe.easing)
-
-        ex_interpolation = self.__transformInterpolation(keyframe.interpolation)
-        if ex_interpolation == None:
-          text = "The keyframe interpolation type is not supported.\n"
-          text += "  Action:        %s\n" % action.name
-          text += "  Group:         %s\n" % group_name
-          text += "  Channel:       %s\n" % channel_name
-          text += "  Keyframe:      %d\n" % keyframe_index
-          text += "  Interpolation: %s\n" % keyframe.interpolation
-          text += "  Possible solution: Use a supported interpolation type (%s)\n" % list(self.__supported_interpolation.values())
-          self.__errors.append(text)
-          error = True
-        else:
-          if keyframe_index in keyframes:
-            existing = keyframes[keyframe_index]
-            if existing != None:
-              assert type(existing) == CalciumKeyframe
-
-              if existing.interpolation != ex_interpolation:
-                text  = "The interpolation value is not the same for all channels at this keyframe.\n"
-                text += "  Action:                         %s\n" % action.name
-                text += "  Group:                          %s\n" % group_name
-                text += "  Channel:                        %s\n" % channel_name
-                text += "  Keyframe:                       %d\n" % keyframe_index
-                text += "  Interpolation:                  %s\n" % keyframe.interpolation
-                text += "  Interpolation in other channel: %s\n" % existing.interpolation
-                text += "  Possible solution: Set the interpolation value to %s for all channels at this keyframe\n" % existing.interpolation
-                self.__errors.append(text)
-                error = True
-              #endif
-            #endif
-          #endif
-        #endif
+  def __evaluateBoneDirectly(self, pose_bone, properties, indices):
+    assert type(pose_bone) == bpy_types.PoseBone
+    assert type(properties) == type({})
+
+    channels = []
+    for curve_property in ["location", "rotation_quaternion", "scale"]:
+      fcurves = properties.get(curve_property, {})
+      current = getattr(pose_bone, curve_property)
+      property_channels = []
+      for channel_index in range(0, len(current)):
+        property_channels.append((fcurves.get(channel_index, None), current[channel_index]))
+      #endfor
+      channels.append(property_channels)
+    #endfor
 
-        ex_easing = self.__transformEasing(keyframe.easing)
-        if ex_easing == None:
-          text = "The keyframe easing type is not supported.\n"
-          text += "  Action:        %s\n" % action.name
-          text += "  Group:         %s\n" % group_name
-          text += "  Channel:       %s\n" % channel_name
-          text += "  Keyframe:      %d\n" % keyframe_index
-          text += "  Interpolation: %s\n" % keyframe.easing
-          text += "  Possible solution: Use a supported easing type (%s)\n" % list(self.__supported_easing.values())
-          self.__errors.append(text)
-          error = True
-        else:
-          if keyframe_index in keyframes:
-            existing = keyframes[keyframe_index]
-            if existing != None:
-              assert type(existing) == CalciumKeyframe
-
-              if existing.easing != ex_easing:
-                text  = "The easing value is not the same for all channels at this keyframe.\n"
-                text += "  Action:                         %s\n" % action.name
-                text += "  Group:                          %s\n" % group_name
-                text += "  Channel:                        %s\n" % channel_name
-                text += "  Keyframe:                       %d\n" % keyframe_index
-                text += "  Interpolation:                  %s\n" % keyframe.easing
-                text += "  Interpolation in other channel: %s\n" % existing.easing
-                text += "  Possible solution: Set the easing value to %s for all channels at this keyframe\n" % existing.easing
-                self.__errors.append(text)
-                error = True
-              #endif
-            #endif
+    samples = {}
+    for index in indices:
+      values = []
+      for property_channels in channels:
+        property_values = []
+        for fcurve, current in property_channels:
+          if fcurve == None:
+            property_values.append(current)
+          else:
+            property_values.append(fcurve.evaluate(index))
           #endif
-        #endif
-
-        if not error:
-          assert type(ex_interpolation) == str
-          assert type(ex_easing) == str
-          keyframes[keyframe_index] = CalciumKeyframe(keyframe_index, ex_interpolation, ex_easing)
-        #endif
+        #endfor
+        values.append(property_values)
       #endfor
-    #endfor
 
-    if error:
-      return None
-    #endif
+      scale = mathutils.Vector(values[2])
+      if scale.x <= 0.0 or scale.y <= 0.0 or scale.z <= 0.0:
+        return None
+      #endif
 
-    return keyframes
+      orientation = mathutils.Quaternion(values[1]).normalized().to_matrix().to_quaternion()
+      samples[index] = (mathutils.Vector(values[0]), orientation, scale)
+    #endfor
+    return samples
   #end
 
-  def __calculateKeyframesForCurves(self, action, group_name, group_channels):
-    assert type(action) == bpy.types.Action
-    assert type(group_name) == str
-    assert type(group_channels) == type({})
-
-    self.__log("[%s] __calculateKeyframesForCurves %s", action.name, group_name)
+  #
+  # The frames at which a baked action is sampled: from the first frame of
+  # the action to the last, at the bake rate. The times are fractional if
+  # the bake rate differs from the frame rate of the scene.
+  #
 
-    if not self.__checkAllChannelsArePresent(action, group_name, group_channels):
-      return None
+  def __bakeRate(self):
+    if self.__bake_rate == 0.0:
+      return float(bpy.context.scene.render.fps)
     #endif
+    return self.__bake_rate
+  #end
 
-    if not self.__checkKeyframesCountsEqual(action, group_name, group_channels):
-      return None
-    #endif
+  def __bakeTimes(self, action):
+    assert type(action) == bpy.types.Action
 
-    keyframes_by_channel = self.__calculateKeyframesCollect(action, group_name, group_channels)
-    if not self.__checkKeyframesCorresponding(action, group_name, keyframes_by_channel):
-      return None
-    #endif
+    step  = bpy.context.scene.render.fps / self.__bakeRate()
+    first = action.frame_range.x
+    count = int(math.floor((action.frame_range.y - first) / step + 1.0e-6)) + 1
 
-    return self.__calculateKeyframesCollectForExport(action, group_name, keyframes_by_channel)
+    times = []
+    for sample in range(0, count):
+      times.append(first + sample * step)
+    #endfor
+    return times
   #end
 
-  def __writeBoneCurvesTranslation(self, out_file, armature, action, bone_name):
-    assert type(out_file) == io.TextIOWrapper
+  #
+  # The frames at which each bone of the armature must be sampled. For
+  # keyframe exports, these are the keyframe indices used by the curves of
+  # each animated bone. For baked exports, every bone is sampled at every
+  # bake time of the action.
+  #
+
+  def __sampleIndices(self, armature, action, curves_by_bone):
     assert type(armature) == bpy_types.Object
     assert type(action) == bpy.types.Action
-    assert armature.type == 'ARMATURE'
-    assert type(bone_name) == str
+    assert type(curves_by_bone) == type({})
 
-    group_name          = 'pose.bones["%s"].location' % bone_name
-    group_channels      = {}
-    group_channels["X"] = action.fcurves.find(group_name, 0)
-    group_channels["Y"] = action.fcurves.find(group_name, 1)
-    group_channels["Z"] = action.fcurves.find(group_name, 2)
-
-    frames = self.__calculateKeyframesForCurves(action, group_name, group_channels)
-
-    if frames == None:
-      return
+    indices_by_bone = {}
+    if self.__sampling == "baked":
+      times = self.__bakeTimes(action)
+      for pose_bone in armature.pose.bones:
+        indices_by_bone[pose_bone.name] = times
+      #endfor
+      return indices_by_bone
     #endif
 
-    frames_count = len(frames)
-    self.__log("action[%s]: translation frame count: %d", action.name, frames_count)
-    if frames_count > 0:
-      out_file.write("    [curve\n")
-      out_file.write("      [curve-bone \"%s\"]\n" % bone_name)
-      out_file.write("      [curve-type translation]\n")
-      out_file.write("      [curve-keyframes\n")
-
-      assert bone_name in armature.pose.bones, "No bone %s in armature" % bone_name
-      bone = armature.pose.bones[bone_name]
-      assert type(bone) == bpy_types.PoseBone
-
-      for index in sorted(frames.keys()):
-        assert type(index) == int
-        frame = frames[index]
-        assert type(frame) == CalciumKeyframe
-
-        bpy.context.scene.frame_set(index)
-
-        value = self.__transformTranslationToExport(bone.matrix_basis.to_translation())
-        out_file.write("        [curve-keyframe\n")
-        out_file.write("          [curve-keyframe-index %d]\n" % index)
-        out_file.write("          [curve-keyframe-interpolation \"%s\"]\n" % frame.interpolation)
-        out_file.write("          [curve-keyframe-easing \"%s\"]\n" % frame.easing)
-        out_file.write("          [curve-keyframe-vector3 %f %f %f]]\n" % (value.x, value.y, value.z))
-      #end
-
-      out_file.write("    ]]\n")
-      out_file.write("\n")
-    #endif
+    for bone_name, curves in curves_by_bone.items():
+      indices = set()
+      for bone_frames in curves.values():
+        indices.update(bone_frames.keys())
+      #endfor
+      indices_by_bone[bone_name] = indices
+    #endfor
+    return indices_by_bone
   #end
 
-  def __writeBoneCurvesScale(self, out_file, armature, action, bone_name):
-    assert type(out_file) == io.TextIOWrapper
+  #
+  # Calculate the local transform of every bone at each of the frames given
+  # for it by __sampleIndices. Bones that can be evaluated directly are
+  # calculated from their F-curves. For the remaining bones, the scene must
+  # be evaluated once for each unique frame used by any of them: each such
+  # bone is added to the given map of frames to (armature, bone name, bone
+  # samples) lists, and its samples are filled in later by __sampleScene.
+  #
+  # The fcurve_index is the result of __indexAction for the action. The
+  # result maps bone names to maps of frames to (translation, orientation,
+  # scale) tuples.
+  #
+
+  def __sampleActionDirectly(self, armature, action, fcurve_index, indices_by_bone, evaluation, frames):
     assert type(armature) == bpy_types.Object
     assert type(action) == bpy.types.Action
     assert armature.type == 'ARMATURE'
-    assert type(bone_name) == str
-
-    group_name = 'pose.bones["%s"].scale' % bone_name
-    group_channels      = {}
-    group_channels["X"] = action.fcurves.find(group_name, 0)
-    group_channels["Y"] = action.fcurves.find(group_name, 1)
-    group_channels["Z"] = action.fcurves.find(group_name, 2)
-
-    frames = self.__calculateKeyframesForCurves(action, group_name, group_channels)
+    assert type(fcurve_index) == type({})
+    assert type(indices_by_bone) == type({})
+    assert type(frames) == type({})
+
+    samples      = {}
+    direct_bones = []
+    scene_bones  = []
+    for bone_name, indices in indices_by_bone.items():
+      assert bone_name in armature.pose.bones, "No bone %s in armature" % bone_name
+      pose_bone = armature.pose.bones[bone_name]
 
-    if frames == None:
-      return
-    #endif
+      if len(indices) == 0:
+        samples[bone_name] = {}
+        continue
+      #endif
 
-    frames_count = len(frames)
-    self.__log("action[%s]: scale frame count: %d", action.name, frames_count)
-    if frames_count > 0:
-      out_file.write("    [curve\n")
-      out_file.write("      [curve-bone \"%s\"]\n" % bone_name)
-      out_file.write("      [curve-type scale]\n")
-      out_file.write("      [curve-keyframes\n")
+      properties = fcurve_index.get(bone_name, {})
+      reason = self.__sceneEvaluationReason(pose_bone, properties, evaluation)
+      if reason == None:
+        time_start = time.perf_counter()
+        bone_samples = self.__evaluateBoneDirectly(pose_bone, properties, sorted(indices))
+        self.__profiler.addTime("fcurve_evaluation", time.perf_counter() - time_start, 1)
+        if bone_samples != None:
+          self.__log("[%s] %s: evaluated from F-curves", action.name, bone_name)
+          samples[bone_name] = bone_samples
+          direct_bones.append(bone_name)
+          continue
+        #endif
+        reason = "a scale is not positive"
+      #endif
 
-      assert bone_name in armature.pose.bones, "No bone %s in armature" % bone_name
-      bone = armature.pose.bones[bone_name]
-      assert type(bone) == bpy_types.PoseBone
-
-      for index in sorted(frames.keys()):
-        assert type(index) == int
-        frame = frames[index]
-        assert type(frame) == CalciumKeyframe
-
-        bpy.context.scene.frame_set(index)
-
-        value = self.__transformScaleToExport(bone.matrix_basis.to_scale())
-        out_file.write("        [curve-keyframe\n")
-        out_file.write("          [curve-keyframe-index %d]\n" % index)
-        out_file.write("          [curve-keyframe-interpolation \"%s\"]\n" % frame.interpolation)
-        out_file.write("          [curve-keyframe-easing \"%s\"]\n" % frame.easing)
-        out_file.write("          [curve-keyframe-vector3 %f %f %f]]\n" % (value.x, value.y, value.z))
-      #end
+      self.__log("[%s] %s: evaluated by the scene (%s)", action.name, bone_name, reason)
+      scene_bones.append((bone_name, reason))
+      samples[bone_name] = {}
+      for index in indices:
+        frames.setdefault(index, []).append((armature, bone_name, samples[bone_name]))
+      #endfor
+    #endfor
 
-      out_file.write("    ]]\n")
-      out_file.write("\n")
-    #endif
+    self.__evaluation_paths.append((armature.name, action.name, direct_bones, scene_bones))
+    self.__profiler.count("bones_evaluated_directly", len(direct_bones))
+    self.__profiler.count("bones_evaluated_by_scene", len(scene_bones))
+    self.__log("[%s] __sampleActionDirectly: %s: %d bones evaluated from F-curves, %d bones evaluated by the scene",
+      action.name, armature.name, len(direct_bones), len(scene_bones))
+    return samples
   #end
 
-  def __writeBoneCurvesOrientation(self, out_file, armature, action, bone_name):
-    assert type(out_file) == io.TextIOWrapper
-    assert type(armature) == bpy_types.Object
+  #
+  # Evaluate the scene once for each frame in the given map, as built by
+  # __sampleActionDirectly, and record the local transform of each listed
+  # bone. Evaluating the scene is by far the most expensive part of the
+  # export, so this is done frame-major rather than once per keyframe per
+  # curve, and once for all of the armatures that share the action rather
+  # than once per armature. Fractional frames, as used by baked actions,
+  # are evaluated as subframes.
+  #
+
+  def __sampleScene(self, action, frames):
     assert type(action) == bpy.types.Action
-    assert armature.type == 'ARMATURE'
-    assert type(bone_name) == str
+    assert type(frames) == type({})
+
+    self.__log("[%s] __sampleScene: %d unique frames evaluated by the scene", action.name, len(frames))
+
+    frame_set_seconds     = 0.0
+    decomposition_seconds = 0.0
+    decomposition_count   = 0
+    for index in sorted(frames.keys()):
+      frame = int(math.floor(index))
+      time_start = time.perf_counter()
+      bpy.context.scene.frame_set(frame, subframe=index - frame)
+      time_set = time.perf_counter()
+      frame_set_seconds += time_set - time_start
+
+      for armature, bone_name, bone_samples in frames[index]:
+        bone = armature.pose.bones[bone_name]
+        assert type(bone) == bpy_types.PoseBone
+
+        matrix = bone.matrix_basis.copy()
+        bone_samples[index] = (matrix.to_translation(), matrix.to_quaternion(), matrix.to_scale())
+      #endfor
+      decomposition_seconds += time.perf_counter() - time_set
+      decomposition_count   += len(frames[index])
+    #endfor
 
-    group_name = 'pose.bones["%s"].rotation_quaternion' % bone_name
-    group_channels      = {}
-    group_channels["W"] = action.fcurves.find(group_name, 0)
-    group_channels["X"] = action.fcurves.find(group_name, 1)
-    group_channels["Y"] = action.fcurves.find(group_name, 2)
-    group_channels["Z"] = action.fcurves.find(group_name, 3)
+    self.__profiler.addTime("frame_set", frame_set_seconds, len(frames))
+    self.__profiler.addTime("matrix_decomposition", decomposition_seconds, decomposition_count)
+  #end
 
-    frames = self.__calculateKeyframesForCurves(action, group_name, group_channels)
+  #
+  # Transform all of the samples of an action, as calculated by
+  # __sampleActionDirectly and __sampleScene, to the exported coordinate
+  # system in a single pass. The result maps bone names to maps of frames
+  # to (translation, orientation, scale) tuples of exported values, so that
+  # each sample is converted once however many curves use it.
+  #
 
-    if frames == None:
-      return
-    #endif
+  __sample_slots = {
+    "translation" : 0,
+    "orientation" : 1,
+    "scale"       : 2
+  }
+
+  def __transformSamplesToExport(self, samples):
+    assert type(samples) == type({})
+
+    time_start = time.perf_counter()
+    count      = 0
+    converted  = {}
+    for bone_name, bone_samples in samples.items():
+      bone_converted = {}
+      for index, (translation, orientation, scale) in bone_samples.items():
+        bone_converted[index] = (
+          self.__transformTranslationToExport(translation),
+          self.__transformOrientationToExport(orientation),
+          self.__transformScaleToExport(scale))
+      #endfor
+      converted[bone_name] = bone_converted
+      count += len(bone_converted)
+    #endfor
 
-    frames_count = len(frames)
-    self.__log("action[%s]: orientation frame count: %d", action.name, frames_count)
-    if frames_count > 0:
-      out_file.write("    [curve\n")
-      out_file.write("      [curve-bone \"%s\"]\n" % bone_name)
-      out_file.write("      [curve-type orientation]\n")
-      out_file.write("      [curve-keyframes\n")
+    self.__profiler.addTime("coordinate_conversion", time.perf_counter() - time_start, count)
+    return converted
+  #end
 
-      assert bone_name in armature.pose.bones, "No bone %s in armature" % bone_name
-      bone = armature.pose.bones[bone_name]
-      assert type(bone) == bpy_types.PoseBone
-
-      for index in sorted(frames.keys()):
-        assert type(index) == int
-        frame = frames[index]
-        assert type(frame) == CalciumKeyframe
-
-        bpy.context.scene.frame_set(index)
-
-        value = self.__transformOrientationToExport(bone.matrix_basis.to_quaternion())
-        out_file.write("        [curve-keyframe\n")
-        out_file.write("          [curve-keyframe-index %d]\n" % index)
-        out_file.write("          [curve-keyframe-interpolation \"%s\"]\n" % frame.interpolation)
-        out_file.write("          [curve-keyframe-easing \"%s\"]\n" % frame.easing)
-        out_file.write("          [curve-keyframe-quaternion-xyzw %f %f %f %f]]\n" % (value.x, value.y, value.z, value.w))
-      #end
+  #
+  # Build all of the validated curves of the given action from the samples
+  # calculated by __sampleActionDirectly and __sampleScene.
+  #
+
+  def __calculateAction(self, armature, action, curves_by_bone, samples):
+    assert type(armature) == bpy_types.Object
+    assert type(action) == bpy.types.Action
+    assert armature.type == 'ARMATURE'
+    assert type(curves_by_bone) == type({})
+    assert type(samples) == type({})
+
+    converted = self.__transformSamplesToExport(samples)
+    curves    = []
+    for pose_bone in self.__exportedBones(armature):
+      bone_name = pose_bone.name
+      if not (bone_name in curves_by_bone):
+        continue
+      #endif
+
+      bone_curves  = curves_by_bone[bone_name]
+      bone_samples = converted[bone_name]
+
+      for curve_type, curve_property, channel_names in self.__curve_groups:
+        if not (curve_type in bone_curves):
+          continue
+        #endif
+
+        frames = bone_curves[curve_type]
+        self.__log("action[%s]: %s frame count: %d", action.name, curve_type, len(frames))
+        if len(frames) == 0:
+          continue
+        #endif
+
+        slot    = self.__sample_slots[curve_type]
+        builder = CalciumCurveBuilder(bone_name, curve_type)
+        for index in sorted(frames.keys()):
+          assert type(index) == int
+          interpolation, easing = frames[index]
+          builder.append(index, interpolation, easing, bone_samples[index][slot])
+        #endfor
 
-      out_file.write("    ]]\n")
-      out_file.write("\n")
+        curves.append(builder.build())
+      #endfor
+    #endfor
+
+    result = CalciumAction(action.name, int(action.frame_range.y - action.frame_range.x), curves)
+    if self.__reduce_keyframes:
+      with self.__profiler.phase("keyframe_reduction"):
+        result, report = reduce.reduceAction(result, self.__reduction_tolerances)
+      #endwith
+      self.__reduction_reports.append((armature.name, action.name, report))
     #endif
+    if self.__collapse_constant_curves or self.__omit_rest_pose_curves:
+      result, collapsed, omitted = reduce.simplifyAction(result, self.__collapse_constant_curves, self.__omit_rest_pose_curves)
+      self.__profiler.count("curves_collapsed", collapsed)
+      self.__profiler.count("curves_omitted", omitted)
+      self.__log("action[%s]: %d constant curves collapsed, %d rest pose curves omitted", action.name, collapsed, omitted)
+    #endif
+    return result
   #end
 
-  def __writeArmature(self, out_file, armature):
+  #
+  # Build the baked tracks of the given action from the samples calculated
+  # by __sampleActionDirectly and __sampleScene. The tracks are frame-major,
+  # and the bones of each frame are in the order in which they are
+  # exported.
+  #
+
+  def __calculateBakedAction(self, armature, action, samples):
     assert type(armature) == bpy_types.Object
+    assert type(action) == bpy.types.Action
     assert armature.type == 'ARMATURE'
-    self.__log("__writeArmature: %s", armature.name)
+    assert type(samples) == type({})
+
+    converted    = self.__transformSamplesToExport(samples)
+    times        = self.__bakeTimes(action)
+    pose_bones   = self.__exportedBones(armature)
+    translations = array.array('d')
+    orientations = array.array('d')
+    scales       = array.array('d')
+    for time_index in times:
+      for pose_bone in pose_bones:
+        translation, orientation, scale = converted[pose_bone.name][time_index]
+        translations.extend(translation)
+        orientations.extend(orientation)
+        scales.extend(scale)
+      #endfor
+    #endfor
 
-    out_file.write("[skeleton\n")
-    out_file.write("  [skeleton-name \"%s\"]\n" % armature.name)
-    out_file.write("  [skeleton-bones\n")
+    self.__log("action[%s]: baked %d samples of %d bones", action.name, len(times), len(pose_bones))
+    return CalciumBakedAction(
+      action.name,
+      int(action.frame_range.y - action.frame_range.x),
+      self.__bakeRate(),
+      len(times),
+      len(pose_bones),
+      translations,
+      orientations,
+      scales)
+  #end
 
-    for pose_bone in armature.pose.bones:
-      assert type(pose_bone) == bpy_types.PoseBone
-      bone = pose_bone.bone
-      assert type(bone) == bpy_types.Bone
+  #
+  # The values of the properties of the given Blender struct, for hashing.
+  # Nested structs and collections are included down to the given depth.
+  # Data-blocks are identified by name, and objects also by their current
+  # world transform, since constraints and drivers may depend on it.
+  #
 
-      #
-      # The matrix_local field of each bone is relative to the origin
-      # of the armature. To retrieve a parent-relative matrix, it's
-      # necessary to multiply the bone's matrix by the inverse of its
-      # parent matrix.
-      #
+  def __propertyValues(self, struct, depth):
+    values = []
+    for prop in struct.bl_rna.properties:
+      identifier = prop.identifier
+      if identifier == "rna_type":
+        continue
+      #endif
 
-      if bone.parent:
-        mat = bone.matrix_local * bone.parent.matrix_local.inverted()
+      value = getattr(struct, identifier, None)
+      if prop.type == 'POINTER':
+        if value == None:
+          values.append((identifier, None))
+        elif isinstance(value, bpy.types.Object):
+          values.append((identifier, value.name, tuple(tuple(row) for row in value.matrix_world)))
+        elif isinstance(value, bpy.types.ID):
+          values.append((identifier, value.name))
+        elif depth > 0:
+          values.append((identifier, self.__propertyValues(value, depth - 1)))
+        #endif
+      elif prop.type == 'COLLECTION':
+        if depth > 0:
+          values.append((identifier, [self.__propertyValues(item, depth - 1) for item in value]))
+        #endif
+      elif type(value) in [bool, int, float, str]:
+        values.append((identifier, value))
+      elif type(value) == set:
+        values.append((identifier, tuple(sorted(value))))
       else:
-        mat = bone.matrix_local
+        values.append((identifier, tuple(value)))
       #endif
+    #endfor
+    return values
+  #end
 
-      bone_trans  = self.__transformTranslationToExport(mat.to_translation())
-      bone_scale  = self.__transformScaleToExport(mat.to_scale())
-      bone_orient = self.__transformOrientationToExport(bone.matrix.to_quaternion())
+  #
+  # Add an F-curve to the given hash: its data path, index and mute flag,
+  # the position, value, interpolation and easing of each keyframe, and
+  # the settings of each of its modifiers.
+  #
 
-      out_file.write("    [bone\n")
-      out_file.write("      [bone-name             \"%s\"]\n" % bone.name)
-      if bone.parent != None:
-        out_file.write("      [bone-parent           \"%s\"]\n" % bone.parent.name)
-      out_file.write("      [bone-translation      %f %f %f]\n" % (bone_trans.x, bone_trans.y, bone_trans.z))
-      out_file.write("      [bone-scale            %f %f %f]\n" % (bone_scale.x, bone_scale.y, bone_scale.z))
-      out_file.write("      [bone-orientation-xyzw %f %f %f %f]]\n" % (bone_orient.x, bone_orient.y, bone_orient.z, bone_orient.w))
-    #end
+  def __hashFCurve(self, digest, fcurve):
+    points = fcurve.keyframe_points
+    digest.update(repr((fcurve.data_path, fcurve.array_index, fcurve.mute, len(points))).encode("utf-8"))
+
+    coordinates = array.array('f', [0.0]) * (2 * len(points))
+    points.foreach_get("co", coordinates)
+    digest.update(coordinates.tobytes())
 
-    out_file.write("  ]\n")
-    out_file.write("]\n")
+    modes = []
+    for point in points:
+      modes.append((point.interpolation, point.easing))
+    #endfor
+    digest.update(repr(modes).encode("utf-8"))
+
+    for modifier in fcurve.modifiers:
+      digest.update(repr(self.__propertyValues(modifier, 1)).encode("utf-8"))
+    #endfor
   #end
 
-  def __writeActions(self, out_file, armature, actions):
-    assert type(out_file) == io.TextIOWrapper
-    assert type(actions) == bpy.types.bpy_prop_collection
+  #
+  # Calculate a hash of everything, other than the actions themselves,
+  # that affects the exported actions: the options, the frame rate of the
+  # scene, the rest pose of the armature, the current pose of each bone
+  # (which holds any channel that no curve animates), the constraints of
+  # the armature and its bones, and the drivers of the armature.
+  #
+
+  def __hashArmature(self, armature):
     assert type(armature) == bpy_types.Object
     assert armature.type == 'ARMATURE'
-    assert len(actions) > 0, "Must have at least one action"
 
-    try:
-      if armature.animation_data is not None:
-        self.__log("__writeActions: saving action %s", armature.animation_data.action)
-        saved_action = armature.animation_data.action
-      else:
-        self.__log("__writeActions: creating temporary animation data")
-        armature.animation_data_create()
+    options = []
+    for name, value in sorted(self.__options.items()):
+      if not (name in self.__options_not_hashed):
+        options.append((name, value))
       #endif
+    #endfor
 
-      for action in actions:
-        if action.name == 'poses':
-          continue
-        #endif
+    digest = hashlib.sha1()
+    digest.update(repr((CALCIUM_CACHE_VERSION, options, bpy.context.scene.render.fps, armature.name)).encode("utf-8"))
+    for pose_bone in armature.pose.bones:
+      bone = pose_bone.bone
+      parent_name = None
+      if bone.parent != None:
+        parent_name = bone.parent.name
+      #endif
+      matrix = tuple(tuple(row) for row in bone.matrix_local)
+      digest.update(repr((bone.name, parent_name, pose_bone.rotation_mode, matrix)).encode("utf-8"))
+
+      pose = (
+        tuple(pose_bone.location),
+        tuple(pose_bone.rotation_quaternion),
+        tuple(pose_bone.rotation_euler),
+        tuple(pose_bone.rotation_axis_angle),
+        tuple(pose_bone.scale))
+      digest.update(repr(pose).encode("utf-8"))
+
+      for constraint in pose_bone.constraints:
+        digest.update(repr(self.__propertyValues(constraint, 1)).encode("utf-8"))
+      #endfor
+    #endfor
 
-        self.__log("__writeActions: %s", action.name)
-        armature.animation_data.action = action
+    for constraint in armature.constraints:
+      digest.update(repr(self.__propertyValues(constraint, 1)).encode("utf-8"))
+    #endfor
 
-        out_file.write("[action\n")
-        out_file.write("  [action-name \"%s\"]\n" % action.name)
-        out_file.write("  [action-length %d]\n" % int(action.frame_range.y - action.frame_range.x))
-        out_file.write("  [curves\n")
-        out_file.write("\n")
+    #
+    # A driver is hashed with its variables and their targets.
+    #
 
-        for bone_name in armature.pose.bones.keys():
-          self.__writeBoneCurvesTranslation(out_file, armature, action, bone_name)
-          self.__writeBoneCurvesScale(out_file, armature, action, bone_name)
-          self.__writeBoneCurvesOrientation(out_file, armature, action, bone_name)
-        #end
+    if armature.animation_data != None:
+      for fcurve in armature.animation_data.drivers:
+        self.__hashFCurve(digest, fcurve)
+        digest.update(repr(self.__propertyValues(fcurve.driver, 2)).encode("utf-8"))
+      #endfor
+    #endif
+    return digest.hexdigest()
+  #end
 
-        out_file.write("]]\n")
-      #end
+  #
+  # Calculate a hash of the F-curve data of the given action.
+  #
 
-    finally:
-      if saved_action:
-        self.__log("__writeActions: restoring saved action %s", saved_action)
-        armature.animation_data.action = saved_action
-      else:
-        self.__log("__writeActions: clearing temporary animation data")
-        armature.animation_data_clear()
+  def __hashAction(self, armature_hash, action):
+    assert type(armature_hash) == str
+    assert type(action) == bpy.types.Action
+
+    digest = hashlib.sha1(armature_hash.encode("utf-8"))
+    digest.update(repr((action.name, tuple(action.frame_range))).encode("utf-8"))
+    for fcurve in action.fcurves:
+      self.__hashFCurve(digest, fcurve)
+    #endfor
+    return digest.hexdigest()
+  #end
+
+  #
+  # Find the bones of the armature whose channels are set by drivers, and
+  # whether anything other than the current action animates the armature,
+  # in which case no bone can be evaluated directly from the F-curves.
+  # Returns a (driven bones, reason) pair, where the reason is None if
+  # bones of the armature may be evaluated directly.
+  #
+
+  def __prepareEvaluation(self, armature):
+    assert type(armature) == bpy_types.Object
+    assert armature.type == 'ARMATURE'
+
+    animation_data = armature.animation_data
+
+    driven_bones = set()
+    for fcurve in animation_data.drivers:
+      parsed = self.__parseFCurvePath(fcurve.data_path)
+      if parsed != None and not fcurve.mute:
+        driven_bones.add(parsed[0])
       #endif
-    #endtry
+    #endfor
 
-    out_file.write("\n")
+    reason = None
+    if not self.__direct_evaluation:
+      reason = "direct evaluation is disabled"
+    elif animation_data.use_nla and any(not track.mute for track in animation_data.nla_tracks):
+      reason = "the armature has NLA tracks"
+    elif animation_data.action_influence != 1.0 or animation_data.action_blend_type != 'REPLACE':
+      reason = "the action is blended"
+    #endif
+    return (driven_bones, reason)
   #end
 
   #
-  # Export all of the weights for a given mesh.
+  # Calculate each of the given actions in turn for each of the given
+  # armatures, passing each result to the receiver as soon as it is
+  # available. This is a generator that yields once each action has been
+  # received for every armature. The current actions of the armatures and
+  # the current frame of the scene are restored when the generator
+  # finishes or is closed.
+  #
+  # The validated actions of each armature are given as returned by
+  # __validateActions, in the order of the armatures. Each action is made
+  # the current action of every armature that exports it at once, so the
+  # scene is evaluated once for each unique keyframe index of the action,
+  # however many armatures share it.
+  #
+  # The receiver is called with the position of the armature in the given
+  # list, the cache key of the action (or None if the cache is not used)
+  # and the calculated action. If the cache already holds the exported
+  # action, it is not calculated at all, and the receiver is called with
+  # None in place of the action. The actions of each armature are received
+  # in the order in which they were validated.
   #
 
-  def __writeMeshWeights(self, out_file, mesh):
-    assert type(out_file) == io.TextIOWrapper
-    assert type(mesh) == bpy_types.Object
-    assert mesh.type == 'MESH'
+  def __calculateActions(self, armatures, validated, receiver):
+    assert type(armatures) == list
+    assert type(validated) == list
+    assert len(armatures) == len(validated)
+
+    frame_saved   = bpy.context.scene.frame_current
+    saved_actions = []
+    try:
+      for armature in armatures:
+        assert type(armature) == bpy_types.Object
+        assert armature.type == 'ARMATURE'
 
-    self.__log("__writeMeshWeights: considering mesh %s for export", mesh.name)
+        if armature.animation_data is not None:
+          self.__log("__calculateActions: %s: saving action %s", armature.name, armature.animation_data.action)
+          saved_actions.append(armature.animation_data.action)
+        else:
+          self.__log("__calculateActions: %s: creating temporary animation data", armature.name)
+          armature.animation_data_create()
+          saved_actions.append(None)
+        #endif
+      #endfor
 
-    if len(mesh.vertex_groups) > 0:
-      self.__log("__writeMeshWeights: exporting mesh %s", mesh.name)
+      evaluations     = []
+      armature_hashes = []
+      for armature in armatures:
+        evaluations.append(self.__prepareEvaluation(armature))
+        if self.__cache != None:
+          armature_hashes.append(self.__hashArmature(armature))
+        else:
+          armature_hashes.append(None)
+        #endif
+      #endfor
 
-      out_file.write("[mesh\n")
-      out_file.write("  [mesh-name \"%s\"]\n" % mesh.name)
-      out_file.write("  [mesh-weight-arrays\n")
+      #
+      # Every armature validates the actions in the same order, so
+      # gathering the armatures of each action in the order in which the
+      # actions are first seen keeps the order of each armature.
+      #
 
-      vertices = mesh.data.vertices
-      vertex_count = len(vertices)
+      jobs = collections.OrderedDict()
+      for position, armature_validated in enumerate(validated):
+        for action, curves_by_bone in armature_validated:
+          jobs.setdefault(action.name, (action, []))[1].append((position, curves_by_bone))
+        #endfor
+      #endfor
 
-      for vertex_group in mesh.vertex_groups:
-        self.__log("__writeMeshWeights: exporting %d weights for bone %s", vertex_count, vertex_group.name)
+      for action, action_jobs in jobs.values():
+        results = []
+        pending = []
+        for position, curves_by_bone in action_jobs:
+          key = None
+          if self.__cache != None:
+            key = self.__hashAction(armature_hashes[position], action)
+            if self.__cache.contains(key):
+              self.__log("__calculateActions: %s: %s is unchanged, reusing the cached export", armatures[position].name, action.name)
+              self.__profiler.count("actions_cached", 1)
+              results.append((position, key, None))
+              continue
+            #endif
+          #endif
+          pending.append((position, key, curves_by_bone))
+        #endfor
 
-        out_file.write("      [mesh-weight-array\n")
-        out_file.write("        [mesh-weight-array-bone \"%s\"]\n" % vertex_group.name)
-        out_file.write("        [mesh-weight-array-values\n")
+        if len(pending) > 0:
+          self.__log("__calculateActions: %s (%d armatures)", action.name, len(pending))
+          with self.__profiler.phase("action_calculation"):
+            fcurve_index = self.__indexAction(action)
+            frames       = {}
+            sampled      = []
+            for position, key, curves_by_bone in pending:
+              armature = armatures[position]
+              armature.animation_data.action = action
+              indices_by_bone = self.__sampleIndices(armature, action, curves_by_bone)
+              samples = self.__sampleActionDirectly(armature, action, fcurve_index, indices_by_bone, evaluations[position], frames)
+              sampled.append((position, key, curves_by_bone, samples))
+            #endfor
+
+            self.__sampleScene(action, frames)
+
+            for position, key, curves_by_bone, samples in sampled:
+              if self.__sampling == "baked":
+                calculated = self.__calculateBakedAction(armatures[position], action, samples)
+              else:
+                calculated = self.__calculateAction(armatures[position], action, curves_by_bone, samples)
+              #endif
+              results.append((position, key, calculated))
+            #endfor
+          #endwith
+        #endif
 
-        for index in range (0, vertex_count):
-          out_file.write("          [mesh-weight-array-value %f]\n" % vertex_group.weight(index))
+        for position, key, calculated in sorted(results, key=lambda result: result[0]):
+          receiver(position, key, calculated)
         #endfor
+        yield
+      #endfor
 
-        out_file.write("        ]\n")
-        out_file.write("      ]\n")
+    finally:
+      for armature, saved_action in zip(armatures, saved_actions):
+        if saved_action:
+          self.__log("__calculateActions: %s: restoring saved action %s", armature.name, saved_action)
+          armature.animation_data.action = saved_action
+        else:
+          self.__log("__calculateActions: %s: clearing temporary animation data", armature.name)
+          armature.animation_data_clear()
+        #endif
       #endfor
+      bpy.context.scene.frame_set(frame_saved)
+    #endtry
+  #end
 
-      out_file.write("  ]\n")
-      out_file.write("]\n")
-    #endif
-  #endif
+  #
+  # The pose bones of the armature in the order in which they are exported.
+  # If bones are referred to by index, the bones are sorted so that every
+  # parent comes before its children: each root bone is followed by its
+  # descendants, depth first, and siblings keep their order in the
+  # armature. Otherwise, the bones are in the order of the armature.
+  #
 
-  def __writeFile(self, out_file, armature):
-    assert type(out_file) == io.TextIOWrapper
+  def __exportedBones(self, armature):
     assert type(armature) == bpy_types.Object
     assert armature.type == 'ARMATURE'
 
-    out_file.write("[version 1 0]\n")
-    out_file.write("[action-fps %d]\n" % bpy.context.scene.render.fps)
-
-    self.__writeArmature(out_file, armature)
+    pose_bones = list(armature.pose.bones)
+    if self.__bone_references == "names":
+      return pose_bones
+    #endif
 
-    for child in armature.children:
-      if child.type == 'MESH':
-        self.__writeMeshWeights(out_file, child)
+    roots    = []
+    children = {}
+    for pose_bone in pose_bones:
+      parent = pose_bone.bone.parent
+      if parent == None:
+        roots.append(pose_bone)
+      else:
+        children.setdefault(parent.name, []).append(pose_bone)
       #endif
     #endfor
 
-    if len(bpy.data.actions) > 0:
-      frame_saved = bpy.context.scene.frame_current
-      try:
-        self.__writeActions(out_file, armature, bpy.data.actions)
-      finally:
-        bpy.context.scene.frame_set(frame_saved)
-      #endtry
-    #endif
+    ordered = []
+    pending = list(reversed(roots))
+    while len(pending) > 0:
+      pose_bone = pending.pop()
+      ordered.append(pose_bone)
+      pending.extend(reversed(children.get(pose_bone.name, [])))
+    #endwhile
+
+    assert len(ordered) == len(pose_bones)
+    return ordered
   #end
 
-  def __writeErrorLog(self, error_file, error_path, armature):
-    assert type(error_file) == io.TextIOWrapper
-    assert type(error_path) == str
+  def __calculateArmature(self, armature):
     assert type(armature) == bpy_types.Object
     assert armature.type == 'ARMATURE'
+    self.__log("__calculateArmature: %s", armature.name)
 
-    t = datetime.datetime.now()
-    error_file.write("Export of %s on %s\n" % (armature.name, t.isoformat()))
-    error_file.write("\n")
+    bones = []
+    for pose_bone in self.__exportedBones(armature):
+      assert type(pose_bone) == bpy_types.PoseBone
+      bone = pose_bone.bone
+      assert type(bone) == bpy_types.Bone
 
-    if len(self.__errors) > 0:
-      for error in self.__errors:
-        error_file.write("%s\n" % error)
+      #
+      # The matrix_local field of each bone is relative to the origin
+      # of the armature. To retrieve a parent-relative matrix, it's
+      # necessary to multiply the bone's matrix by the inverse of its
+      # parent matrix.
+      #
+
+      if bone.parent:
+        mat = bone.matrix_local * bone.parent.matrix_local.inverted()
+        parent_name = bone.parent.name
+      else:
+        mat = bone.matrix_local
+        parent_name = None
+      #endif
+
+      bone_trans  = self.__transformTranslationToExport(mat.to_translation())
+      bone_scale  = self.__transformScaleToExport(mat.to_scale())
+      bone_orient = self.__transformOrientationToExport(bone.matrix.to_quaternion())
+
+      bones.append(CalciumBone(bone.name, parent_name, bone_trans, bone_scale, bone_orient))
+    #end
+
+    return CalciumSkeleton(armature.name, bones)
+  #end
+
+  #
+  # Collect all of the weights for a given mesh in a single pass over the
+  # vertices. Each vertex only lists the groups that it actually belongs to,
+  # so the resulting weight arrays are sparse. Meshes without vertex groups
+  # are not exported, and None is returned for them.
+  #
+  # If influences are exported, the weight arrays are reduced to influences
+  # of the given deforming bones, and are not themselves exported.
+  #
+
+  def __calculateMesh(self, mesh, bone_indices):
+    assert type(mesh) == bpy_types.Object
+    assert mesh.type == 'MESH'
+    assert type(bone_indices) == type({})
+
+    self.__log("__calculateMesh: considering mesh %s for export", mesh.name)
+
+    group_count = len(mesh.vertex_groups)
+    if group_count == 0:
+      return None
+    #endif
+
+    group_indices = []
+    group_weights = []
+    for group_index in range(0, group_count):
+      group_indices.append(array.array('I'))
+      group_weights.append(array.array('f'))
+    #endfor
+
+    for vertex in mesh.data.vertices:
+      vertex_index = vertex.index
+      for element in vertex.groups:
+        group_index = element.group
+        if group_index < group_count:
+          group_indices[group_index].append(vertex_index)
+          group_weights[group_index].append(element.weight)
+        #endif
       #endfor
+    #endfor
 
-      error_file.write("\n")
-      error_file.write("Export failed with %d errors.\n" % len(self.__errors))
-      raise CalciumExportFailed("Exporting failed due to errors.\nSee the log file at: %s" % error_path)
-    else:
-      error_file.write("Exported successfully.\n")
+    weight_arrays = []
+    for vertex_group in mesh.vertex_groups:
+      weight_arrays.append(CalciumWeightArray(
+        vertex_group.name,
+        group_indices[vertex_group.index],
+        group_weights[vertex_group.index]))
+    #endfor
+
+    result = CalciumMesh(mesh.name, len(mesh.data.vertices), weight_arrays, None)
+    if self.__weight_layout == "influences":
+      result.influences = influences.calculateInfluences(
+        result, bone_indices, self.__influence_count, self.__influence_quantization)
+      result.weight_arrays = []
     #endif
+    return result
   #end
 
-  def write(self, path):
-    assert type(path) == str
-    error_path = path + ".log"
+  #
+  # The child meshes of the armature whose weights are exported.
+  #
 
-    self.__errors = []
+  def __meshChildren(self, armature):
+    assert type(armature) == bpy_types.Object
+    assert armature.type == 'ARMATURE'
 
-    armature = False
-    if len(bpy.context.selected_objects) > 0:
-      for obj in bpy.context.selected_objects:
-        if obj.type == 'ARMATURE':
-          if armature:
-            raise CalciumTooManyArmaturesSelected("Too many armatures selected: At most one of the selected objects can be an armature when exporting")
-          #endif
-          armature = obj
+    children = []
+    if self.__export_child_mesh_weights:
+      for child in armature.children:
+        if child.type == 'MESH':
+          children.append(child)
         #endif
       #endfor
     #endif
+    return children
+  #end
 
-    if False == armature:
-      raise CalciumNoArmatureSelected("No armatures selected: An armature object must be selected for export")
-    #endif
+  #
+  # Calculate the weights of each child mesh of the armature in turn. This
+  # is a generator that yields each calculated mesh, or None for a mesh
+  # that is not exported, so that callers can make progress one mesh at a
+  # time.
+  #
 
+  def __calculateMeshes(self, armature):
     assert type(armature) == bpy_types.Object
     assert armature.type == 'ARMATURE'
 
-    self.__log("opening: %s", path)
-    with open(path, "wt") as out_file:
-      self.__log("opening: %s", error_path)
-      with open(error_path, "wt") as error_file:
-        self.__writeFile(out_file, armature)
-        self.__writeErrorLog(error_file, error_path, armature)
+    #
+    # Influences refer to bones by their index in the skeleton, and only
+    # deforming bones are allowed to influence vertices.
+    #
+
+    bone_indices = {}
+    for bone_index, pose_bone in enumerate(self.__exportedBones(armature)):
+      if pose_bone.bone.use_deform:
+        bone_indices[pose_bone.name] = bone_index
+      #endif
+    #endfor
+
+    for child in self.__meshChildren(armature):
+      with self.__profiler.phase("weight_extraction"):
+        mesh = self.__calculateMesh(child, bone_indices)
       #endwith
-    #endwith
+      if mesh != None:
+        self.__profiler.count("meshes", 1)
+        self.__profiler.count("vertices", mesh.vertex_count)
+      #endif
+      yield mesh
+    #endfor
+  #end
+
+  #
+  # The number of workers to use for formatting and for writing outputs.
+  #
+
+  def __workerCount(self):
+    worker_count = self.__worker_count
+    if worker_count == 0:
+      worker_count = os.cpu_count() or 1
+    #endif
+    return worker_count
+  #end
+
+  #
+  # Create a pool of worker processes for formatting, or return None if
+  # formatting should happen on the calling thread. Workers are always
+  # forked from the current process, and so are only used on Linux: the
+  # default "spawn" start method of other systems would start a new
+  # Blender for each worker and import the add-on, and therefore bpy,
+  # again. Python versions before 3.7 cannot be given a start method, but
+  # always fork on Linux.
+  #
+
+  def __createWorkerPool(self):
+    worker_count = self.__workerCount()
+    if worker_count <= 1 or not sys.platform.startswith("linux"):
+      self.__log("formatting on the main thread")
+      return None
+    #endif
+
+    self.__log("formatting with %d worker processes", worker_count)
+    if sys.version_info >= (3, 7):
+      return concurrent.futures.ProcessPoolExecutor(max_workers=worker_count, mp_context=multiprocessing.get_context("fork"))
+    #endif
+    return concurrent.futures.ProcessPoolExecutor(max_workers=worker_count)
+  #end
+
+  #
+  # Export the text format. Each armature is written to the output file at
+  # the same position in the given list. Data is extracted from Blender on
+  # the calling thread, and each extracted mesh and action is then
+  # formatted in the worker pool while extraction continues.
+  #
+  # This, like __writeFileBinary and __writeFormat, is a generator that
+  # yields once for each mesh and once for each action.
+  #
+
+  def __writeFile(self, out_files, armatures, validated, contents):
+    assert type(out_files) == list
+    assert type(armatures) == list
+    assert type(validated) == list
+    assert type(contents) == list
+    assert len(out_files) == len(armatures)
+    assert len(contents) == len(armatures)
+
+    profiler    = self.__profiler
+    formatters  = []
+    serializers = []
+    for out_file, armature in zip(out_files, armatures):
+      assert isinstance(out_file, io.TextIOBase)
+      assert type(armature) == bpy_types.Object
+      assert armature.type == 'ARMATURE'
+
+      with profiler.phase("skeleton"):
+        skeleton = self.__calculateArmature(armature)
+      #endwith
+
+      bone_indices = None
+      if self.__bone_references == "indices":
+        bone_indices = {}
+        for bone_index, bone in enumerate(skeleton.bones):
+          bone_indices[bone.name] = bone_index
+        #endfor
+      #endif
+
+      formatter  = text.CalciumTextFormatter(self.__float_precision, bone_indices, self.__sampling == "baked", self.__share_curves)
+      serializer = text.CalciumTextSerializer(out_file, formatter, self.__buffer_size, profiler, self.__write_index)
+      serializer.writeHeader(bpy.context.scene.render.fps)
+      profiler.addBytes("header", serializer.length())
+
+      length = serializer.length()
+      with profiler.phase("formatting"):
+        serializer.writeSkeleton(skeleton)
+      #endwith
+      profiler.addBytes("skeleton", serializer.length() - length)
+      if self.__write_index:
+        contents[len(serializers)].setSkeleton(serializer.lastSpan(), skeletonCounts(skeleton))
+      #endif
+      formatters.append(formatter)
+      serializers.append(serializer)
+    #endfor
+
+    #
+    # If curves are shared, the curves of each armature are collected by
+    # hash as its actions are received, and written after the actions. The
+    # cache holds the formatted text of each action along with its shared
+    # curves and its counts for the index.
+    #
+
+    shared_curves = []
+    for armature in armatures:
+      shared_curves.append(collections.OrderedDict())
+    #endfor
+
+    def shareCurves(position, curves):
+      for curve in curves:
+        curve_hash = curve.keyframesHash()
+        if curve_hash in shared_curves[position]:
+          profiler.count("curves_shared", 1)
+        else:
+          shared_curves[position][curve_hash] = curve
+        #endif
+      #endfor
+    #end
+
+    #
+    # Formatting may happen in the worker pool, so the formatting phase is
+    # the time that the exporter spends formatting or waiting for
+    # formatted elements. The sizes and spans of meshes and actions are
+    # recorded as they are written.
+    #
+
+    def meshReceiver(position, counts):
+      def receiveMesh(formatted):
+        profiler.addBytes("meshes", len(formatted))
+        if self.__write_index:
+          contents[position].addMesh(serializers[position].lastSpan(), counts)
+        #endif
+      #end
+      return receiveMesh
+    #end
+
+    pool = self.__createWorkerPool()
+    try:
+      format_queues = []
+      for serializer in serializers:
+        format_queues.append(text.CalciumTextFormatQueue(serializer, pool))
+      #endfor
+
+      for position, armature in enumerate(armatures):
+        for mesh in self.__calculateMeshes(armature):
+          if mesh != None:
+            with profiler.phase("formatting"):
+              format_queues[position].submit(formatters[position].formatMesh, mesh, meshReceiver(position, meshCounts(mesh)))
+            #endwith
+          #endif
+          yield
+        #endfor
+      #endfor
+
+      def receiveFormattedAction(position, key, formatted, curves, counts):
+        profiler.addBytes("actions", len(formatted))
+        if self.__write_index:
+          contents[position].addAction(serializers[position].lastSpan(), counts)
+        #endif
+        if key != None:
+          self.__cache.put(key, (formatted, curves, counts))
+        #endif
+      #end
+
+      def receiveAction(position, key, action):
+        format_queue = format_queues[position]
+        formatter    = formatters[position]
+        with profiler.phase("formatting"):
+          if action == None:
+            formatted, curves, counts = self.__cache.get(key)
+            shareCurves(position, curves)
+            format_queue.submitText(formatted, lambda formatted: receiveFormattedAction(position, None, formatted, curves, counts))
+          else:
+            curves = []
+            if self.__share_curves and type(action) == CalciumAction:
+              curves = action.curves
+              shareCurves(position, curves)
+            #endif
+            counts = actionCounts(action)
+            format_queue.submit(formatter.formatAction, action, lambda formatted: receiveFormattedAction(position, key, formatted, curves, counts))
+          #endif
+        #endwith
+      #end
+
+      def sharedCurvesReceiver(position, counts):
+        def receiveSharedCurves(formatted):
+          profiler.addBytes("shared_curves", len(formatted))
+          if self.__write_index:
+            contents[position].setSharedCurves(serializers[position].lastSpan(), counts)
+          #endif
+        #end
+        return receiveSharedCurves
+      #end
+
+      if any(len(armature_validated) > 0 for armature_validated in validated):
+        yield from self.__calculateActions(armatures, validated, receiveAction)
+      #endif
+
+      with profiler.phase("formatting"):
+        for position, (format_queue, serializer) in enumerate(zip(format_queues, serializers)):
+          if len(bpy.data.actions) > 0:
+            format_queue.drain(True)
+            serializer.writeActionsEnd()
+          #endif
+
+          if self.__share_curves:
+            curves = list(shared_curves[position].values())
+            format_queue.submit(formatters[position].formatSharedCurves, curves, sharedCurvesReceiver(position, curvesCounts(curves)))
+          #endif
+
+          format_queue.drain(True)
+        #endfor
+      #endwith
+    finally:
+      if pool != None:
+        pool.shutdown()
+      #endif
+    #endtry
+
+    for position, serializer in enumerate(serializers):
+      serializer.flush()
+      if self.__write_index:
+        contents[position].setLength(serializer.octets())
+      #endif
+    #endfor
+  #end
+
+  def __writeFileBinary(self, out_files, armatures, validated, contents):
+    assert type(out_files) == list
+    assert type(armatures) == list
+    assert type(validated) == list
+    assert type(contents) == list
+    assert len(out_files) == len(armatures)
+    assert len(contents) == len(armatures)
+
+    skeletons = []
+    meshes    = []
+    actions   = []
+    for out_file, armature in zip(out_files, armatures):
+      assert isinstance(out_file, io.BufferedIOBase)
+      assert type(armature) == bpy_types.Object
+      assert armature.type == 'ARMATURE'
+
+      with self.__profiler.phase("skeleton"):
+        skeletons.append(self.__calculateArmature(armature))
+      #endwith
+
+      armature_meshes = []
+      for mesh in self.__calculateMeshes(armature):
+        if mesh != None:
+          armature_meshes.append(mesh)
+        #endif
+        yield
+      #endfor
+      meshes.append(armature_meshes)
+      actions.append([])
+    #endfor
+
+    def receiveAction(position, key, action):
+      if action == None:
+        action = self.__cache.get(key)
+      elif key != None:
+        self.__cache.put(key, action)
+      #endif
+      actions[position].append(action)
+    #end
+
+    if any(len(armature_validated) > 0 for armature_validated in validated):
+      yield from self.__calculateActions(armatures, validated, receiveAction)
+    #endif
+
+    for position, out_file in enumerate(out_files):
+      writer = binary.CalciumBinaryWriter(out_file, self.__curve_encoding, self.__bone_references, self.__share_curves, self.__profiler, contents[position])
+      writer.write(bpy.context.scene.render.fps, skeletons[position], meshes[position], actions[position])
+      if self.__curve_encoding != "float":
+        for report in writer.curveReports():
+          self.__curve_reports.append((armatures[position].name,) + report)
+        #endfor
+      #endif
+    #endfor
+  #end
+
+  def __writeFormat(self, out_files, armatures, validated, contents):
+    if self.__format == "binary":
+      yield from self.__writeFileBinary(out_files, armatures, validated, contents)
+    else:
+      yield from self.__writeFile(out_files, armatures, validated, contents)
+    #endif
+  #end
+
+  #
+  # The contents of each of the given armatures, if a table of contents is
+  # written.
+  #
+
+  def __contents(self, armatures):
+    contents = []
+    for armature in armatures:
+      if self.__write_index:
+        contents.append(CalciumContents(armature.name))
+      else:
+        contents.append(None)
+      #endif
+    #endfor
+    return contents
+  #end
+
+  def __writeIndex(self, path, contents, starts):
+    index_path = path + ".idx"
+    self.__log("writing index: %s", index_path)
+    writeIndex(index_path, self.__format, self.__compression, contents, starts)
+  #end
+
+  #
+  # Open the output file, compressing the data as it is written if
+  # compression is enabled. No uncompressed copy is ever written. Text is
+  # always written as UTF-8 with "\n" line endings, so that the offsets in
+  # the table of contents hold on every platform.
+  #
+
+  def __openOutput(self, path, mode):
+    assert type(path) == str
+    if mode == "wt":
+      if self.__compression == "gzip":
+        return gzip.open(path, mode, compresslevel=self.__compression_level, encoding="utf-8", newline="\n")
+      #endif
+      if self.__compression == "xz":
+        return lzma.open(path, mode, preset=self.__compression_level, encoding="utf-8", newline="\n")
+      #endif
+      return open(path, mode, encoding="utf-8", newline="\n")
+    #endif
+    if self.__compression == "gzip":
+      return gzip.open(path, mode, compresslevel=self.__compression_level)
+    #endif
+    if self.__compression == "xz":
+      return lzma.open(path, mode, preset=self.__compression_level)
+    #endif
+    return open(path, mode)
+  #end
+
+  def __saveCache(self):
+    if self.__cache != None:
+      with self.__profiler.phase("cache_save"):
+        self.__cache.save()
+      #endwith
+    #endif
+  #end
+
+  #
+  # Write the log of the export of the given armatures. If any errors were
+  # recorded for them, the export fails.
+  #
+
+  def __writeErrorLog(self, error_file, error_path, armatures):
+    assert type(error_file) == io.TextIOWrapper
+    assert type(error_path) == str
+    assert type(armatures) == list
+
+    names = []
+    for armature in armatures:
+      assert type(armature) == bpy_types.Object
+      assert armature.type == 'ARMATURE'
+      names.append(armature.name)
+    #endfor
+
+    #
+    # A log of several armatures names the armature of each action.
+    #
+
+    def actionName(armature_name, action_name):
+      if len(names) > 1:
+        return "%s:%s" % (armature_name, action_name)
+      #endif
+      return action_name
+    #end
+
+    t = datetime.datetime.now()
+    error_file.write("Export of %s on %s\n" % (", ".join(names), t.isoformat()))
+    error_file.write("\n")
+
+    evaluation_paths = [entry for entry in self.__evaluation_paths if entry[0] in names]
+    for armature_name, action_name, direct_bones, scene_bones in evaluation_paths:
+      error_file.write("Action %s: %d bones evaluated from F-curves, %d bones evaluated by the scene\n" % (actionName(armature_name, action_name), len(direct_bones), len(scene_bones)))
+      for bone_name, reason in scene_bones:
+        error_file.write("  %s: %s\n" % (bone_name, reason))
+      #endfor
+    #endfor
+    if len(evaluation_paths) > 0:
+      error_file.write("\n")
+    #endif
+
+    reduction_reports = [entry for entry in self.__reduction_reports if entry[0] in names]
+    for armature_name, action_name, report in reduction_reports:
+      error_file.write("Action %s: keyframe reduction\n" % actionName(armature_name, action_name))
+      for curve_type, (before, after, maximum) in sorted(report.items()):
+        error_file.write("  %s: %d of %d keyframes kept, maximum error %f\n" % (curve_type, after, before, maximum))
+      #endfor
+    #endfor
+    if len(reduction_reports) > 0:
+      error_file.write("\n")
+    #endif
+
+    curve_reports = [entry for entry in self.__curve_reports if entry[0] in names]
+    for armature_name, action_name, bone_name, curve_type, encoding, error in curve_reports:
+      error_file.write("Action %s: %s %s: %s, maximum error %f\n" % (actionName(armature_name, action_name), bone_name, curve_type, encoding, error))
+    #endfor
+    if len(curve_reports) > 0:
+      error_file.write("\n")
+    #endif
+
+    errors = []
+    for armature_name, error in self.__errors:
+      if armature_name in names:
+        if len(names) > 1:
+          error = "Armature %s: %s" % (armature_name, error)
+        #endif
+        errors.append(error)
+      #endif
+    #endfor
+    if len(errors) > 0:
+      for error in errors:
+        error_file.write("%s\n" % error)
+      #endfor
+
+      error_file.write("\n")
+      error_file.write("Export failed with %d errors.\n" % len(errors))
+      raise CalciumExportFailed("Exporting failed due to errors.\nSee the log file at: %s" % error_path)
+    else:
+      error_file.write("Exported successfully.\n")
+    #endif
+  #end
+
+  #
+  # The selected armatures, ordered by name.
+  #
+
+  def __selectedArmatures(self):
+    armatures = []
+    for obj in bpy.context.selected_objects:
+      if obj.type == 'ARMATURE':
+        armatures.append(obj)
+      #endif
+    #endfor
+
+    if len(armatures) == 0:
+      raise CalciumNoArmatureSelected("No armatures selected: An armature object must be selected for export")
+    #endif
+
+    return sorted(armatures, key=lambda armature: armature.name)
+  #end
+
+  #
+  # The file to which the given armature is written when several armatures
+  # are written to separate files: the name of the armature is added to
+  # the name of the given file, before its first extension.
+  #
+
+  def __armaturePath(self, path, armature):
+    directory, name = os.path.split(path)
+    stem, dot, extension = name.partition(".")
+    armature_name = re.sub(r'[^\w.-]', "_", armature.name)
+    return os.path.join(directory, "%s-%s%s%s" % (stem, armature_name, dot, extension))
+  #end
+
+  def write(self, path):
+    assert type(path) == str
+    self.writeArmatures(path, self.__selectedArmatures())
+  #end
+
+  #
+  # Export the selected armatures in steps, as writeArmaturesInSteps does.
+  # The selection is checked immediately, rather than when the first step
+  # is taken.
+  #
+
+  def writeInSteps(self, path):
+    assert type(path) == str
+    return self.writeArmaturesInSteps(path, self.__selectedArmatures())
+  #end
+
+  #
+  # Validate the actions of the selected armatures without exporting
+  # anything, and return the list of errors. The scene is never evaluated.
+  #
+
+  def validate(self):
+    armatures = self.__selectedArmatures()
+    if len(armatures) == 1:
+      return self.validateArmature(armatures[0])
+    #endif
+
+    errors = []
+    for armature in armatures:
+      for error in self.validateArmature(armature):
+        errors.append("Armature %s: %s" % (armature.name, error))
+      #endfor
+    #endfor
+    return errors
+  #end
+
+  def validateArmature(self, armature):
+    assert type(armature) == bpy_types.Object
+    assert armature.type == 'ARMATURE'
+
+    self.__errors            = []
+    self.__evaluation_paths  = []
+    self.__reduction_reports = []
+    self.__curve_reports     = []
+    self.__fcurve_indices    = {}
+    self.__profiler          = profiling.CalciumProfiler(False)
+    self.__validateActions(armature, bpy.data.actions)
+    return [error for armature_name, error in self.__errors]
+  #end
+
+  #
+  # Export the given armature, regardless of the current selection. A
+  # profile of the export is written to a JSON file next to the log file,
+  # even if the export fails.
+  #
+
+  def writeArmature(self, path, armature):
+    assert type(armature) == bpy_types.Object
+    self.writeArmatures(path, [armature])
+  #end
+
+  #
+  # Export the given armatures, regardless of the current selection. A
+  # single armature is written to the given file. Several armatures are
+  # written to separate files named by __armaturePath, or one after the
+  # other to the given file, according to the multiple_armatures option.
+  # In both cases, the log, cache and profile files are named after the
+  # given file.
+  #
+
+  def writeArmatures(self, path, armatures):
+    for progress in self.writeArmaturesInSteps(path, armatures):
+      pass
+    #endfor
+  #end
+
+  #
+  # Export the given armatures, as writeArmatures does, one step at a time.
+  # This is a generator that yields a (completed steps, total steps) pair
+  # after each step of the export: each mesh, each action (calculated for
+  # every armature that exports it), and finally the writing of the
+  # output. Blender must not be used to change the scene between steps.
+  #
+  # Closing the generator before it finishes cancels the export: the
+  # current actions of the armatures and the current frame of the scene
+  # are restored, partially written output and log files are removed, and
+  # the cache is not saved. The profile is still written.
+  #
+
+  def writeArmaturesInSteps(self, path, armatures):
+    assert type(path) == str
+    assert type(armatures) == list
+    assert len(armatures) > 0
+    profile_path = path + ".profile.json"
+
+    self.__profiler = profiling.CalciumProfiler(self.__trace_memory)
+    if len(armatures) == 1:
+      self.__profiler.set("armature", armatures[0].name)
+    else:
+      self.__profiler.set("armatures", [armature.name for armature in armatures])
+      self.__profiler.set("multiple_armatures", self.__multiple_armatures)
+    #endif
+    self.__profiler.set("format", self.__format)
+    self.__profiler.set("compression", self.__compression)
+    try:
+      with self.__profiler.phase("export"):
+        yield from self.__writeArmatures(path, armatures)
+      #endwith
+    except GeneratorExit:
+      self.__log("export cancelled")
+      self.__profiler.set("cancelled", True)
+      raise
+    finally:
+      self.__log("writing profile: %s", profile_path)
+      self.__profiler.write(profile_path)
+    #endtry
+  #end
+
+  def __writeArmatures(self, path, armatures):
+    error_path = path + ".log"
+
+    self.__errors            = []
+    self.__evaluation_paths  = []
+    self.__reduction_reports = []
+    self.__curve_reports     = []
+    self.__fcurve_indices    = {}
+
+    for armature in armatures:
+      assert type(armature) == bpy_types.Object
+      assert armature.type == 'ARMATURE'
+    #endfor
+
+    #
+    # All actions are validated before anything is evaluated or written.
+    # If any are invalid, only the error log is written.
+    #
+
+    validated = []
+    for armature in armatures:
+      validated.append(self.__validateActions(armature, bpy.data.actions))
+    #endfor
+    if len(self.__errors) > 0:
+      self.__log("opening: %s", error_path)
+      with open(error_path, "wt") as error_file:
+        self.__writeErrorLog(error_file, error_path, armatures)
+      #endwith
+    #endif
+
+    self.__cache = None
+    if self.__use_cache:
+      cache_path = path + ".cache"
+      self.__cache = cache.CalciumExportCache(cache_path)
+      self.__log("cache: %s (%d entries)", cache_path, self.__cache.loadedCount())
+    #endif
+
+    #
+    # One step for each mesh, one for each action, whichever armatures
+    # export it, and one for the output.
+    #
+
+    steps = 1
+    action_names = set()
+    for armature, armature_validated in zip(armatures, validated):
+      steps += len(self.__meshChildren(armature))
+      for action, curves_by_bone in armature_validated:
+        action_names.add(action.name)
+      #endfor
+    #endfor
+    steps += len(action_names)
+
+    if len(armatures) > 1:
+      writing = self.__writeMultipleArmatures(path, armatures, validated)
+    else:
+      writing = self.__writeSingleArmature(path, armatures, validated)
+    #endif
+
+    #
+    # The writing generator is closed explicitly, so that a cancelled
+    # export removes its partial output and restores the scene before
+    # this generator returns, rather than whenever the writing generator
+    # happens to be collected.
+    #
+
+    completed = 0
+    try:
+      for step in writing:
+        completed += 1
+        yield (completed, steps)
+      #endfor
+    finally:
+      writing.close()
+    #endtry
+  #end
+
+  #
+  # Remove the partial output of a cancelled export.
+  #
+
+  def __removeOutput(self, paths):
+    for path in paths:
+      if os.path.exists(path):
+        self.__log("removing: %s", path)
+        os.remove(path)
+      #endif
+    #endfor
+  #end
+
+  #
+  # Write the given armatures to the given file, from the output thread if
+  # writes are asynchronous, which is only the case for text files. A
+  # write that fails on the output thread is recorded as an error of each
+  # of the armatures, so that it is reported in the log once the export
+  # has finished.
+  #
+
+  def __writeOutput(self, path, out_file, armatures, validated, contents):
+    if not self.__async_write:
+      yield from self.__writeFormat([out_file], armatures, validated, contents)
+      return
+    #endif
+
+    output_thread = CalciumOutputThread(out_file, self.__write_queue_size, self.__buffer_size)
+    try:
+      yield from self.__writeFormat([output_thread.file()], armatures, validated, contents)
+    except BaseException:
+      output_thread.finish(True)
+      raise
+    #endtry
+
+    with self.__profiler.phase("output_wait"):
+      failure = output_thread.finish(False)
+    #endwith
+    self.__profiler.addTime("output_thread", output_thread.seconds(), output_thread.blocks())
+
+    if failure != None:
+      for armature in armatures:
+        self.__errors.append((armature.name, "Writing %s failed: %s" % (path, failure)))
+      #endfor
+    #endif
+  #end
+
+  #
+  # Write a single armature, streaming it to its file as it is calculated.
+  #
+
+  def __writeSingleArmature(self, path, armatures, validated):
+    error_path = path + ".log"
+    contents   = self.__contents(armatures)
+
+    if self.__format == "binary":
+      mode = "wb"
+    else:
+      mode = "wt"
+    #endif
+
+    try:
+      self.__log("opening: %s", path)
+      with self.__openOutput(path, mode) as out_file:
+        self.__log("opening: %s", error_path)
+        with open(error_path, "wt") as error_file:
+          yield from self.__writeOutput(path, out_file, armatures, validated, contents)
+          self.__saveCache()
+          self.__writeErrorLog(error_file, error_path, armatures)
+        #endwith
+      #endwith
+    except GeneratorExit:
+      self.__removeOutput([path, error_path])
+      raise
+    #endtry
+
+    if self.__write_index:
+      self.__writeIndex(path, contents, [0])
+    #endif
+
+    self.__profiler.set("file_size", os.path.getsize(path))
+    yield
+  #end
+
+  #
+  # Write several armatures. Each armature is first written to a buffer in
+  # memory, so that the actions shared by the armatures are evaluated once
+  # for all of them. The buffers are then compressed and written to their
+  # files in parallel.
+  #
+  # A combined file holds the complete file of each armature in turn, in
+  # the order of the armatures. Each text file begins with its version, and
+  # each binary file records its own size in its header and is padded to
+  # the binary alignment, so that its offsets remain relative to its start.
+  #
+  # Nothing is written to disk until every armature has been calculated,
+  # so a cancelled export leaves no partial output.
+  #
+
+  def __writeMultipleArmatures(self, path, armatures, validated):
+    if self.__format == "binary":
+      buffers = [io.BytesIO() for armature in armatures]
+    else:
+      buffers = [io.StringIO() for armature in armatures]
+    #endif
+
+    contents = self.__contents(armatures)
+    yield from self.__writeFormat(buffers, armatures, validated, contents)
+    self.__saveCache()
+
+    outputs = []
+    if self.__multiple_armatures == "combined":
+      outputs.append((path, buffers, armatures, contents))
+    else:
+      paths = {}
+      for armature, buffer, armature_contents in zip(armatures, buffers, contents):
+        armature_path = self.__armaturePath(path, armature)
+        if armature_path in paths:
+          raise CalciumExportFailed("Armatures %s and %s would both be written to %s" % (paths[armature_path], armature.name, armature_path))
+        #endif
+        paths[armature_path] = armature.name
+        outputs.append((armature_path, [buffer], [armature], [armature_contents]))
+      #endfor
+    #endif
+
+    def writeOutput(output_path, output_buffers):
+      self.__log("opening: %s", output_path)
+      if self.__format == "binary":
+        with self.__openOutput(output_path, "wb") as out_file:
+          for buffer in output_buffers:
+            data = buffer.getvalue()
+            out_file.write(data)
+            if len(output_buffers) > 1:
+              out_file.write(bytes(-len(data) % binary.CALCIUM_BINARY_ALIGNMENT))
+            #endif
+          #endfor
+        #endwith
+      else:
+        with self.__openOutput(output_path, "wt") as out_file:
+          for buffer in output_buffers:
+            out_file.write(buffer.getvalue())
+          #endfor
+        #endwith
+      #endif
+      return os.path.getsize(output_path)
+    #end
+
+    file_size = 0
+    with self.__profiler.phase("output_write"):
+      with concurrent.futures.ThreadPoolExecutor(max_workers=self.__workerCount()) as executor:
+        futures = []
+        for output_path, output_buffers, output_armatures, output_contents in outputs:
+          futures.append(executor.submit(writeOutput, output_path, output_buffers))
+        #endfor
+        for future in futures:
+          file_size += future.result()
+        #endfor
+      #endwith
+    #endwith
+    self.__profiler.set("file_size", file_size)
+
+    for output_path, output_buffers, output_armatures, output_contents in outputs:
+      error_path = output_path + ".log"
+      self.__log("opening: %s", error_path)
+      with open(error_path, "wt") as error_file:
+        self.__writeErrorLog(error_file, error_path, output_armatures)
+      #endwith
+    #endfor
+
+    #
+    # The files of a combined file follow each other, with binary files
+    # padded to the binary alignment.
+    #
+
+    if self.__write_index:
+      for output_path, output_buffers, output_armatures, output_contents in outputs:
+        starts = []
+        start  = 0
+        for armature_contents in output_contents:
+          starts.append(start)
+          start += armature_contents.length()
+          if self.__format == "binary" and len(output_contents) > 1:
+            start += -armature_contents.length() % binary.CALCIUM_BINARY_ALIGNMENT
+          #endif
+        #endfor
+        self.__writeIndex(output_path, output_contents, starts)
+      #endfor
+    #endif
+    yield
   #end
 
 #endclass
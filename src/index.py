@@ -0,0 +1,198 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import json
+
+from .model import CalciumAction, CalciumBakedAction, CalciumMesh, CalciumSkeleton
+
+#
+# The table of contents of an exported file, written next to it as a JSON
+# file with ".idx" added to its name. A loader can seek to, or map, a
+# single element of the file without parsing anything before it. The
+# index records the octet offset and length of the skeleton, each mesh and
+# each action of every armature in the file, along with the counts that a
+# loader needs to preallocate storage:
+#
+#   {
+#     "version"     : 1,
+#     "format"      : "text" or "binary",
+#     "compression" : "none", "gzip" or "xz",
+#     "armatures"   : [
+#       {
+#         "name"     : armature name,
+#         "offset"   : offset of the file of the armature,
+#         "length"   : length of the file of the armature,
+#         "skeleton" : { "offset", "length", "bones" },
+#         "meshes"   : [ { "name", "offset", "length", "vertices",
+#                          "weight_arrays" or "influences" }, ... ],
+#         "actions"  : [ { "name", "offset", "length",
+#                          "curves" and "keyframes",
+#                          or "frames" and "bones" if baked }, ... ],
+#         "shared_curves" : { "offset", "length", "curves", "keyframes" }
+#       },
+#       ...
+#     ]
+#   }
+#
+# Offsets are absolute octet offsets in the file, or in the decompressed
+# data of a compressed file. A file only holds several armatures if they
+# are combined. The shared curves are only present for text files with
+# shared curves.
+#
+# In a text file, which is always UTF-8 with "\n" line endings, each
+# element is one complete expression. In a binary file, the span of an
+# element holds the arrays written for it followed by its records: the
+# skeleton record, the weight array records or influence record of a mesh,
+# and the curve records or baked record of an action. Shared keyframes
+# are in the span of the first action that uses them.
+#
+
+CALCIUM_INDEX_VERSION = 1
+
+def skeletonCounts(skeleton):
+  assert type(skeleton) == CalciumSkeleton
+  return {"bones" : len(skeleton.bones)}
+#end
+
+def meshCounts(mesh):
+  assert type(mesh) == CalciumMesh
+  if mesh.influences != None:
+    return {"name" : mesh.name, "vertices" : mesh.vertex_count, "influences" : mesh.influences.count}
+  #endif
+  return {"name" : mesh.name, "vertices" : mesh.vertex_count, "weight_arrays" : len(mesh.weight_arrays)}
+#end
+
+def actionCounts(action):
+  if type(action) == CalciumBakedAction:
+    return {"name" : action.name, "frames" : action.frame_count, "bones" : action.bone_count}
+  #endif
+  assert type(action) == CalciumAction
+  return {"name" : action.name, "curves" : len(action.curves), "keyframes" : sum(curve.size() for curve in action.curves)}
+#end
+
+def curvesCounts(curves):
+  assert type(curves) == list
+  return {"curves" : len(curves), "keyframes" : sum(curve.size() for curve in curves)}
+#end
+
+#
+# The contents of the file of one armature. Each element is added with
+# its (offset, length) span relative to the start of the file of the
+# armature, and its counts.
+#
+
+class CalciumContents:
+
+  def __init__(self, name):
+    assert type(name) == str
+
+    self.__name          = name
+    self.__length        = 0
+    self.__skeleton      = None
+    self.__meshes        = []
+    self.__actions       = []
+    self.__shared_curves = None
+  #end
+
+  def __entry(self, span, counts):
+    offset, length = span
+    entry = dict(counts)
+    entry["offset"] = offset
+    entry["length"] = length
+    return entry
+  #end
+
+  def setSkeleton(self, span, counts):
+    self.__skeleton = self.__entry(span, counts)
+  #end
+
+  def addMesh(self, span, counts):
+    self.__meshes.append(self.__entry(span, counts))
+  #end
+
+  def addAction(self, span, counts):
+    self.__actions.append(self.__entry(span, counts))
+  #end
+
+  def setSharedCurves(self, span, counts):
+    self.__shared_curves = self.__entry(span, counts)
+  #end
+
+  def setLength(self, length):
+    assert type(length) == int
+    self.__length = length
+  #end
+
+  def length(self):
+    return self.__length
+  #end
+
+  #
+  # The index entry of the armature, with every offset moved by the given
+  # start of the file of the armature.
+  #
+
+  def entry(self, start):
+    assert type(start) == int
+
+    def moved(entry):
+      entry = dict(entry)
+      entry["offset"] += start
+      return entry
+    #end
+
+    result = {
+      "name"     : self.__name,
+      "offset"   : start,
+      "length"   : self.__length,
+      "skeleton" : moved(self.__skeleton),
+      "meshes"   : [moved(mesh) for mesh in self.__meshes],
+      "actions"  : [moved(action) for action in self.__actions]
+    }
+    if self.__shared_curves != None:
+      result["shared_curves"] = moved(self.__shared_curves)
+    #endif
+    return result
+  #end
+#endclass
+
+#
+# Write the index of a file holding the given contents, each beginning at
+# the corresponding start.
+#
+
+def writeIndex(path, file_format, compression, contents, starts):
+  assert type(path) == str
+  assert type(contents) == list
+  assert type(starts) == list
+  assert len(contents) == len(starts)
+
+  armatures = []
+  for armature_contents, start in zip(contents, starts):
+    assert type(armature_contents) == CalciumContents
+    armatures.append(armature_contents.entry(start))
+  #endfor
+
+  report = {
+    "version"     : CALCIUM_INDEX_VERSION,
+    "format"      : file_format,
+    "compression" : compression,
+    "armatures"   : armatures
+  }
+  with open(path, "wt") as index_file:
+    json.dump(report, index_file, indent=2, sort_keys=True)
+  #endwith
+#end
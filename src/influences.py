@@ -0,0 +1,131 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import array
+
+from .model import CalciumInfluences, CalciumMesh, CalciumWeightArray
+
+#
+# The supported quantizations of influence weights, and the largest value
+# of each. Unquantized weights are stored as floats.
+#
+
+CALCIUM_INFLUENCE_QUANTIZATIONS = {
+  "none"   : None,
+  "uint8"  : 255,
+  "uint16" : 65535
+}
+
+CALCIUM_INFLUENCE_TYPECODES = {
+  "none"   : 'f',
+  "uint8"  : 'B',
+  "uint16" : 'H'
+}
+
+#
+# Quantize the given normalized weights so that they sum to exactly the
+# given maximum value. Rounding error is absorbed by the largest weight.
+#
+
+def quantizeWeights(weights, maximum):
+  assert type(weights) == list
+  assert type(maximum) == int
+
+  quantized = []
+  for weight in weights:
+    quantized.append(int(round(weight * maximum)))
+  #endfor
+
+  if len(quantized) > 0:
+    quantized[0] += maximum - sum(quantized)
+  #endif
+  return quantized
+#end
+
+#
+# Calculate the per-vertex influences of the given mesh. Only the weight
+# arrays that name one of the given bones are considered, and each bone is
+# identified by its index in the given map. Each vertex receives exactly
+# "count" influences: the largest weights renormalized to sum to one (or
+# to the maximum quantized value), padded with zero-weight influences of
+# bone 0. Vertices that are influenced by no bone have all weights zero.
+#
+
+def calculateInfluences(mesh, bone_indices, count, quantization):
+  assert type(mesh) == CalciumMesh
+  assert type(bone_indices) == type({})
+  assert type(count) == int
+  assert count > 0
+  assert quantization in CALCIUM_INFLUENCE_QUANTIZATIONS
+
+  vertex_count = mesh.vertex_count
+  by_vertex    = [None] * vertex_count
+
+  for weight_array in mesh.weight_arrays:
+    assert type(weight_array) == CalciumWeightArray
+    bone_index = bone_indices.get(weight_array.bone_name, None)
+    if bone_index == None:
+      continue
+    #endif
+
+    for vertex_index, weight in zip(weight_array.indices, weight_array.weights):
+      if weight > 0.0:
+        existing = by_vertex[vertex_index]
+        if existing == None:
+          existing = []
+          by_vertex[vertex_index] = existing
+        #endif
+        existing.append((-weight, bone_index))
+      #endif
+    #endfor
+  #endfor
+
+  maximum  = CALCIUM_INFLUENCE_QUANTIZATIONS[quantization]
+  bones    = array.array('H', [0]) * (vertex_count * count)
+  weights  = array.array(CALCIUM_INFLUENCE_TYPECODES[quantization], [0]) * (vertex_count * count)
+
+  for vertex_index in range(0, vertex_count):
+    existing = by_vertex[vertex_index]
+    if existing == None:
+      continue
+    #endif
+
+    existing.sort()
+    selected = existing[0:count]
+
+    total = 0.0
+    for negated, bone_index in selected:
+      total -= negated
+    #endfor
+
+    normalized = []
+    for negated, bone_index in selected:
+      normalized.append(-negated / total)
+    #endfor
+
+    if maximum != None:
+      normalized = quantizeWeights(normalized, maximum)
+    #endif
+
+    base = vertex_index * count
+    for position in range(0, len(selected)):
+      bones[base + position]   = selected[position][1]
+      weights[base + position] = normalized[position]
+    #endfor
+  #endfor
+
+  return CalciumInfluences(count, quantization, bones, weights)
+#end
@@ -0,0 +1,328 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+#
+# The data extracted from Blender for export. Nothing in this module
+# depends on bpy, so the writers, validators and optimizers that consume it
+# can be used, tested and benchmarked outside of Blender, and the model can
+# be sent to worker processes. All values are already in the exported
+# coordinate system.
+#
+# All classes use __slots__, and bulk data is held in arrays rather than
+# in one object per element, so that a curve with 100000 keyframes is a
+# handful of arrays rather than 100000 objects.
+#
+
+import array
+import hashlib
+
+#
+# The interpolations and easings of keyframes. Curves store each as the
+# index of its name in these lists.
+#
+
+CALCIUM_INTERPOLATIONS = ["constant", "linear", "exponential"]
+CALCIUM_EASINGS        = ["in", "out", "in-out"]
+
+CALCIUM_INTERPOLATION_CODES = {
+  "constant"    : 0,
+  "linear"      : 1,
+  "exponential" : 2
+}
+
+CALCIUM_EASING_CODES = {
+  "in"     : 0,
+  "out"    : 1,
+  "in-out" : 2
+}
+
+#
+# The ways in which curves and weight arrays refer to bones: by the name
+# of the bone, or by the index of the bone in the skeleton. When bones are
+# referred to by index, the skeleton is sorted so that every parent comes
+# before its children.
+#
+
+CALCIUM_BONE_REFERENCES = ["names", "indices"]
+
+#
+# The number of components of the value of each type of curve.
+#
+
+CALCIUM_CURVE_WIDTHS = {
+  "translation" : 3,
+  "scale"       : 3,
+  "orientation" : 4
+}
+
+#
+# A single keyframe of a curve. Curves do not store keyframes as objects;
+# this is a copy of one keyframe, as returned by CalciumCurve.keyframe().
+#
+
+class CalciumKeyframe:
+  __slots__ = ["index", "interpolation", "easing", "value"]
+
+  def __init__(self, _index, _interpolation, _easing, _value):
+    self.index         = _index
+    self.interpolation = _interpolation
+    self.easing        = _easing
+    self.value         = _value
+  #end
+#endclass
+
+#
+# A curve of a bone. The type is one of "translation", "scale" or
+# "orientation". Keyframes are ordered by index, and are stored in
+# parallel arrays: the indices, the interpolation and easing codes, and
+# the values. The value of each keyframe occupies consecutive elements of
+# the values array: (x, y, z) for translation and scale curves, and
+# (x, y, z, w) for orientation curves.
+#
+
+class CalciumCurve:
+  __slots__ = ["bone_name", "type", "indices", "interpolations", "easings", "values"]
+
+  def __init__(self, _bone_name, _type, _indices, _interpolations, _easings, _values):
+    assert _type in CALCIUM_CURVE_WIDTHS
+    assert type(_indices) == array.array
+    assert type(_interpolations) == array.array
+    assert type(_easings) == array.array
+    assert type(_values) == array.array
+    assert len(_interpolations) == len(_indices)
+    assert len(_easings) == len(_indices)
+    assert len(_values) == len(_indices) * CALCIUM_CURVE_WIDTHS[_type]
+
+    self.bone_name      = _bone_name
+    self.type           = _type
+    self.indices        = _indices
+    self.interpolations = _interpolations
+    self.easings        = _easings
+    self.values         = _values
+  #end
+
+  def size(self):
+    return len(self.indices)
+  #end
+
+  def width(self):
+    return CALCIUM_CURVE_WIDTHS[self.type]
+  #end
+
+  def value(self, position):
+    width = CALCIUM_CURVE_WIDTHS[self.type]
+    return tuple(self.values[position * width : (position + 1) * width])
+  #end
+
+  def keyframe(self, position):
+    return CalciumKeyframe(
+      self.indices[position],
+      CALCIUM_INTERPOLATIONS[self.interpolations[position]],
+      CALCIUM_EASINGS[self.easings[position]],
+      self.value(position))
+  #end
+
+  #
+  # A new curve holding the keyframes at the given positions, which must
+  # be in ascending order.
+  #
+
+  def select(self, positions):
+    width          = CALCIUM_CURVE_WIDTHS[self.type]
+    indices        = array.array(self.indices.typecode)
+    interpolations = array.array(self.interpolations.typecode)
+    easings        = array.array(self.easings.typecode)
+    values         = array.array(self.values.typecode)
+    for position in positions:
+      indices.append(self.indices[position])
+      interpolations.append(self.interpolations[position])
+      easings.append(self.easings[position])
+      values.extend(self.values[position * width : (position + 1) * width])
+    #endfor
+    return CalciumCurve(self.bone_name, self.type, indices, interpolations, easings, values)
+  #end
+
+  #
+  # A hash of the type and keyframes of the curve, but not its bone. Curves
+  # with the same hash have the same keyframes, and may share one copy of
+  # them.
+  #
+
+  def keyframesHash(self):
+    digest = hashlib.sha1(repr((self.type, len(self.indices))).encode("utf-8"))
+    digest.update(array.array('i', self.indices).tobytes())
+    digest.update(array.array('B', self.interpolations).tobytes())
+    digest.update(array.array('B', self.easings).tobytes())
+    digest.update(array.array('d', self.values).tobytes())
+    return digest.hexdigest()
+  #end
+#endclass
+
+#
+# Build curves from keyframes one at a time.
+#
+
+class CalciumCurveBuilder:
+  __slots__ = ["bone_name", "type", "indices", "interpolations", "easings", "values"]
+
+  def __init__(self, _bone_name, _type):
+    assert _type in CALCIUM_CURVE_WIDTHS
+    self.bone_name      = _bone_name
+    self.type           = _type
+    self.indices        = array.array('i')
+    self.interpolations = array.array('B')
+    self.easings        = array.array('B')
+    self.values         = array.array('d')
+  #end
+
+  def append(self, index, interpolation, easing, value):
+    assert len(value) == CALCIUM_CURVE_WIDTHS[self.type]
+    self.indices.append(index)
+    self.interpolations.append(CALCIUM_INTERPOLATION_CODES[interpolation])
+    self.easings.append(CALCIUM_EASING_CODES[easing])
+    self.values.extend(value)
+  #end
+
+  def build(self):
+    return CalciumCurve(self.bone_name, self.type, self.indices, self.interpolations, self.easings, self.values)
+  #end
+#endclass
+
+class CalciumAction:
+  __slots__ = ["name", "length", "curves"]
+
+  def __init__(self, _name, _length, _curves):
+    self.name   = _name
+    self.length = _length
+    self.curves = _curves
+  #end
+#endclass
+
+#
+# An action sampled at a fixed rate, in samples per second. Every bone of
+# the skeleton is sampled at every one of the frame_count sample times,
+# and the samples are stored in dense frame-major tracks: the value of
+# bone b at sample t occupies consecutive elements of each track starting
+# at (t * bone_count + b) * width, where the width is 3 for translations
+# and scales and 4 (x, y, z, w) for orientations. Bone b is bone b of the
+# skeleton.
+#
+
+class CalciumBakedAction:
+  __slots__ = ["name", "length", "rate", "frame_count", "bone_count", "translations", "orientations", "scales"]
+
+  def __init__(self, _name, _length, _rate, _frame_count, _bone_count, _translations, _orientations, _scales):
+    assert type(_rate) == float
+    assert type(_frame_count) == int
+    assert type(_bone_count) == int
+    assert type(_translations) == array.array
+    assert type(_orientations) == array.array
+    assert type(_scales) == array.array
+    assert len(_translations) == _frame_count * _bone_count * 3
+    assert len(_orientations) == _frame_count * _bone_count * 4
+    assert len(_scales) == _frame_count * _bone_count * 3
+
+    self.name         = _name
+    self.length       = _length
+    self.rate         = _rate
+    self.frame_count  = _frame_count
+    self.bone_count   = _bone_count
+    self.translations = _translations
+    self.orientations = _orientations
+    self.scales       = _scales
+  #end
+#endclass
+
+#
+# A bone of a skeleton. The parent is the name of the parent bone, or
+# None for root bones. The orientation is an (x, y, z, w) tuple.
+#
+
+class CalciumBone:
+  __slots__ = ["name", "parent", "translation", "scale", "orientation"]
+
+  def __init__(self, _name, _parent, _translation, _scale, _orientation):
+    self.name        = _name
+    self.parent      = _parent
+    self.translation = _translation
+    self.scale       = _scale
+    self.orientation = _orientation
+  #end
+#endclass
+
+class CalciumSkeleton:
+  __slots__ = ["name", "bones"]
+
+  def __init__(self, _name, _bones):
+    self.name  = _name
+    self.bones = _bones
+  #end
+#endclass
+
+#
+# The weights of a single vertex group. The weights are sparse: the
+# indices array holds the vertices that belong to the group, and the
+# weights array holds their weights. All other vertices have a weight of
+# zero.
+#
+
+class CalciumWeightArray:
+  __slots__ = ["bone_name", "indices", "weights"]
+
+  def __init__(self, _bone_name, _indices, _weights):
+    assert len(_indices) == len(_weights)
+    self.bone_name = _bone_name
+    self.indices   = _indices
+    self.weights   = _weights
+  #end
+#endclass
+
+#
+# The per-vertex influences of a mesh. Each vertex has exactly "count"
+# influences, stored consecutively: the bones array holds the indices of
+# the influencing bones within the skeleton, and the weights array holds
+# the weights as floats or, if quantized, as unsigned integers that sum to
+# the maximum value of the quantized type.
+#
+
+class CalciumInfluences:
+  __slots__ = ["count", "quantization", "bones", "weights"]
+
+  def __init__(self, _count, _quantization, _bones, _weights):
+    assert len(_bones) == len(_weights)
+    self.count        = _count
+    self.quantization = _quantization
+    self.bones        = _bones
+    self.weights      = _weights
+  #end
+#endclass
+
+#
+# A mesh. The weights are either given as one weight array per vertex
+# group, or as per-vertex influences, in which case there are no weight
+# arrays.
+#
+
+class CalciumMesh:
+  __slots__ = ["name", "vertex_count", "weight_arrays", "influences"]
+
+  def __init__(self, _name, _vertex_count, _weight_arrays, _influences):
+    self.name          = _name
+    self.vertex_count  = _vertex_count
+    self.weight_arrays = _weight_arrays
+    self.influences    = _influences
+  #end
+#endclass
@@ -0,0 +1,152 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import io
+import queue
+import threading
+import time
+
+#
+# Asynchronous output of text files. Text written by the exporter is
+# collected into blocks of at least the given size, and the blocks are put
+# into a bounded queue that a background thread drains to the output
+# file. Writing, and any compression that the output file performs, then
+# overlap with the evaluation of the scene on the main thread. When the
+# queue is full, the exporter waits for the thread to catch up, so at most
+# the given number of blocks are held in memory.
+#
+# If a write fails, the failure is kept and the remaining blocks are
+# discarded. The failure is returned by finish(), so that the exporter can
+# report it along with the other errors of the export.
+#
+
+class CalciumOutputThread:
+
+  def __init__(self, out_file, queue_size, block_size):
+    assert type(queue_size) == int
+    assert queue_size > 0
+    assert type(block_size) == int
+
+    self.__out_file   = out_file
+    self.__queue      = queue.Queue(queue_size)
+    self.__block_size = block_size
+    self.__pending    = []
+    self.__buffered   = 0
+    self.__failure    = None
+    self.__discard    = False
+    self.__seconds    = 0.0
+    self.__blocks     = 0
+    self.__file       = CalciumTextOutput(self)
+
+    self.__thread = threading.Thread(target=self.__run, name="calcium-output")
+    self.__thread.daemon = True
+    self.__thread.start()
+  #end
+
+  def __run(self):
+    while True:
+      block = self.__queue.get()
+      if block == None:
+        break
+      #endif
+      if self.__failure != None or self.__discard:
+        continue
+      #endif
+
+      time_start = time.perf_counter()
+      try:
+        self.__out_file.write(block)
+      except Exception as ex:
+        self.__failure = ex
+      #endtry
+      self.__seconds += time.perf_counter() - time_start
+      self.__blocks  += 1
+    #endwhile
+  #end
+
+  def __putPending(self):
+    if len(self.__pending) > 0:
+      self.__queue.put("".join(self.__pending))
+      self.__pending  = []
+      self.__buffered = 0
+    #endif
+  #end
+
+  #
+  # The file object that the exporter writes to.
+  #
+
+  def file(self):
+    return self.__file
+  #end
+
+  def put(self, data):
+    assert self.__thread != None
+    self.__pending.append(data)
+    self.__buffered += len(data)
+    if self.__buffered >= self.__block_size:
+      self.__putPending()
+    #endif
+  #end
+
+  #
+  # Wait for the thread to write every block, or to discard them if the
+  # export was abandoned, and return the failure of the first write that
+  # failed, if any.
+  #
+
+  def finish(self, discard):
+    assert type(discard) == bool
+
+    if self.__thread != None:
+      if discard:
+        self.__discard = True
+      else:
+        self.__putPending()
+      #endif
+      self.__queue.put(None)
+      self.__thread.join()
+      self.__thread = None
+    #endif
+    return self.__failure
+  #end
+
+  #
+  # The time that the thread spent writing, and the number of blocks that
+  # it wrote.
+  #
+
+  def seconds(self):
+    return self.__seconds
+  #end
+
+  def blocks(self):
+    return self.__blocks
+  #end
+#endclass
+
+class CalciumTextOutput(io.TextIOBase):
+
+  def __init__(self, output_thread):
+    self.__output_thread = output_thread
+  #end
+
+  def write(self, text):
+    assert type(text) == str
+    self.__output_thread.put(text)
+    return len(text)
+  #end
+#endclass
@@ -0,0 +1,150 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import contextlib
+import datetime
+import json
+import time
+import tracemalloc
+
+#
+# Record where the time of an export goes. Each phase accumulates its
+# wall time and the number of times it ran; phases may be nested, so the
+# times of phases do not add up to the total. Counters record how often
+# something happened, and the size of each written section is recorded
+# in octets. If memory tracing is enabled, the peak memory allocated by
+# Python during the export is recorded with tracemalloc.
+#
+# The report is a JSON object:
+#
+#   {
+#     "version"  : 1,
+#     "started"  : ISO 8601 time,
+#     "seconds"  : total wall time,
+#     "phases"   : { name: { "seconds": s, "calls": n }, ... },
+#     "counters" : { name: n, ... },
+#     "bytes"    : { section: n, ... },
+#     "memory"   : { "peak": octets } or null,
+#     ...        : any values given to set()
+#   }
+#
+
+class CalciumProfiler:
+  VERSION = 1
+
+  def __init__(self, trace_memory):
+    assert type(trace_memory) == bool
+
+    self.__trace_memory = trace_memory
+    self.__tracing      = False
+    self.__started      = datetime.datetime.now()
+    self.__time_start   = time.perf_counter()
+    self.__phases       = {}
+    self.__counters     = {}
+    self.__bytes        = {}
+    self.__values       = {}
+    self.__memory       = None
+
+    if trace_memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+      self.__tracing = True
+    #endif
+  #end
+
+  #
+  # Time the enclosed block as one call of the given phase.
+  #
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    time_start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.addTime(name, time.perf_counter() - time_start, 1)
+    #endtry
+  #end
+
+  #
+  # Add time spent in a phase that was measured by the caller. This avoids
+  # the overhead of phase() in loops.
+  #
+
+  def addTime(self, name, seconds, calls):
+    assert type(name) == str
+    assert type(calls) == int
+
+    entry = self.__phases.get(name, None)
+    if entry == None:
+      entry = {"seconds" : 0.0, "calls" : 0}
+      self.__phases[name] = entry
+    #endif
+    entry["seconds"] += seconds
+    entry["calls"]   += calls
+  #end
+
+  def count(self, name, amount):
+    assert type(name) == str
+    assert type(amount) == int
+    self.__counters[name] = self.__counters.get(name, 0) + amount
+  #end
+
+  def addBytes(self, section, amount):
+    assert type(section) == str
+    assert type(amount) == int
+    self.__bytes[section] = self.__bytes.get(section, 0) + amount
+  #end
+
+  def set(self, name, value):
+    assert type(name) == str
+    self.__values[name] = value
+  #end
+
+  #
+  # Stop memory tracing, if this profiler started it, and return the
+  # report.
+  #
+
+  def finish(self):
+    if self.__tracing:
+      current, peak = tracemalloc.get_traced_memory()
+      tracemalloc.stop()
+      self.__tracing = False
+      self.__memory  = {"peak" : peak}
+    #endif
+
+    report = dict(self.__values)
+    report.update({
+      "version"  : CalciumProfiler.VERSION,
+      "started"  : self.__started.isoformat(),
+      "seconds"  : time.perf_counter() - self.__time_start,
+      "phases"   : self.__phases,
+      "counters" : self.__counters,
+      "bytes"    : self.__bytes,
+      "memory"   : self.__memory
+    })
+    return report
+  #end
+
+  def write(self, path):
+    assert type(path) == str
+    report = self.finish()
+    with open(path, "wt") as report_file:
+      json.dump(report, report_file, indent=2, sort_keys=True)
+    #endwith
+    return report
+  #end
+#endclass
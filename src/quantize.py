@@ -0,0 +1,227 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import array
+import math
+import struct
+
+from .model import CalciumCurve
+from .reduce import normalizeQuaternion, quaternionAngle, vectorDistance
+
+#
+# The encodings of the values of exported curves. With "float", every
+# value is stored as floats. With "quantized", curves whose values are
+# all the same are stored as a single value, orientations are stored with
+# the smallest-three encoding in 48 bits, and translations and scales are
+# stored as 16-bit values quantized to the range of the curve.
+#
+
+CALCIUM_CURVE_ENCODINGS = ["float", "quantized"]
+
+#
+# The largest value of a 16-bit range-quantized component, and of a 15-bit
+# smallest-three component. The three smallest components of a unit
+# quaternion lie within [-1/sqrt(2), 1/sqrt(2)].
+#
+
+CALCIUM_QUANTIZE_RANGE_MAXIMUM    = 65535
+CALCIUM_QUANTIZE_SMALLEST_MAXIMUM = 32767
+CALCIUM_QUANTIZE_SMALLEST_BOUND   = 1.0 / math.sqrt(2.0)
+
+#
+# Round a value to the nearest 32-bit float, as it will be stored.
+#
+
+def toFloat32(value):
+  return struct.unpack("<f", struct.pack("<f", value))[0]
+#end
+
+#
+# Quantize each component of the given vectors to 16 bits within the range
+# of that component over all of the vectors. Returns the minimum and
+# maximum of each component and the quantized components, in the same
+# order as the given components. A component that never changes is
+# quantized to zero.
+#
+
+def quantizeRange(vectors, width):
+  assert type(vectors) == list
+  assert type(width) == int
+
+  minimum = []
+  maximum = []
+  for component in range(0, width):
+    values = [vector[component] for vector in vectors]
+    minimum.append(toFloat32(min(values)))
+    maximum.append(toFloat32(max(values)))
+  #endfor
+
+  quantized = array.array('H')
+  for vector in vectors:
+    for component in range(0, width):
+      extent = maximum[component] - minimum[component]
+      if extent > 0.0:
+        value = (vector[component] - minimum[component]) / extent
+        quantized.append(min(CALCIUM_QUANTIZE_RANGE_MAXIMUM, max(0, int(round(value * CALCIUM_QUANTIZE_RANGE_MAXIMUM)))))
+      else:
+        quantized.append(0)
+      #endif
+    #endfor
+  #endfor
+  return (tuple(minimum), tuple(maximum), quantized)
+#end
+
+def dequantizeRange(minimum, maximum, quantized, index):
+  result = []
+  width  = len(minimum)
+  for component in range(0, width):
+    extent = maximum[component] - minimum[component]
+    result.append(minimum[component] + extent * quantized[index * width + component] / CALCIUM_QUANTIZE_RANGE_MAXIMUM)
+  #endfor
+  return tuple(result)
+#end
+
+#
+# Encode an (x, y, z, w) quaternion in 48 bits with the smallest-three
+# encoding: the quaternion is normalized and negated if necessary so that
+# its largest component is positive, and that component is dropped. The
+# three remaining components are quantized to 15 bits each. The result is
+# three 16-bit words holding the 48-bit value
+#
+#   bits  0-14  first remaining component
+#   bits 15-29  second remaining component
+#   bits 30-44  third remaining component
+#   bits 45-46  index of the dropped component (0 x, 1 y, 2 z, 3 w)
+#   bit  47     zero
+#
+# with the least significant word first.
+#
+
+def encodeSmallestThree(q):
+  assert len(q) == 4
+
+  q = normalizeQuaternion(q)
+
+  largest = 0
+  for component in range(1, 4):
+    if abs(q[component]) > abs(q[largest]):
+      largest = component
+    #endif
+  #endfor
+  if q[largest] < 0.0:
+    q = [-c for c in q]
+  #endif
+
+  bound = CALCIUM_QUANTIZE_SMALLEST_BOUND
+  bits  = largest << 45
+  shift = 0
+  for component in range(0, 4):
+    if component == largest:
+      continue
+    #endif
+    value = (q[component] + bound) / (2.0 * bound)
+    value = min(CALCIUM_QUANTIZE_SMALLEST_MAXIMUM, max(0, int(round(value * CALCIUM_QUANTIZE_SMALLEST_MAXIMUM))))
+    bits |= value << shift
+    shift += 15
+  #endfor
+
+  return (bits & 0xffff, (bits >> 16) & 0xffff, (bits >> 32) & 0xffff)
+#end
+
+def decodeSmallestThree(words):
+  assert len(words) == 3
+
+  bits    = words[0] | (words[1] << 16) | (words[2] << 32)
+  largest = (bits >> 45) & 0x3
+  bound   = CALCIUM_QUANTIZE_SMALLEST_BOUND
+
+  q     = [0.0, 0.0, 0.0, 0.0]
+  total = 0.0
+  shift = 0
+  for component in range(0, 4):
+    if component == largest:
+      continue
+    #endif
+    value = (bits >> shift) & CALCIUM_QUANTIZE_SMALLEST_MAXIMUM
+    q[component] = (value / CALCIUM_QUANTIZE_SMALLEST_MAXIMUM) * (2.0 * bound) - bound
+    total += q[component] * q[component]
+    shift += 15
+  #endfor
+
+  q[largest] = math.sqrt(max(0.0, 1.0 - total))
+  return tuple(q)
+#end
+
+#
+# An encoded curve. The encoding is one of "float", "constant" or
+# "quantized". The header holds the floats that precede the values: the
+# minimum and maximum of each component for range-quantized curves, and
+# nothing otherwise. The values are the stored floats or 16-bit words, and
+# the error is the largest distance (or angle, in radians, for
+# orientations) between an original value and the value that a reader
+# reconstructs from the encoding. Orientations are normalized before they
+# are compared, since a reader always reconstructs a unit quaternion, so
+# the error only measures the loss due to quantization.
+#
+
+class CalciumEncodedCurve:
+  encoding = "float"
+  header   = None
+  values   = None
+  error    = 0.0
+
+  def __init__(self, _encoding, _header, _values, _error):
+    self.encoding = _encoding
+    self.header   = _header
+    self.values   = _values
+    self.error    = _error
+  #end
+#endclass
+
+def encodeCurve(curve, encoding):
+  assert type(curve) == CalciumCurve
+  assert encoding in CALCIUM_CURVE_ENCODINGS
+
+  if encoding == "float" or curve.size() == 0:
+    return CalciumEncodedCurve("float", array.array('f'), array.array('f', curve.values), 0.0)
+  #endif
+
+  vectors = []
+  for position in range(0, curve.size()):
+    vectors.append(tuple(toFloat32(c) for c in curve.value(position)))
+  #endfor
+
+  if vectors.count(vectors[0]) == len(vectors):
+    return CalciumEncodedCurve("constant", array.array('f'), array.array('f', vectors[0]), 0.0)
+  #endif
+
+  error = 0.0
+  if curve.type == "orientation":
+    values = array.array('H')
+    for vector in vectors:
+      words = encodeSmallestThree(vector)
+      values.extend(words)
+      error = max(error, quaternionAngle(normalizeQuaternion(vector), decodeSmallestThree(words)))
+    #endfor
+    return CalciumEncodedCurve("quantized", array.array('f'), values, error)
+  #endif
+
+  minimum, maximum, values = quantizeRange(vectors, 3)
+  for index, vector in enumerate(vectors):
+    error = max(error, vectorDistance(vector, dequantizeRange(minimum, maximum, values, index)))
+  #endfor
+  return CalciumEncodedCurve("quantized", array.array('f', minimum + maximum), values, error)
+#end
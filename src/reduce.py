@@ -0,0 +1,331 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import math
+
+from .model import CALCIUM_INTERPOLATION_CODES, CalciumAction, CalciumCurve
+
+#
+# Tolerance-based keyframe reduction. A keyframe is removed when the value
+# that the remaining keyframes give at its index is within the tolerance
+# of its own value. The tolerance of a curve depends on its type: the
+# distance between translations, the distance between scales, or the
+# angle in radians between orientations.
+#
+# The value between two keyframes is given by the interpolation and easing
+# of the first one, so keyframes are only removed from runs of keyframes
+# that all have the same interpolation and easing, and the first keyframe
+# of each run is always kept. Within a run, "constant" keyframes hold the
+# value of the first keyframe, and "linear" keyframes are interpolated
+# linearly (translation and scale) or by spherical linear interpolation
+# (orientation). Keyframes with "exponential" interpolation are never
+# removed. The first and last keyframes of a curve are always kept.
+#
+
+CALCIUM_REDUCIBLE_INTERPOLATIONS = [
+  CALCIUM_INTERPOLATION_CODES["constant"],
+  CALCIUM_INTERPOLATION_CODES["linear"]
+]
+
+def vectorDistance(v0, v1):
+  total = 0.0
+  for a, b in zip(v0, v1):
+    total += (a - b) * (a - b)
+  #endfor
+  return math.sqrt(total)
+#end
+
+def quaternionAngle(q0, q1):
+  dot = 0.0
+  for a, b in zip(q0, q1):
+    dot += a * b
+  #endfor
+  return 2.0 * math.acos(min(1.0, abs(dot)))
+#end
+
+def normalizeQuaternion(q):
+  length = math.sqrt(q[0] * q[0] + q[1] * q[1] + q[2] * q[2] + q[3] * q[3])
+  return tuple(c / length for c in q)
+#end
+
+def vectorLerp(v0, v1, t):
+  result = []
+  for a, b in zip(v0, v1):
+    result.append(a + (b - a) * t)
+  #endfor
+  return tuple(result)
+#end
+
+#
+# Spherical linear interpolation between two (x, y, z, w) quaternions,
+# along the shortest path.
+#
+
+def quaternionSlerp(q0, q1, t):
+  dot = 0.0
+  for a, b in zip(q0, q1):
+    dot += a * b
+  #endfor
+
+  if dot < 0.0:
+    q1  = tuple(-b for b in q1)
+    dot = -dot
+  #endif
+
+  if dot > 0.9995:
+    return vectorLerp(q0, q1, t)
+  #endif
+
+  theta = math.acos(dot)
+  sin_theta = math.sin(theta)
+  s0 = math.sin((1.0 - t) * theta) / sin_theta
+  s1 = math.sin(t * theta) / sin_theta
+
+  result = []
+  for a, b in zip(q0, q1):
+    result.append(a * s0 + b * s1)
+  #endfor
+  return tuple(result)
+#end
+
+#
+# The value given at the keyframe at position j of the curve by the
+# keyframes at positions first and last, and its error relative to the
+# value of keyframe j.
+#
+
+def keyframeError(curve, first, last, j):
+  v0 = curve.value(first)
+  vj = curve.value(j)
+
+  if curve.interpolations[first] == CALCIUM_INTERPOLATION_CODES["constant"]:
+    value = v0
+  else:
+    indices = curve.indices
+    t = (indices[j] - indices[first]) / (indices[last] - indices[first])
+    if curve.type == "orientation":
+      value = quaternionSlerp(v0, curve.value(last), t)
+    else:
+      value = vectorLerp(v0, curve.value(last), t)
+    #endif
+  #endif
+
+  if curve.type == "orientation":
+    return quaternionAngle(value, vj)
+  #endif
+  return vectorDistance(value, vj)
+#end
+
+#
+# Reduce the keyframes strictly between first and last, which must all
+# have the same interpolation and easing as first, in the manner of the
+# Ramer-Douglas-Peucker algorithm: if every keyframe in between is within
+# the tolerance, all of them are removed, otherwise the range is split at
+# the keyframe with the largest error. The indices of the kept keyframes
+# in between are added to the given set, and the largest error of a
+# removed keyframe is returned.
+#
+
+def reduceRun(curve, first, last, tolerance, kept):
+  pending = [(first, last)]
+  maximum = 0.0
+
+  while len(pending) > 0:
+    first, last = pending.pop()
+    if last - first < 2:
+      continue
+    #endif
+
+    worst       = None
+    worst_error = 0.0
+    range_error = 0.0
+    for j in range(first + 1, last):
+      error = keyframeError(curve, first, last, j)
+      range_error = max(range_error, error)
+      if error > tolerance and (worst == None or error > worst_error):
+        worst       = j
+        worst_error = error
+      #endif
+    #endfor
+
+    if worst == None:
+      maximum = max(maximum, range_error)
+    else:
+      kept.add(worst)
+      pending.append((first, worst))
+      pending.append((worst, last))
+    #endif
+  #endwhile
+  return maximum
+#end
+
+#
+# Reduce the keyframes of the given curve. Returns the reduced curve and
+# the largest error of a removed keyframe.
+#
+
+def reduceCurve(curve, tolerance):
+  assert type(curve) == CalciumCurve
+  assert type(tolerance) == float
+
+  count = curve.size()
+  if count <= 2:
+    return (curve, 0.0)
+  #endif
+
+  interpolations = curve.interpolations
+  easings        = curve.easings
+
+  kept    = set([0, count - 1])
+  maximum = 0.0
+
+  first = 0
+  while first < count - 1:
+    last = first + 1
+    while last < count - 1:
+      if interpolations[last] != interpolations[first] or easings[last] != easings[first]:
+        break
+      #endif
+      last += 1
+    #endwhile
+
+    kept.add(first)
+    kept.add(last)
+    if interpolations[first] in CALCIUM_REDUCIBLE_INTERPOLATIONS:
+      maximum = max(maximum, reduceRun(curve, first, last, tolerance, kept))
+    else:
+      kept.update(range(first, last))
+    #endif
+    first = last
+  #endwhile
+
+  return (curve.select(sorted(kept)), maximum)
+#end
+
+#
+# Reduce all of the curves of the given action. The tolerances map curve
+# types to tolerances. Returns the reduced action and a report that maps
+# each curve type to a (keyframes before, keyframes after, largest error)
+# tuple.
+#
+
+def reduceAction(action, tolerances):
+  assert type(action) == CalciumAction
+  assert type(tolerances) == type({})
+
+  curves = []
+  report = {}
+  for curve in action.curves:
+    reduced, error = reduceCurve(curve, tolerances[curve.type])
+    curves.append(reduced)
+
+    before, after, maximum = report.get(curve.type, (0, 0, 0.0))
+    report[curve.type] = (before + curve.size(), after + reduced.size(), max(maximum, error))
+  #endfor
+  return (CalciumAction(action.name, action.length, curves), report)
+#end
+
+#
+# Simplification of curves. A constant curve, whose keyframes all have
+# exactly the same value, is collapsed to its first keyframe. A curve that
+# holds the rest pose of its bone at every keyframe may be omitted
+# entirely, since a bone holds its rest pose in any channel that no curve
+# animates.
+#
+# The rest pose is the bind pose of the bone. Curve values are sampled
+# from the pose relative to the bind pose (matrix_basis), so a curve that
+# holds the bind pose has no translation, unit scale and the identity
+# orientation, and that is what curves are compared against, rather than
+# the bind transform of the bone itself.
+#
+# Values that are decomposed from matrices in the scene come out as, for
+# example, a scale of 0.99999994 or an orientation of (-0.0, 0, 0,
+# 0.99999994), so each keyframe is compared with the rest pose within a
+# small tolerance: a distance for translations and scales, and an angle
+# in radians between normalized orientations. The tolerance is far below
+# anything visible, and only absorbs the rounding of the decomposition.
+#
+
+CALCIUM_REST_POSE_VALUES = {
+  "translation" : (0.0, 0.0, 0.0),
+  "scale"       : (1.0, 1.0, 1.0),
+  "orientation" : (0.0, 0.0, 0.0, 1.0)
+}
+
+CALCIUM_REST_POSE_TOLERANCE = 1.0e-5
+
+def isConstantCurve(curve):
+  assert type(curve) == CalciumCurve
+
+  first = curve.value(0)
+  for position in range(1, curve.size()):
+    if curve.value(position) != first:
+      return False
+    #endif
+  #endfor
+  return True
+#end
+
+def isRestPoseCurve(curve):
+  assert type(curve) == CalciumCurve
+
+  rest = CALCIUM_REST_POSE_VALUES[curve.type]
+  for position in range(0, curve.size()):
+    value = curve.value(position)
+    if curve.type == "orientation":
+      error = quaternionAngle(normalizeQuaternion(value), rest)
+    else:
+      error = vectorDistance(value, rest)
+    #endif
+    if error > CALCIUM_REST_POSE_TOLERANCE:
+      return False
+    #endif
+  #endfor
+  return True
+#end
+
+#
+# Simplify all of the curves of the given action. Returns the simplified
+# action and the numbers of curves that were collapsed and omitted.
+#
+
+def simplifyAction(action, collapse_constant, omit_rest_pose):
+  assert type(action) == CalciumAction
+  assert type(collapse_constant) == bool
+  assert type(omit_rest_pose) == bool
+
+  curves    = []
+  collapsed = 0
+  omitted   = 0
+  for curve in action.curves:
+    if curve.size() == 0:
+      curves.append(curve)
+      continue
+    #endif
+
+    if omit_rest_pose and isRestPoseCurve(curve):
+      omitted += 1
+      continue
+    #endif
+
+    if collapse_constant and curve.size() > 1 and isConstantCurve(curve):
+      curve = curve.select([0])
+      collapsed += 1
+    #endif
+    curves.append(curve)
+  #endfor
+  return (CalciumAction(action.name, action.length, curves), collapsed, omitted)
+#end
@@ -0,0 +1,538 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import collections
+import concurrent.futures
+import time
+
+from .model import CALCIUM_EASINGS, CALCIUM_INTERPOLATIONS, CalciumAction, CalciumBakedAction, CalciumBone, CalciumCurve, CalciumInfluences, CalciumMesh, CalciumSkeleton, CalciumWeightArray
+
+#
+# Format the elements of the text Calcium format (.ca). Each element is
+# formatted as a single string, with all of the keyframes of a curve and
+# all of the weights of an array formatted in one batch. Floating point
+# values are written with the given number of decimal places; the default
+# of 6 matches "%f".
+#
+# A file that uses none of the features below has the version 1.0. A file
+# that uses any of them has the version 1.1, and its header lists each
+# feature that it uses, independently of the others, in a [features]
+# expression:
+#
+#   "bone-indices"   : bone indices are given, mapping the name of each
+#                      bone of the skeleton to its index. Each bone gives
+#                      its index and the index of its parent, and curves
+#                      and weight arrays give the index of their bone (-1
+#                      for a vertex group that names no bone). Otherwise,
+#                      bones are referred to by name.
+#
+#   "baked-actions"  : each action holds the dense tracks of a
+#                      CalciumBakedAction, one line per sample, instead of
+#                      curves.
+#
+#   "shared-curves"  : the keyframes of each curve are replaced by a
+#                      [curve-shared] reference to the hash of its type and
+#                      keyframes, and the keyframes of each hash are
+#                      written once, in a [shared-curves] table that
+#                      follows the actions.
+#
+
+class CalciumTextFormatter:
+
+  def __init__(self, precision, bone_indices, baked, shared):
+    assert type(precision) == int
+    assert precision >= 0
+    assert bone_indices == None or type(bone_indices) == type({})
+    assert type(baked) == bool
+    assert type(shared) == bool
+
+    self.__bone_indices = bone_indices
+    self.__baked        = baked
+    self.__shared       = shared
+
+    real = "%%.%df" % precision
+    self.__real      = real
+    self.__vector3   = " ".join([real] * 3)
+    self.__vector4   = " ".join([real] * 4)
+
+    keyframe_common = (
+      "        [curve-keyframe\n"
+      "          [curve-keyframe-index %d]\n"
+      "          [curve-keyframe-interpolation \"%s\"]\n"
+      "          [curve-keyframe-easing \"%s\"]\n")
+
+    self.__keyframe_vector3 = keyframe_common + "          [curve-keyframe-vector3 " + self.__vector3 + "]]\n"
+    self.__keyframe_vector4 = keyframe_common + "          [curve-keyframe-quaternion-xyzw " + self.__vector4 + "]]\n"
+    self.__weight           = "          [mesh-weight-array-value " + real + "]\n"
+  #end
+
+  def formatHeader(self, fps):
+    assert type(fps) == int
+
+    features = []
+    if self.__bone_indices != None:
+      features.append("\"bone-indices\"")
+    #endif
+    if self.__baked:
+      features.append("\"baked-actions\"")
+    #endif
+    if self.__shared:
+      features.append("\"shared-curves\"")
+    #endif
+
+    if len(features) == 0:
+      return "[version 1 0]\n[action-fps %d]\n" % fps
+    #endif
+    return "[version 1 1]\n[features %s]\n[action-fps %d]\n" % (" ".join(features), fps)
+  #end
+
+  def formatSkeleton(self, skeleton):
+    assert type(skeleton) == CalciumSkeleton
+
+    bone_translation = "      [bone-translation      " + self.__vector3 + "]\n"
+    bone_scale       = "      [bone-scale            " + self.__vector3 + "]\n"
+    bone_orientation = "      [bone-orientation-xyzw " + self.__vector4 + "]]\n"
+
+    lines = []
+    lines.append("[skeleton\n")
+    lines.append("  [skeleton-name \"%s\"]\n" % skeleton.name)
+    lines.append("  [skeleton-bones\n")
+
+    bone_indices = self.__bone_indices
+    for bone in skeleton.bones:
+      assert type(bone) == CalciumBone
+      lines.append("    [bone\n")
+      lines.append("      [bone-name             \"%s\"]\n" % bone.name)
+      if bone_indices != None:
+        lines.append("      [bone-index            %d]\n" % bone_indices[bone.name])
+        if bone.parent != None:
+          lines.append("      [bone-parent-index     %d]\n" % bone_indices[bone.parent])
+        #endif
+      elif bone.parent != None:
+        lines.append("      [bone-parent           \"%s\"]\n" % bone.parent)
+      #endif
+      lines.append(bone_translation % bone.translation)
+      lines.append(bone_scale % bone.scale)
+      lines.append(bone_orientation % bone.orientation)
+    #endfor
+
+    lines.append("  ]\n")
+    lines.append("]\n")
+    return "".join(lines)
+  #end
+
+  def __formatMeshWeights(self, mesh):
+    assert type(mesh) == CalciumMesh
+
+    lines = []
+    lines.append("[mesh\n")
+    lines.append("  [mesh-name \"%s\"]\n" % mesh.name)
+    lines.append("  [mesh-weight-arrays\n")
+
+    value_format = self.__weight
+    value_zero   = value_format % 0.0
+
+    for weight_array in mesh.weight_arrays:
+      assert type(weight_array) == CalciumWeightArray
+
+      lines.append("      [mesh-weight-array\n")
+      if self.__bone_indices != None:
+        lines.append("        [mesh-weight-array-bone-index %d]\n" % self.__bone_indices.get(weight_array.bone_name, -1))
+      else:
+        lines.append("        [mesh-weight-array-bone \"%s\"]\n" % weight_array.bone_name)
+      #endif
+      lines.append("        [mesh-weight-array-values\n")
+
+      #
+      # Vertices that are not in the group have a weight of zero.
+      #
+
+      values = [value_zero] * mesh.vertex_count
+      for index, weight in zip(weight_array.indices, weight_array.weights):
+        values[index] = value_format % weight
+      #endfor
+      lines.append("".join(values))
+
+      lines.append("        ]\n")
+      lines.append("      ]\n")
+    #endfor
+
+    lines.append("  ]\n")
+    lines.append("]\n")
+    return "".join(lines)
+  #end
+
+  #
+  # Each influence line gives the bone indices of the vertex followed by
+  # their weights.
+  #
+
+  def __formatMeshInfluences(self, mesh):
+    assert type(mesh) == CalciumMesh
+    assert type(mesh.influences) == CalciumInfluences
+
+    mesh_influences = mesh.influences
+    count           = mesh_influences.count
+
+    if mesh_influences.quantization == "none":
+      weight_format = (" " + self.__real) * count
+    else:
+      weight_format = " %d" * count
+    #endif
+    value_format = "      [mesh-influence" + (" %d" * count) + weight_format + "]\n"
+
+    lines = []
+    lines.append("[mesh\n")
+    lines.append("  [mesh-name \"%s\"]\n" % mesh.name)
+    lines.append("  [mesh-influences\n")
+    lines.append("    [mesh-influences-count %d]\n" % count)
+    lines.append("    [mesh-influences-quantization %s]\n" % mesh_influences.quantization)
+    lines.append("    [mesh-influences-values\n")
+
+    bones   = mesh_influences.bones
+    weights = mesh_influences.weights
+    for base in range(0, mesh.vertex_count * count, count):
+      lines.append(value_format % (tuple(bones[base : base + count]) + tuple(weights[base : base + count])))
+    #endfor
+
+    lines.append("    ]\n")
+    lines.append("  ]\n")
+    lines.append("]\n")
+    return "".join(lines)
+  #end
+
+  def formatMesh(self, mesh):
+    assert type(mesh) == CalciumMesh
+    if mesh.influences != None:
+      return self.__formatMeshInfluences(mesh)
+    #endif
+    return self.__formatMeshWeights(mesh)
+  #end
+
+  def __formatKeyframes(self, curve, lines):
+    assert type(curve) == CalciumCurve
+
+    if curve.type == "orientation":
+      keyframe_format = self.__keyframe_vector4
+    else:
+      keyframe_format = self.__keyframe_vector3
+    #endif
+
+    width          = curve.width()
+    values         = curve.values
+    interpolations = curve.interpolations
+    easings        = curve.easings
+    for position, index in enumerate(curve.indices):
+      base = position * width
+      keyframe = (index, CALCIUM_INTERPOLATIONS[interpolations[position]], CALCIUM_EASINGS[easings[position]])
+      lines.append(keyframe_format % (keyframe + tuple(values[base : base + width])))
+    #endfor
+  #end
+
+  def formatCurve(self, curve):
+    assert type(curve) == CalciumCurve
+
+    lines = []
+    lines.append("    [curve\n")
+    if self.__bone_indices != None:
+      lines.append("      [curve-bone-index %d]\n" % self.__bone_indices[curve.bone_name])
+    else:
+      lines.append("      [curve-bone \"%s\"]\n" % curve.bone_name)
+    #endif
+    lines.append("      [curve-type %s]\n" % curve.type)
+
+    if self.__shared:
+      lines.append("      [curve-shared \"%s\"]]\n" % curve.keyframesHash())
+    else:
+      lines.append("      [curve-keyframes\n")
+      self.__formatKeyframes(curve, lines)
+      lines.append("    ]]\n")
+    #endif
+    lines.append("\n")
+    return "".join(lines)
+  #end
+
+  #
+  # Format the table of shared curves. Each of the given curves is written
+  # under its hash; only the type and keyframes of each curve are used.
+  #
+
+  def formatSharedCurves(self, curves):
+    assert type(curves) == list
+    assert self.__shared
+
+    lines = []
+    lines.append("[shared-curves\n")
+    lines.append("\n")
+    for curve in curves:
+      assert type(curve) == CalciumCurve
+      lines.append("    [shared-curve\n")
+      lines.append("      [shared-curve-hash \"%s\"]\n" % curve.keyframesHash())
+      lines.append("      [curve-type %s]\n" % curve.type)
+      lines.append("      [curve-keyframes\n")
+      self.__formatKeyframes(curve, lines)
+      lines.append("    ]]\n")
+      lines.append("\n")
+    #endfor
+    lines.append("]\n")
+    return "".join(lines)
+  #end
+
+  #
+  # Format one dense track of a baked action, one line per sample.
+  #
+
+  def __formatBakedTrack(self, name, values, width, action):
+    assert type(action) == CalciumBakedAction
+
+    stride       = action.bone_count * width
+    frame_format = "      [action-baked-frame" + (" " + self.__real) * stride + "]\n"
+
+    lines = []
+    lines.append("    [%s\n" % name)
+    for base in range(0, action.frame_count * stride, stride):
+      lines.append(frame_format % tuple(values[base : base + stride]))
+    #endfor
+    lines.append("    ]\n")
+    return "".join(lines)
+  #end
+
+  def __formatBakedAction(self, action):
+    assert type(action) == CalciumBakedAction
+
+    lines = []
+    lines.append("[action\n")
+    lines.append("  [action-name \"%s\"]\n" % action.name)
+    lines.append("  [action-length %d]\n" % action.length)
+    lines.append("  [action-baked\n")
+    lines.append(("    [action-baked-rate " + self.__real + "]\n") % action.rate)
+    lines.append("    [action-baked-frames %d]\n" % action.frame_count)
+    lines.append("    [action-baked-bones %d]\n" % action.bone_count)
+    lines.append(self.__formatBakedTrack("action-baked-translations", action.translations, 3, action))
+    lines.append(self.__formatBakedTrack("action-baked-orientations-xyzw", action.orientations, 4, action))
+    lines.append(self.__formatBakedTrack("action-baked-scales", action.scales, 3, action))
+    lines.append("]]\n")
+    return "".join(lines)
+  #end
+
+  def formatAction(self, action):
+    if type(action) == CalciumBakedAction:
+      return self.__formatBakedAction(action)
+    #endif
+    assert type(action) == CalciumAction
+
+    lines = []
+    lines.append("[action\n")
+    lines.append("  [action-name \"%s\"]\n" % action.name)
+    lines.append("  [action-length %d]\n" % action.length)
+    lines.append("  [curves\n")
+    lines.append("\n")
+
+    for curve in action.curves:
+      lines.append(self.formatCurve(curve))
+    #endfor
+
+    lines.append("]]\n")
+    return "".join(lines)
+  #end
+
+  def formatActionsEnd(self):
+    return "\n"
+  #end
+#endclass
+
+#
+# Write formatted elements to a text file. Formatted text is collected in
+# memory and written in large blocks, to avoid the overhead of many small
+# writes. If a profiler is given, the time spent in file writes is recorded
+# as the "write" phase. If spans are recorded, the octet offset and length
+# of each element in the UTF-8 encoded file are available from lastSpan()
+# as soon as it is written.
+#
+
+class CalciumTextSerializer:
+
+  def __init__(self, out_file, formatter, buffer_size, profiler, record_spans):
+    assert type(formatter) == CalciumTextFormatter
+    assert type(buffer_size) == int
+    assert type(record_spans) == bool
+
+    self.__out_file     = out_file
+    self.__formatter    = formatter
+    self.__buffer_size  = buffer_size
+    self.__buffer       = []
+    self.__buffered     = 0
+    self.__length       = 0
+    self.__profiler     = profiler
+    self.__record_spans = record_spans
+    self.__octets       = 0
+    self.__span         = None
+  #end
+
+  #
+  # The number of characters written so far, including buffered text.
+  #
+
+  def length(self):
+    return self.__length
+  #end
+
+  #
+  # The (offset, length) in octets of the most recently written element,
+  # and the number of octets written so far, if spans are recorded.
+  #
+
+  def lastSpan(self):
+    assert self.__record_spans
+    return self.__span
+  #end
+
+  def octets(self):
+    assert self.__record_spans
+    return self.__octets
+  #end
+
+  #
+  # Write an already formatted element.
+  #
+
+  def writeText(self, text):
+    assert type(text) == str
+    self.__buffer.append(text)
+    self.__buffered += len(text)
+    self.__length   += len(text)
+    if self.__record_spans:
+      octets = len(text.encode("utf-8"))
+      self.__span    = (self.__octets, octets)
+      self.__octets += octets
+    #endif
+    if self.__buffered >= self.__buffer_size:
+      self.flush()
+    #endif
+  #end
+
+  def writeHeader(self, fps):
+    self.writeText(self.__formatter.formatHeader(fps))
+  #end
+
+  def writeSkeleton(self, skeleton):
+    self.writeText(self.__formatter.formatSkeleton(skeleton))
+  #end
+
+  def writeMesh(self, mesh):
+    self.writeText(self.__formatter.formatMesh(mesh))
+  #end
+
+  def writeAction(self, action):
+    self.writeText(self.__formatter.formatAction(action))
+  #end
+
+  def writeActionsEnd(self):
+    self.writeText(self.__formatter.formatActionsEnd())
+  #end
+
+  def flush(self):
+    if len(self.__buffer) > 0:
+      time_start = time.perf_counter()
+      self.__out_file.write("".join(self.__buffer))
+      if self.__profiler != None:
+        self.__profiler.addTime("write", time.perf_counter() - time_start, 1)
+      #endif
+      self.__buffer   = []
+      self.__buffered = 0
+    #endif
+  #end
+#endclass
+
+#
+# Format elements and write the results to a serializer in the order in
+# which the elements were submitted. If an executor is given, formatting
+# runs in the executor's workers, and finished elements are written as
+# soon as all of the elements submitted before them are written.
+# Otherwise, elements are formatted immediately.
+#
+
+class CalciumTextFormatQueue:
+
+  def __init__(self, serializer, executor):
+    assert type(serializer) == CalciumTextSerializer
+
+    self.__serializer = serializer
+    self.__executor   = executor
+    self.__pending    = collections.deque()
+  #end
+
+  #
+  # Format the given element with the given function. If a receiver is
+  # given, it is called with the formatted text once it has been written.
+  #
+
+  def submit(self, function, element, receiver):
+    if self.__executor == None:
+      formatted = function(element)
+      self.__serializer.writeText(formatted)
+      if receiver != None:
+        receiver(formatted)
+      #endif
+      return
+    #endif
+
+    self.__pending.append((self.__executor.submit(function, element), receiver))
+    self.drain(False)
+  #end
+
+  #
+  # Write text that has already been formatted, in order with the elements
+  # submitted before it. If a receiver is given, it is called with the
+  # text once it has been written.
+  #
+
+  def submitText(self, formatted, receiver):
+    assert type(formatted) == str
+    if len(self.__pending) == 0:
+      self.__serializer.writeText(formatted)
+      if receiver != None:
+        receiver(formatted)
+      #endif
+      return
+    #endif
+
+    future = concurrent.futures.Future()
+    future.set_result(formatted)
+    self.__pending.append((future, receiver))
+  #end
+
+  #
+  # Write all finished elements that are not waiting for an earlier
+  # element. If wait is True, wait for all elements to finish.
+  #
+
+  def drain(self, wait):
+    while len(self.__pending) > 0:
+      future, receiver = self.__pending[0]
+      if not (wait or future.done()):
+        return
+      #endif
+
+      self.__pending.popleft()
+      formatted = future.result()
+      self.__serializer.writeText(formatted)
+      if receiver != None:
+        receiver(formatted)
+      #endif
+    #endwhile
+  #end
+#endclass
@@ -0,0 +1,244 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+#
+# Validate the keyframes of curve groups. A group is a set of channels
+# that are exported together, such as the X, Y and Z channels of the
+# location of a bone. The channels of a group are given as a list of
+# (channel name, keyframes) pairs, where the keyframes of a channel are a
+# list of (frame index, interpolation, easing) tuples using the Blender
+# names of the interpolation and easing, or None if the channel has no
+# F-curve.
+#
+# Each group is checked in a single pass over the keyframes of its
+# channels, using sets of frame indices rather than comparing channels
+# pairwise. Errors are appended to the given list of error texts.
+#
+
+class CalciumValidator:
+
+  __supported_interpolation = {
+    "CONSTANT" : "constant",
+    "LINEAR"   : "linear",
+    "EXPO"     : "exponential"
+  }
+
+  __supported_easing = {
+    "EASE_IN"     : "in",
+    "EASE_OUT"    : "out",
+    "EASE_IN_OUT" : "in-out"
+  }
+
+  #
+  # Check that all of the channels of a given group are present. If none
+  # of them are present, then the group is simply assumed not to exist and
+  # ignored.
+  #
+
+  def __checkAllChannelsArePresent(self, errors, action_name, group_name, channels):
+    missing = []
+    for channel_name, keyframes in channels:
+      if keyframes == None:
+        missing.append(channel_name)
+      #endif
+    #endfor
+
+    if len(missing) == len(channels):
+      return False
+    #endif
+
+    for channel_name in missing:
+      text =  "No keyframes are defined for a channel of a group.\n"
+      text += "  Action:   %s\n" % action_name
+      text += "  Group:    %s\n" % group_name
+      text += "  Channel:  %s\n" % channel_name
+      text += "  Solution: Create the same number of keyframes for all channels of the group\n"
+      errors.append(text)
+    #endfor
+    return len(missing) == 0
+  #end
+
+  #
+  # Check that all of the given group channels have the same number of
+  # keyframes.
+  #
+
+  def __checkKeyframesCountsEqual(self, errors, action_name, group_name, channels):
+    counts = set()
+    for channel_name, keyframes in channels:
+      counts.add(len(keyframes))
+    #endfor
+
+    if len(counts) > 1:
+      text  = "The channels of a group have a different number of keyframes.\n"
+      text += "  Action:                      %s\n" % action_name
+      text += "  Group:                       %s\n" % group_name
+
+      for channel_name, keyframes in channels:
+        text += "  Keyframe count for channel %s: %d\n" % (channel_name, len(keyframes))
+      #endfor
+
+      text += "  Solution: Create a matching number of keyframes for all channels in the group\n"
+      errors.append(text)
+      return False
+    #endif
+    return True
+  #end
+
+  #
+  # Check that for all keyframes k in a channel c, there is a corresponding
+  # keyframe in all other channels at the same frame as k. The frames of
+  # every channel are compared against the union of the frames of all
+  # channels.
+  #
+
+  def __checkKeyframesCorresponding(self, errors, action_name, group_name, frames_by_channel):
+    owners = {}
+    for channel_name, frames in frames_by_channel:
+      for frame_index in frames.keys():
+        owners.setdefault(frame_index, channel_name)
+      #endfor
+    #endfor
+
+    ok = True
+    for channel_name, frames in frames_by_channel:
+      if len(frames) == len(owners):
+        continue
+      #endif
+
+      for frame_index in sorted(owners.keys() - frames.keys()):
+        text =  "A keyframe for a channel of a group is missing corresponding keyframes in the other group channels.\n"
+        text += "  Action:                        %s\n" % action_name
+        text += "  Group:                         %s\n" % group_name
+        text += "  Frame at:                      %d\n" % frame_index
+        text += "  Channel:                       %s\n" % owners[frame_index]
+        text += "  Channel with missing keyframe: %s\n" % channel_name
+        text += "  Possible solution: Create a keyframe at frame %d for channel %s of group %s\n" % (frame_index, channel_name, group_name)
+        errors.append(text)
+        ok = False
+      #endfor
+    #endfor
+    return ok
+  #end
+
+  #
+  # Check that the interpolation and easing of each keyframe is supported,
+  # and the same in all channels, and collect the keyframes for export.
+  #
+
+  def __collectForExport(self, errors, action_name, group_name, frames_by_channel):
+    error     = False
+    keyframes = {}
+    for channel_name, frames in frames_by_channel:
+      for keyframe_index, (interpolation, easing) in frames.items():
+        existing = keyframes.get(keyframe_index, None)
+
+        ex_interpolation = self.__supported_interpolation.get(interpolation, None)
+        if ex_interpolation == None:
+          text = "The keyframe interpolation type is not supported.\n"
+          text += "  Action:        %s\n" % action_name
+          text += "  Group:         %s\n" % group_name
+          text += "  Channel:       %s\n" % channel_name
+          text += "  Keyframe:      %d\n" % keyframe_index
+          text += "  Interpolation: %s\n" % interpolation
+          text += "  Possible solution: Use a supported interpolation type (%s)\n" % list(self.__supported_interpolation.values())
+          errors.append(text)
+          error = True
+        elif existing != None and existing[0] != ex_interpolation:
+          text  = "The interpolation value is not the same for all channels at this keyframe.\n"
+          text += "  Action:                         %s\n" % action_name
+          text += "  Group:                          %s\n" % group_name
+          text += "  Channel:                        %s\n" % channel_name
+          text += "  Keyframe:                       %d\n" % keyframe_index
+          text += "  Interpolation:                  %s\n" % interpolation
+          text += "  Interpolation in other channel: %s\n" % existing[0]
+          text += "  Possible solution: Set the interpolation value to %s for all channels at this keyframe\n" % existing[0]
+          errors.append(text)
+          error = True
+        #endif
+
+        ex_easing = self.__supported_easing.get(easing, None)
+        if ex_easing == None:
+          text = "The keyframe easing type is not supported.\n"
+          text += "  Action:        %s\n" % action_name
+          text += "  Group:         %s\n" % group_name
+          text += "  Channel:       %s\n" % channel_name
+          text += "  Keyframe:      %d\n" % keyframe_index
+          text += "  Interpolation: %s\n" % easing
+          text += "  Possible solution: Use a supported easing type (%s)\n" % list(self.__supported_easing.values())
+          errors.append(text)
+          error = True
+        elif existing != None and existing[1] != ex_easing:
+          text  = "The easing value is not the same for all channels at this keyframe.\n"
+          text += "  Action:                         %s\n" % action_name
+          text += "  Group:                          %s\n" % group_name
+          text += "  Channel:                        %s\n" % channel_name
+          text += "  Keyframe:                       %d\n" % keyframe_index
+          text += "  Interpolation:                  %s\n" % easing
+          text += "  Interpolation in other channel: %s\n" % existing[1]
+          text += "  Possible solution: Set the easing value to %s for all channels at this keyframe\n" % existing[1]
+          errors.append(text)
+          error = True
+        #endif
+
+        if not error and existing == None:
+          keyframes[keyframe_index] = (ex_interpolation, ex_easing)
+        #endif
+      #endfor
+    #endfor
+
+    if error:
+      return None
+    #endif
+    return keyframes
+  #end
+
+  #
+  # Validate the given group. Returns a map of frame indices to the
+  # exported (interpolation, easing) of each keyframe if the group is
+  # valid, or None if the group is invalid or has no channels at all.
+  #
+
+  def validateGroup(self, errors, action_name, group_name, channels):
+    assert type(errors) == list
+    assert type(action_name) == str
+    assert type(group_name) == str
+    assert type(channels) == list
+
+    if not self.__checkAllChannelsArePresent(errors, action_name, group_name, channels):
+      return None
+    #endif
+
+    if not self.__checkKeyframesCountsEqual(errors, action_name, group_name, channels):
+      return None
+    #endif
+
+    frames_by_channel = []
+    for channel_name, keyframes in channels:
+      frames = {}
+      for frame_index, interpolation, easing in keyframes:
+        frames[frame_index] = (interpolation, easing)
+      #endfor
+      frames_by_channel.append((channel_name, frames))
+    #endfor
+
+    if not self.__checkKeyframesCorresponding(errors, action_name, group_name, frames_by_channel):
+      return None
+    #endif
+
+    return self.__collectForExport(errors, action_name, group_name, frames_by_channel)
+  #end
+#endclass
@@ -0,0 +1,38 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+#
+# Import the modules of the add-on that do not depend on Blender. The
+# __init__ module of the add-on imports bpy, so the source directory is
+# registered as the "calcium" package without running it.
+#
+
+import importlib
+import importlib.machinery
+import importlib.util
+import os
+import sys
+
+SOURCE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+def importModule(name):
+  if not ("calcium" in sys.modules):
+    package = importlib.util.module_from_spec(importlib.machinery.ModuleSpec("calcium", None, is_package=True))
+    package.__path__ = [SOURCE_DIRECTORY]
+    sys.modules["calcium"] = package
+  #endif
+  return importlib.import_module("calcium." + name)
+#end
@@ -0,0 +1,224 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import array
+import io
+import struct
+import unittest
+
+import support
+
+binary = support.importModule("binary")
+model  = support.importModule("model")
+
+#
+# The structures of the format, as documented at the start of binary.py.
+#
+
+HEADER       = struct.Struct("<8sIIiIQQQQQ")
+STRING_TABLE = struct.Struct("<II")
+SKELETON     = struct.Struct("<IIQQQQQ")
+TABLE        = struct.Struct("<II")
+MESH         = struct.Struct("<IIIIQ")
+WEIGHT_ARRAY = struct.Struct("<IIQ")
+INFLUENCES   = struct.Struct("<IIQQ")
+ACTION       = struct.Struct("<IiIIQ")
+CURVE        = struct.Struct("<IIIIQQQ")
+BAKED        = struct.Struct("<fIQQQ")
+
+def makeSkeleton():
+  return model.CalciumSkeleton("skeleton", [
+    model.CalciumBone("root", None, (0.0, 0.0, 0.0), (1.0, 1.0, 1.0), (0.0, 0.0, 0.0, 1.0)),
+    model.CalciumBone("arm", "root", (1.0, 2.0, 3.0), (1.0, 1.0, 1.0), (0.0, 0.0, 0.0, 1.0))
+  ])
+#end
+
+def makeMesh():
+  weight_arrays = [
+    model.CalciumWeightArray("arm", array.array('i', [1, 2]), array.array('f', [0.5, 1.0])),
+    model.CalciumWeightArray("other", array.array('i', [0]), array.array('f', [0.25]))
+  ]
+  return model.CalciumMesh("mesh", 3, weight_arrays, None)
+#end
+
+def makeAction():
+  builder = model.CalciumCurveBuilder("arm", "translation")
+  builder.append(1, "linear", "in", (0.0, 0.0, 0.0))
+  builder.append(5, "constant", "in-out", (1.0, 2.0, 3.0))
+  builder.append(9, "exponential", "out", (2.0, 2.0, 2.0))
+  return model.CalciumAction("walk", 8, [builder.build()])
+#end
+
+def write(bone_references, meshes, actions):
+  out_file = io.BytesIO()
+  writer   = binary.CalciumBinaryWriter(out_file, "float", bone_references, False, None, None)
+  writer.write(24, makeSkeleton(), meshes, actions)
+  return out_file.getvalue()
+#end
+
+def readArray(data, typecode, offset, count):
+  values = array.array(typecode)
+  values.frombytes(data[offset:offset + values.itemsize * count])
+  return list(values)
+#end
+
+#
+# Read the string table at the given offset. The last start of a string
+# is the size of the string data.
+#
+
+def readStrings(data, offset):
+  count, size = STRING_TABLE.unpack_from(data, offset)
+  starts = readArray(data, 'I', offset + STRING_TABLE.size, count + 1)
+  base   = offset + STRING_TABLE.size + 4 * (count + 1)
+  assert starts[count] == size
+  assert base + size <= len(data)
+  return [data[base + starts[index]:base + starts[index + 1]].decode("utf-8") for index in range(0, count)]
+#end
+
+class BinaryTest(unittest.TestCase):
+
+  def testStructSizes(self):
+    self.assertEqual(HEADER.size, 64)
+    self.assertEqual(SKELETON.size, 48)
+    self.assertEqual(MESH.size, 24)
+    self.assertEqual(WEIGHT_ARRAY.size, 16)
+    self.assertEqual(INFLUENCES.size, 24)
+    self.assertEqual(ACTION.size, 24)
+    self.assertEqual(CURVE.size, 40)
+    self.assertEqual(BAKED.size, 32)
+  #end
+
+  def testHeader(self):
+    data = write("names", [makeMesh()], [makeAction()])
+    magic, major, minor, fps, flags, strings, skeleton, meshes, actions, size = HEADER.unpack_from(data, 0)
+    self.assertEqual(magic, b"\x89CAB\r\n\x1a\n")
+    self.assertEqual((major, minor), (1, 4))
+    self.assertEqual(fps, 24)
+    self.assertEqual(flags, 0)
+    self.assertEqual(size, len(data))
+    for offset in [strings, skeleton, meshes, actions]:
+      self.assertEqual(offset % 16, 0)
+      self.assertGreaterEqual(offset, HEADER.size)
+      self.assertLess(offset, size)
+    #endfor
+
+    data = write("indices", [], [])
+    self.assertEqual(HEADER.unpack_from(data, 0)[4], 1)
+  #end
+
+  def testSkeleton(self):
+    data    = write("names", [], [])
+    header  = HEADER.unpack_from(data, 0)
+    strings = readStrings(data, header[5])
+
+    name, count, names, parents, translations, scales, orientations = SKELETON.unpack_from(data, header[6])
+    self.assertEqual(strings[name], "skeleton")
+    self.assertEqual(count, 2)
+    for offset in [names, parents, translations, scales, orientations]:
+      self.assertEqual(offset % 16, 0)
+    #endfor
+    self.assertEqual([strings[index] for index in readArray(data, 'i', names, 2)], ["root", "arm"])
+    self.assertEqual(readArray(data, 'i', parents, 2), [-1, 0])
+    self.assertEqual(readArray(data, 'f', translations, 6), [0.0, 0.0, 0.0, 1.0, 2.0, 3.0])
+    self.assertEqual(readArray(data, 'f', orientations, 8), [0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0])
+  #end
+
+  def testWeightArrays(self):
+    for bone_references in ["names", "indices"]:
+      data    = write(bone_references, [makeMesh()], [])
+      header  = HEADER.unpack_from(data, 0)
+      strings = readStrings(data, header[5])
+
+      self.assertEqual(TABLE.unpack_from(data, header[7]), (1, 0))
+      name, vertex_count, array_count, layout, records = MESH.unpack_from(data, header[7] + TABLE.size)
+      self.assertEqual(strings[name], "mesh")
+      self.assertEqual((vertex_count, array_count, layout), (3, 2, 0))
+      self.assertEqual(records % 16, 0)
+
+      bones   = []
+      weights = []
+      for index in range(0, array_count):
+        bone, reserved, offset = WEIGHT_ARRAY.unpack_from(data, records + index * WEIGHT_ARRAY.size)
+        self.assertEqual(reserved, 0)
+        self.assertEqual(offset % 16, 0)
+        bones.append(bone)
+        weights.append(readArray(data, 'f', offset, vertex_count))
+      #endfor
+
+      if bone_references == "names":
+        self.assertEqual([strings[bone] for bone in bones], ["arm", "other"])
+      else:
+        self.assertEqual(bones, [1, 0xffffffff])
+      #endif
+      self.assertEqual(weights, [[0.0, 0.5, 1.0], [0.25, 0.0, 0.0]])
+    #endfor
+  #end
+
+  def testInfluences(self):
+    mesh = model.CalciumMesh("mesh", 2, [], model.CalciumInfluences(2, "uint8",
+      array.array('H', [1, 0, 0, 1]), array.array('B', [255, 0, 200, 55])))
+    data   = write("indices", [mesh], [])
+    header = HEADER.unpack_from(data, 0)
+
+    name, vertex_count, count, layout, record = MESH.unpack_from(data, header[7] + TABLE.size)
+    self.assertEqual((vertex_count, count, layout), (2, 2, 1))
+    quantization, reserved, bones, weights = INFLUENCES.unpack_from(data, record)
+    self.assertEqual(quantization, 1)
+    self.assertEqual(readArray(data, 'H', bones, 4), [1, 0, 0, 1])
+    self.assertEqual(readArray(data, 'B', weights, 4), [255, 0, 200, 55])
+  #end
+
+  def testCurves(self):
+    data    = write("names", [], [makeAction()])
+    header  = HEADER.unpack_from(data, 0)
+    strings = readStrings(data, header[5])
+
+    self.assertEqual(TABLE.unpack_from(data, header[8]), (1, 0))
+    name, length, curve_count, kind, records = ACTION.unpack_from(data, header[8] + TABLE.size)
+    self.assertEqual(strings[name], "walk")
+    self.assertEqual((length, curve_count, kind), (8, 1, 0))
+
+    bone, curve_type, keyframes, encoding, indices, modes, values = CURVE.unpack_from(data, records)
+    self.assertEqual(strings[bone], "arm")
+    self.assertEqual((curve_type, keyframes, encoding), (0, 3, 0))
+    for offset in [indices, modes, values]:
+      self.assertEqual(offset % 16, 0)
+    #endfor
+    self.assertEqual(readArray(data, 'i', indices, 3), [1, 5, 9])
+    self.assertEqual(readArray(data, 'i', modes, 3), [1 | (0 << 8), 0 | (2 << 8), 2 | (1 << 8)])
+    self.assertEqual(readArray(data, 'f', values, 9), [0.0, 0.0, 0.0, 1.0, 2.0, 3.0, 2.0, 2.0, 2.0])
+  #end
+
+  def testBakedAction(self):
+    action = model.CalciumBakedAction("baked", 2, 24.0, 3, 2,
+      array.array('f', range(0, 18)), array.array('f', range(0, 24)), array.array('f', [1.0] * 18))
+    data   = write("indices", [], [action])
+    header = HEADER.unpack_from(data, 0)
+
+    name, length, samples, kind, record = ACTION.unpack_from(data, header[8] + TABLE.size)
+    self.assertEqual((length, samples, kind), (2, 3, 1))
+    rate, bone_count, translations, orientations, scales = BAKED.unpack_from(data, record)
+    self.assertEqual((rate, bone_count), (24.0, 2))
+    self.assertEqual(readArray(data, 'f', translations, 18), [float(value) for value in range(0, 18)])
+    self.assertEqual(readArray(data, 'f', orientations, 24), [float(value) for value in range(0, 24)])
+    self.assertEqual(readArray(data, 'f', scales, 18), [1.0] * 18)
+  #end
+#endclass
+
+if __name__ == "__main__":
+  unittest.main()
+#endif
@@ -0,0 +1,179 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import array
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import support
+
+cache = support.importModule("cache")
+model = support.importModule("model")
+
+def makeAction():
+  builder = model.CalciumCurveBuilder("arm", "orientation")
+  builder.append(1, "linear", "in", (0.0, 0.0, 0.0, 1.0))
+  builder.append(5, "exponential", "in-out", (0.0, 0.5, 0.0, 0.5))
+  return model.CalciumAction("walk", 8, [builder.build()])
+#end
+
+class CacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path      = os.path.join(self.directory, "out.ca.cache")
+  #end
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+  #end
+
+  def assertActionsEqual(self, a, b):
+    self.assertEqual(type(a), model.CalciumAction)
+    self.assertEqual((a.name, a.length, len(a.curves)), (b.name, b.length, len(b.curves)))
+    for curve_a, curve_b in zip(a.curves, b.curves):
+      self.assertEqual((curve_a.bone_name, curve_a.type), (curve_b.bone_name, curve_b.type))
+      self.assertEqual(curve_a.indices, curve_b.indices)
+      self.assertEqual(curve_a.interpolations, curve_b.interpolations)
+      self.assertEqual(curve_a.easings, curve_b.easings)
+      self.assertEqual(curve_a.values, curve_b.values)
+    #endfor
+  #end
+
+  def testMissingFile(self):
+    entries = cache.CalciumExportCache(self.path)
+    self.assertEqual(entries.loadedCount(), 0)
+    self.assertFalse(entries.contains("a"))
+  #end
+
+  def testEntrySurvivesSave(self):
+    action  = makeAction()
+    entries = cache.CalciumExportCache(self.path)
+    entries.put("a", action)
+    entries.put("b", "[action\n]]\n")
+    entries.save()
+
+    loaded = cache.CalciumExportCache(self.path)
+    self.assertEqual(loaded.loadedCount(), 2)
+    self.assertTrue(loaded.contains("a"))
+    self.assertActionsEqual(loaded.get("a"), action)
+    self.assertEqual(loaded.get("b"), "[action\n]]\n")
+    self.assertFalse(os.path.exists(self.path + ".tmp"))
+  #end
+
+  def testUnusedEntriesAreDropped(self):
+    entries = cache.CalciumExportCache(self.path)
+    entries.put("a", "first")
+    entries.put("b", "second")
+    entries.save()
+
+    loaded = cache.CalciumExportCache(self.path)
+    self.assertEqual(loaded.get("b"), "second")
+    loaded.put("c", "third")
+    loaded.save()
+
+    loaded = cache.CalciumExportCache(self.path)
+    self.assertEqual(loaded.loadedCount(), 2)
+    self.assertFalse(loaded.contains("a"))
+    self.assertEqual(loaded.get("b"), "second")
+    self.assertEqual(loaded.get("c"), "third")
+  #end
+
+  def testFormattedEntrySurvivesSave(self):
+    action  = makeAction()
+    counts  = {"curves" : 1, "keyframes" : 2}
+    entries = cache.CalciumExportCache(self.path)
+    entries.put("a", ("[action\n]]\n", action.curves, counts))
+    entries.save()
+
+    formatted, curves, loaded_counts = cache.CalciumExportCache(self.path).get("a")
+    self.assertEqual(formatted, "[action\n]]\n")
+    self.assertEqual(loaded_counts, counts)
+    self.assertActionsEqual(model.CalciumAction("walk", 8, curves), action)
+  #end
+
+  def testBakedActionSurvivesSave(self):
+    action = model.CalciumBakedAction("baked", 2, 24.0, 3, 1,
+      array.array('f', range(0, 9)), array.array('f', range(0, 12)), array.array('f', [1.0] * 9))
+    entries = cache.CalciumExportCache(self.path)
+    entries.put("a", action)
+    entries.save()
+
+    loaded = cache.CalciumExportCache(self.path).get("a")
+    self.assertEqual(type(loaded), model.CalciumBakedAction)
+    self.assertEqual((loaded.name, loaded.length, loaded.rate, loaded.frame_count, loaded.bone_count), ("baked", 2, 24.0, 3, 1))
+    self.assertEqual(loaded.translations, action.translations)
+    self.assertEqual(loaded.orientations, action.orientations)
+    self.assertEqual(loaded.scales, action.scales)
+  #end
+
+  def testFileIsJSON(self):
+    entries = cache.CalciumExportCache(self.path)
+    entries.put("a", makeAction())
+    entries.save()
+
+    with open(self.path, "rt", encoding="utf-8") as cache_file:
+      document = json.load(cache_file)
+    #endwith
+    self.assertEqual(document["version"], cache.CalciumExportCache.VERSION)
+    self.assertEqual(list(document["entries"].keys()), ["a"])
+  #end
+
+  def testInvalidEntries(self):
+    invalid = [
+      {"array" : "q", "data" : ""},
+      {"array" : "f", "data" : "not base64"},
+      {"action" : ["walk", 8, ["not a curve"]]},
+      {"curve" : ["arm", "unknown", [], [], [], []]},
+      {"unknown" : 1}
+    ]
+    for value in invalid:
+      with open(self.path, "wt", encoding="utf-8") as cache_file:
+        json.dump({"version" : cache.CalciumExportCache.VERSION, "entries" : {"a" : value}}, cache_file)
+      #endwith
+      self.assertEqual(cache.CalciumExportCache(self.path).loadedCount(), 0)
+    #endfor
+  #end
+
+  def testOtherVersion(self):
+    entries = cache.CalciumExportCache(self.path)
+    entries.put("a", "first")
+    entries.save()
+
+    with open(self.path, "rt", encoding="utf-8") as cache_file:
+      document = json.load(cache_file)
+    #endwith
+    document["version"] += 1
+    with open(self.path, "wt", encoding="utf-8") as cache_file:
+      json.dump(document, cache_file)
+    #endwith
+    self.assertEqual(cache.CalciumExportCache(self.path).loadedCount(), 0)
+  #end
+
+  def testUnreadableFile(self):
+    with open(self.path, "wb") as cache_file:
+      cache_file.write(b"not a cache")
+    #endwith
+    self.assertEqual(cache.CalciumExportCache(self.path).loadedCount(), 0)
+  #end
+#endclass
+
+if __name__ == "__main__":
+  unittest.main()
+#endif
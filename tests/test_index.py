@@ -0,0 +1,207 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import array
+import io
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import support
+
+binary = support.importModule("binary")
+index  = support.importModule("index")
+model  = support.importModule("model")
+text   = support.importModule("text")
+
+SKELETON     = struct.Struct("<IIQQQQQ")
+WEIGHT_ARRAY = struct.Struct("<IIQ")
+CURVE        = struct.Struct("<IIIIQQQ")
+
+def makeSkeleton():
+  return model.CalciumSkeleton("skéleton", [
+    model.CalciumBone("root", None, (0.0, 0.0, 0.0), (1.0, 1.0, 1.0), (0.0, 0.0, 0.0, 1.0)),
+    model.CalciumBone("arm", "root", (1.0, 2.0, 3.0), (1.0, 1.0, 1.0), (0.0, 0.0, 0.0, 1.0))
+  ])
+#end
+
+def makeMeshes():
+  weight_arrays = [
+    model.CalciumWeightArray("arm", array.array('i', [1, 2]), array.array('f', [0.5, 1.0])),
+    model.CalciumWeightArray("root", array.array('i', [0]), array.array('f', [0.25]))
+  ]
+  return [model.CalciumMesh("mésh", 3, weight_arrays, None)]
+#end
+
+def makeActions():
+  translation = model.CalciumCurveBuilder("arm", "translation")
+  translation.append(1, "linear", "in", (0.0, 0.0, 0.0))
+  translation.append(5, "linear", "in", (1.0, 2.0, 3.0))
+  orientation = model.CalciumCurveBuilder("root", "orientation")
+  orientation.append(1, "linear", "in", (0.0, 0.0, 0.0, 1.0))
+  walk = model.CalciumAction("walk", 4, [translation.build(), orientation.build()])
+  idle = model.CalciumAction("idle", 4, [translation.build()])
+  return [walk, idle]
+#end
+
+def writeText(contents):
+  formatter  = text.CalciumTextFormatter(6, None, False, False)
+  out_file   = io.StringIO()
+  serializer = text.CalciumTextSerializer(out_file, formatter, 1 << 20, None, True)
+
+  serializer.writeHeader(24)
+  skeleton = makeSkeleton()
+  serializer.writeSkeleton(skeleton)
+  contents.setSkeleton(serializer.lastSpan(), index.skeletonCounts(skeleton))
+  for mesh in makeMeshes():
+    serializer.writeMesh(mesh)
+    contents.addMesh(serializer.lastSpan(), index.meshCounts(mesh))
+  #endfor
+  for action in makeActions():
+    serializer.writeAction(action)
+    contents.addAction(serializer.lastSpan(), index.actionCounts(action))
+  #endfor
+  serializer.writeActionsEnd()
+  serializer.flush()
+  contents.setLength(serializer.octets())
+  return out_file.getvalue().encode("utf-8")
+#end
+
+def writeBinary(contents):
+  out_file = io.BytesIO()
+  writer   = binary.CalciumBinaryWriter(out_file, "float", "names", False, None, contents)
+  writer.write(24, makeSkeleton(), makeMeshes(), makeActions())
+  return out_file.getvalue()
+#end
+
+class IndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path      = os.path.join(self.directory, "out.ca.idx")
+  #end
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+  #end
+
+  def readIndex(self, file_format, contents, starts):
+    index.writeIndex(self.path, file_format, "none", contents, starts)
+    with open(self.path, "rt") as index_file:
+      document = json.load(index_file)
+    #endwith
+    self.assertEqual(document["version"], index.CALCIUM_INDEX_VERSION)
+    self.assertEqual(document["format"], file_format)
+    self.assertEqual(document["compression"], "none")
+    return document
+  #end
+
+  def slice(self, data, entry):
+    self.assertLessEqual(entry["offset"] + entry["length"], len(data))
+    return data[entry["offset"]:entry["offset"] + entry["length"]]
+  #end
+
+  def testText(self):
+    contents = index.CalciumContents("armature")
+    data     = writeText(contents)
+    armature = self.readIndex("text", [contents], [0])["armatures"][0]
+
+    formatter = text.CalciumTextFormatter(6, None, False, False)
+    self.assertEqual((armature["name"], armature["offset"], armature["length"]), ("armature", 0, len(data)))
+
+    skeleton = armature["skeleton"]
+    self.assertEqual(skeleton["bones"], 2)
+    self.assertEqual(self.slice(data, skeleton), formatter.formatSkeleton(makeSkeleton()).encode("utf-8"))
+
+    self.assertEqual(len(armature["meshes"]), 1)
+    mesh = armature["meshes"][0]
+    self.assertEqual((mesh["name"], mesh["vertices"], mesh["weight_arrays"]), ("mésh", 3, 2))
+    self.assertEqual(self.slice(data, mesh), formatter.formatMesh(makeMeshes()[0]).encode("utf-8"))
+
+    actions = armature["actions"]
+    self.assertEqual([(action["name"], action["curves"], action["keyframes"]) for action in actions], [("walk", 2, 3), ("idle", 1, 2)])
+    for entry, action in zip(actions, makeActions()):
+      self.assertEqual(self.slice(data, entry), formatter.formatAction(action).encode("utf-8"))
+    #endfor
+    self.assertNotIn("shared_curves", armature)
+  #end
+
+  def testCombinedStarts(self):
+    first  = index.CalciumContents("a")
+    second = index.CalciumContents("b")
+    data   = writeText(first)
+    data  += writeText(second)
+    armatures = self.readIndex("text", [first, second], [0, first.length()])["armatures"]
+
+    self.assertEqual(armatures[1]["offset"], armatures[0]["length"])
+    self.assertEqual(armatures[1]["offset"] + armatures[1]["length"], len(data))
+    for position in range(0, 2):
+      self.assertEqual(self.slice(data, armatures[1]["actions"][position]), self.slice(data, armatures[0]["actions"][position]))
+      self.assertEqual(armatures[1]["actions"][position]["offset"], armatures[0]["actions"][position]["offset"] + first.length())
+    #endfor
+  #end
+
+  def testBinary(self):
+    contents = index.CalciumContents("armature")
+    data     = writeBinary(contents)
+    armature = self.readIndex("binary", [contents], [0])["armatures"][0]
+
+    header = binary.CalciumBinaryWriter.HEADER_STRUCT.unpack_from(data, 0)
+    self.assertEqual(armature["length"], len(data))
+
+    #
+    # Each span holds the arrays of the element followed by its records,
+    # and spans follow each other in order without overlapping.
+    #
+
+    skeleton = armature["skeleton"]
+    self.assertEqual(skeleton["offset"] % 16, 0)
+    self.assertEqual(skeleton["offset"] + skeleton["length"], header[6] + SKELETON.size)
+    bone_names = SKELETON.unpack_from(data, header[6])[2]
+    self.assertGreaterEqual(bone_names, skeleton["offset"])
+
+    mesh = armature["meshes"][0]
+    self.assertGreaterEqual(mesh["offset"], skeleton["offset"] + skeleton["length"])
+    records = binary.CalciumBinaryWriter.MESH_STRUCT.unpack_from(data, header[7] + 8)[4]
+    self.assertEqual(mesh["offset"] + mesh["length"], records + 2 * WEIGHT_ARRAY.size)
+    for position in range(0, 2):
+      weights = WEIGHT_ARRAY.unpack_from(data, records + position * WEIGHT_ARRAY.size)[2]
+      self.assertGreaterEqual(weights, mesh["offset"])
+    #endfor
+
+    previous_end = mesh["offset"] + mesh["length"]
+    for position, entry in enumerate(armature["actions"]):
+      self.assertEqual(entry["offset"] % 16, 0)
+      self.assertGreaterEqual(entry["offset"], previous_end)
+      name, length, curve_count, kind, records = binary.CalciumBinaryWriter.ACTION_STRUCT.unpack_from(data, header[8] + 8 + position * 24)
+      self.assertEqual(curve_count, entry["curves"])
+      self.assertEqual(entry["offset"] + entry["length"], records + curve_count * CURVE.size)
+      for curve in range(0, curve_count):
+        keyframes = CURVE.unpack_from(data, records + curve * CURVE.size)[4]
+        self.assertGreaterEqual(keyframes, entry["offset"])
+      #endfor
+      previous_end = entry["offset"] + entry["length"]
+    #endfor
+    self.assertLessEqual(previous_end, header[8])
+  #end
+#endclass
+
+if __name__ == "__main__":
+  unittest.main()
+#endif
@@ -0,0 +1,98 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import array
+import unittest
+
+import support
+
+influences = support.importModule("influences")
+model      = support.importModule("model")
+
+BONE_INDICES = {"a" : 0, "b" : 1, "c" : 2, "d" : 3}
+
+def makeMesh(vertex_count, weights):
+  weight_arrays = []
+  for bone_name, vertex_weights in weights:
+    indices = array.array('i', [vertex for vertex, weight in vertex_weights])
+    values  = array.array('f', [weight for vertex, weight in vertex_weights])
+    weight_arrays.append(model.CalciumWeightArray(bone_name, indices, values))
+  #endfor
+  return model.CalciumMesh("mesh", vertex_count, weight_arrays, None)
+#end
+
+class InfluencesTest(unittest.TestCase):
+
+  def testTruncationAndRenormalization(self):
+    mesh = makeMesh(1, [
+      ("a", [(0, 0.1)]),
+      ("b", [(0, 0.4)]),
+      ("c", [(0, 0.2)]),
+      ("d", [(0, 0.3)])
+    ])
+    result = influences.calculateInfluences(mesh, BONE_INDICES, 2, "none")
+    self.assertEqual(result.count, 2)
+    self.assertEqual(list(result.bones), [1, 3])
+    self.assertAlmostEqual(result.weights[0], 0.4 / 0.7, places=6)
+    self.assertAlmostEqual(result.weights[1], 0.3 / 0.7, places=6)
+  #end
+
+  def testPadding(self):
+    mesh   = makeMesh(2, [("c", [(0, 0.5)])])
+    result = influences.calculateInfluences(mesh, BONE_INDICES, 4, "none")
+    self.assertEqual(list(result.bones), [2, 0, 0, 0, 0, 0, 0, 0])
+    self.assertEqual(list(result.weights), [1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+  #end
+
+  def testUnknownBonesAndZeroWeights(self):
+    mesh = makeMesh(1, [
+      ("unknown", [(0, 0.9)]),
+      ("a", [(0, 0.0)]),
+      ("b", [(0, 0.25)])
+    ])
+    result = influences.calculateInfluences(mesh, BONE_INDICES, 2, "none")
+    self.assertEqual(list(result.bones), [1, 0])
+    self.assertEqual(list(result.weights), [1.0, 0.0])
+  #end
+
+  def testQuantizedWeightsSum(self):
+    weights = []
+    for bone_name, bone_index in sorted(BONE_INDICES.items()):
+      weights.append((bone_name, [(vertex, ((vertex * 7 + bone_index * 3) % 11 + 1) / 13.0) for vertex in range(0, 100)]))
+    #endfor
+    mesh = makeMesh(100, weights)
+
+    for quantization, maximum, count in [("uint8", 255, 4), ("uint8", 255, 3), ("uint16", 65535, 3)]:
+      result = influences.calculateInfluences(mesh, BONE_INDICES, count, quantization)
+      self.assertEqual(result.weights.typecode, influences.CALCIUM_INFLUENCE_TYPECODES[quantization])
+      for vertex in range(0, 100):
+        vertex_weights = result.weights[vertex * count:(vertex + 1) * count]
+        self.assertEqual(sum(vertex_weights), maximum)
+      #endfor
+    #endfor
+  #end
+
+  def testQuantizeWeights(self):
+    self.assertEqual(influences.quantizeWeights([1.0 / 3.0] * 3, 255), [85, 85, 85])
+    self.assertEqual(influences.quantizeWeights([0.5, 0.25, 0.25], 255), [127, 64, 64])
+    self.assertEqual(sum(influences.quantizeWeights([0.4, 0.3, 0.2, 0.1], 255)), 255)
+    self.assertEqual(influences.quantizeWeights([], 255), [])
+  #end
+#endclass
+
+if __name__ == "__main__":
+  unittest.main()
+#endif
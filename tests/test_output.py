@@ -0,0 +1,105 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import threading
+import unittest
+
+import support
+
+output = support.importModule("output")
+
+#
+# An output file that records each write. If a gate is given, each write
+# waits for it to open, so that blocks queue up behind the first one.
+#
+
+class RecordingFile:
+
+  def __init__(self, gate, failure):
+    self.blocks  = []
+    self.started = threading.Event()
+    self.gate    = gate
+    self.failure = failure
+  #end
+
+  def write(self, block):
+    self.started.set()
+    if self.gate != None:
+      self.gate.wait()
+    #endif
+    if self.failure != None:
+      raise self.failure
+    #endif
+    self.blocks.append(block)
+    return len(block)
+  #end
+#endclass
+
+class OutputThreadTest(unittest.TestCase):
+
+  def testBlocks(self):
+    out_file      = RecordingFile(None, None)
+    output_thread = output.CalciumOutputThread(out_file, 2, 4)
+    text_file     = output_thread.file()
+    for text in ["ab", "cd", "e", "fghij", "k"]:
+      self.assertEqual(text_file.write(text), len(text))
+    #endfor
+
+    self.assertEqual(output_thread.finish(False), None)
+    self.assertEqual(out_file.blocks, ["abcd", "efghij", "k"])
+    self.assertEqual(output_thread.blocks(), 3)
+    self.assertEqual(output_thread.finish(False), None)
+  #end
+
+  def testFailure(self):
+    failure       = OSError("disk full")
+    out_file      = RecordingFile(None, failure)
+    output_thread = output.CalciumOutputThread(out_file, 4, 1)
+    for text in ["a", "b", "c"]:
+      output_thread.put(text)
+    #endfor
+
+    self.assertIs(output_thread.finish(False), failure)
+    self.assertEqual(out_file.blocks, [])
+    self.assertEqual(output_thread.blocks(), 1)
+  #end
+
+  def testDiscard(self):
+    gate          = threading.Event()
+    out_file      = RecordingFile(gate, None)
+    output_thread = output.CalciumOutputThread(out_file, 4, 1)
+    output_thread.put("a")
+    self.assertTrue(out_file.started.wait(10.0))
+    output_thread.put("b")
+    output_thread.put("c")
+
+    #
+    # The first block is being written while the exporter gives up, so
+    # only the blocks still in the queue are discarded.
+    #
+
+    timer = threading.Timer(0.1, gate.set)
+    timer.start()
+    self.assertEqual(output_thread.finish(True), None)
+    timer.join()
+    self.assertEqual(out_file.blocks, ["a"])
+    self.assertEqual(output_thread.blocks(), 1)
+  #end
+#endclass
+
+if __name__ == "__main__":
+  unittest.main()
+#endif
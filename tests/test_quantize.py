@@ -0,0 +1,167 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import math
+import unittest
+
+import support
+
+model    = support.importModule("model")
+quantize = support.importModule("quantize")
+reduce   = support.importModule("reduce")
+
+#
+# The largest angle between an original and a decoded quaternion. Each of
+# the three stored components is within half a quantization step of the
+# original, so the error is bounded by a small multiple of that step.
+#
+
+SMALLEST_THREE_ANGLE = 2.0e-4
+
+def makeCurve(curve_type, values):
+  builder = model.CalciumCurveBuilder("bone", curve_type)
+  for index, value in enumerate(values):
+    builder.append(index, "linear", "in", value)
+  #endfor
+  return builder.build()
+#end
+
+def quaternions():
+  result = [(0.0, 0.0, 0.0, 1.0), (1.0, 0.0, 0.0, 0.0), (0.0, -1.0, 0.0, 0.0), (0.5, 0.5, 0.5, 0.5)]
+  for step in range(0, 64):
+    axis  = (math.sin(step * 0.7), math.cos(step * 1.3), math.sin(step * 2.1) + 0.1)
+    size  = math.sqrt(sum(c * c for c in axis))
+    angle = step * 0.37 - 6.0
+    scale = math.sin(angle / 2.0) / size
+    result.append((axis[0] * scale, axis[1] * scale, axis[2] * scale, math.cos(angle / 2.0)))
+  #endfor
+  return result
+#end
+
+class SmallestThreeTest(unittest.TestCase):
+
+  def testRoundTrip(self):
+    for q in quaternions():
+      words = quantize.encodeSmallestThree(q)
+      self.assertEqual(len(words), 3)
+      for word in words:
+        self.assertTrue(0 <= word <= 0xffff)
+      #endfor
+      self.assertEqual(words[2] >> 15, 0)
+
+      decoded = quantize.decodeSmallestThree(words)
+      self.assertAlmostEqual(sum(c * c for c in decoded), 1.0, places=6)
+      self.assertLess(reduce.quaternionAngle(q, decoded), SMALLEST_THREE_ANGLE)
+    #endfor
+  #end
+
+  def testDroppedComponent(self):
+    for largest in range(0, 4):
+      q = [0.1, 0.1, 0.1, 0.1]
+      q[largest] = -0.9
+      words = quantize.encodeSmallestThree(q)
+      bits  = words[0] | (words[1] << 16) | (words[2] << 32)
+      self.assertEqual((bits >> 45) & 0x3, largest)
+    #endfor
+  #end
+
+  def testUnnormalizedInput(self):
+    for q in quaternions():
+      scaled  = tuple(c * 1.5 for c in q)
+      decoded = quantize.decodeSmallestThree(quantize.encodeSmallestThree(scaled))
+      self.assertLess(reduce.quaternionAngle(q, decoded), SMALLEST_THREE_ANGLE)
+    #endfor
+  #end
+#endclass
+
+class RangeTest(unittest.TestCase):
+
+  def testRoundTrip(self):
+    vectors = [(float(index), math.sin(index) * 100.0, -0.001 * index) for index in range(0, 50)]
+    minimum, maximum, quantized = quantize.quantizeRange(vectors, 3)
+    self.assertEqual(len(quantized), 150)
+    self.assertEqual(minimum[0], 0.0)
+    self.assertEqual(maximum[0], 49.0)
+
+    for index, vector in enumerate(vectors):
+      decoded = quantize.dequantizeRange(minimum, maximum, quantized, index)
+      for component in range(0, 3):
+        step = (maximum[component] - minimum[component]) / quantize.CALCIUM_QUANTIZE_RANGE_MAXIMUM
+        self.assertLessEqual(abs(decoded[component] - vector[component]), step * 0.5 + 1.0e-6)
+      #endfor
+    #endfor
+  #end
+
+  def testExtremesAreExact(self):
+    vectors = [(0.0, 1.0, 2.0), (4.0, 5.0, 6.0)]
+    minimum, maximum, quantized = quantize.quantizeRange(vectors, 3)
+    self.assertEqual(list(quantized), [0, 0, 0, 65535, 65535, 65535])
+    self.assertEqual(quantize.dequantizeRange(minimum, maximum, quantized, 0), vectors[0])
+    self.assertEqual(quantize.dequantizeRange(minimum, maximum, quantized, 1), vectors[1])
+  #end
+
+  def testConstantComponent(self):
+    vectors = [(1.0, 2.0, 3.0), (1.0, 4.0, 3.0)]
+    minimum, maximum, quantized = quantize.quantizeRange(vectors, 3)
+    self.assertEqual(list(quantized), [0, 0, 0, 0, 65535, 0])
+    self.assertEqual(quantize.dequantizeRange(minimum, maximum, quantized, 1), vectors[1])
+  #end
+#endclass
+
+class EncodeCurveTest(unittest.TestCase):
+
+  def testFloat(self):
+    curve   = makeCurve("translation", [(1.0, 2.0, 3.0), (4.0, 5.0, 6.0)])
+    encoded = quantize.encodeCurve(curve, "float")
+    self.assertEqual(encoded.encoding, "float")
+    self.assertEqual(list(encoded.values), [1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+    self.assertEqual(encoded.error, 0.0)
+  #end
+
+  def testConstant(self):
+    curve   = makeCurve("scale", [(1.0, 1.0, 1.0)] * 5)
+    encoded = quantize.encodeCurve(curve, "quantized")
+    self.assertEqual(encoded.encoding, "constant")
+    self.assertEqual(list(encoded.values), [1.0, 1.0, 1.0])
+    self.assertEqual(len(encoded.header), 0)
+  #end
+
+  def testQuantizedTranslation(self):
+    curve   = makeCurve("translation", [(0.0, 0.0, 0.0), (0.3, 1.0, -2.0), (1.0, 0.5, 2.0)])
+    encoded = quantize.encodeCurve(curve, "quantized")
+    self.assertEqual(encoded.encoding, "quantized")
+    self.assertEqual(list(encoded.header), [0.0, 0.0, -2.0, 1.0, 1.0, 2.0])
+    self.assertEqual(len(encoded.values), 9)
+    self.assertGreater(encoded.error, 0.0)
+    self.assertLess(encoded.error, 1.0e-4)
+  #end
+
+  def testQuantizedOrientation(self):
+    values  = quaternions()
+    encoded = quantize.encodeCurve(makeCurve("orientation", values), "quantized")
+    self.assertEqual(encoded.encoding, "quantized")
+    self.assertEqual(len(encoded.values), len(values) * 3)
+    self.assertLess(encoded.error, SMALLEST_THREE_ANGLE)
+
+    scaled  = [tuple(c * 2.0 for c in q) for q in values]
+    encoded = quantize.encodeCurve(makeCurve("orientation", scaled), "quantized")
+    self.assertLess(encoded.error, SMALLEST_THREE_ANGLE)
+  #end
+#endclass
+
+if __name__ == "__main__":
+  unittest.main()
+#endif
@@ -0,0 +1,214 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import math
+import unittest
+
+import support
+
+model  = support.importModule("model")
+reduce = support.importModule("reduce")
+
+def makeCurve(curve_type, keyframes):
+  builder = model.CalciumCurveBuilder("bone", curve_type)
+  for index, interpolation, value in keyframes:
+    builder.append(index, interpolation, "in", value)
+  #endfor
+  return builder.build()
+#end
+
+def rotationZ(angle):
+  return (0.0, 0.0, math.sin(angle / 2.0), math.cos(angle / 2.0))
+#end
+
+class ReduceTest(unittest.TestCase):
+
+  def testCollinearKeyframesAreRemoved(self):
+    curve = makeCurve("translation", [(index, "linear", (float(index), 0.0, 0.0)) for index in range(0, 6)])
+    reduced, error = reduce.reduceCurve(curve, 0.001)
+    self.assertEqual(list(reduced.indices), [0, 5])
+    self.assertAlmostEqual(error, 0.0)
+  #end
+
+  def testToleranceAndMaximumError(self):
+    curve = makeCurve("translation", [
+      (0, "linear", (0.0, 0.0, 0.0)),
+      (1, "linear", (1.0, 0.05, 0.0)),
+      (2, "linear", (2.0, 0.0, 0.0)),
+      (3, "linear", (3.0, 0.5, 0.0)),
+      (4, "linear", (4.0, 0.0, 0.0))
+    ])
+
+    reduced, error = reduce.reduceCurve(curve, 0.1)
+    self.assertEqual(list(reduced.indices), [0, 2, 3, 4])
+    self.assertAlmostEqual(error, 0.05)
+
+    reduced, error = reduce.reduceCurve(curve, 1.0)
+    self.assertEqual(list(reduced.indices), [0, 4])
+    self.assertAlmostEqual(error, 0.5)
+
+    reduced, error = reduce.reduceCurve(curve, 0.01)
+    self.assertEqual(list(reduced.indices), [0, 1, 2, 3, 4])
+    self.assertEqual(error, 0.0)
+  #end
+
+  def testMixedInterpolationRuns(self):
+    curve = makeCurve("translation", [
+      (0, "linear",      (0.0, 0.0, 0.0)),
+      (1, "linear",      (1.0, 0.0, 0.0)),
+      (2, "constant",    (2.0, 0.0, 0.0)),
+      (3, "constant",    (2.0, 0.0, 0.0)),
+      (4, "exponential", (2.0, 0.0, 0.0)),
+      (5, "exponential", (2.0, 0.0, 0.0)),
+      (6, "exponential", (2.0, 0.0, 0.0)),
+      (7, "linear",      (9.0, 0.0, 0.0))
+    ])
+
+    #
+    # The first keyframe of each run is kept, and keyframes with
+    # exponential interpolation are never removed.
+    #
+
+    reduced, error = reduce.reduceCurve(curve, 0.001)
+    self.assertEqual(list(reduced.indices), [0, 2, 4, 5, 6, 7])
+    self.assertEqual(list(reduced.interpolations), [curve.interpolations[index] for index in [0, 2, 4, 5, 6, 7]])
+    self.assertAlmostEqual(error, 0.0)
+  #end
+
+  def testConstantRunKeepsChangedValues(self):
+    curve = makeCurve("scale", [
+      (0, "constant", (1.0, 1.0, 1.0)),
+      (1, "constant", (1.0, 1.0, 1.0)),
+      (2, "constant", (2.0, 1.0, 1.0)),
+      (3, "constant", (2.0, 1.0, 1.0))
+    ])
+    reduced, error = reduce.reduceCurve(curve, 0.001)
+    self.assertEqual(list(reduced.indices), [0, 2, 3])
+  #end
+
+  def testSlerp(self):
+    curve = makeCurve("orientation", [(index, "linear", rotationZ(index * math.pi / 8.0)) for index in range(0, 5)])
+    reduced, error = reduce.reduceCurve(curve, 0.0001)
+    self.assertEqual(list(reduced.indices), [0, 4])
+    self.assertAlmostEqual(error, 0.0, places=6)
+
+    value = reduce.quaternionSlerp(rotationZ(0.0), rotationZ(math.pi / 2.0), 0.25)
+    for a, b in zip(value, rotationZ(math.pi / 8.0)):
+      self.assertAlmostEqual(a, b)
+    #endfor
+  #end
+
+  def testSlerpReportsAngle(self):
+    curve = makeCurve("orientation", [
+      (0, "linear", rotationZ(0.0)),
+      (1, "linear", rotationZ(math.pi / 4.0 + 0.01)),
+      (2, "linear", rotationZ(math.pi / 2.0))
+    ])
+    reduced, error = reduce.reduceCurve(curve, 0.1)
+    self.assertEqual(list(reduced.indices), [0, 2])
+    self.assertAlmostEqual(error, 0.01, places=6)
+
+    reduced, error = reduce.reduceCurve(curve, 0.005)
+    self.assertEqual(list(reduced.indices), [0, 1, 2])
+  #end
+
+  def testSlerpTakesShortestPath(self):
+    q0 = rotationZ(0.0)
+    q1 = tuple(-c for c in rotationZ(math.pi / 2.0))
+    value = reduce.quaternionSlerp(q0, q1, 0.5)
+    self.assertAlmostEqual(reduce.quaternionAngle(value, rotationZ(math.pi / 4.0)), 0.0, places=6)
+  #end
+
+  def testReduceActionReport(self):
+    translation = makeCurve("translation", [(index, "linear", (float(index), 0.0, 0.0)) for index in range(0, 4)])
+    scale       = makeCurve("scale", [(0, "linear", (1.0, 1.0, 1.0)), (1, "linear", (1.0, 1.0, 1.0))])
+    action      = model.CalciumAction("walk", 3, [translation, scale])
+
+    tolerances = {"translation" : 0.001, "scale" : 0.001, "orientation" : 0.001}
+    reduced, report = reduce.reduceAction(action, tolerances)
+    self.assertEqual(reduced.name, "walk")
+    self.assertEqual([curve.size() for curve in reduced.curves], [2, 2])
+    self.assertEqual(report["translation"][0:2], (4, 2))
+    self.assertEqual(report["scale"][0:2], (2, 2))
+  #end
+#endclass
+
+class SimplifyTest(unittest.TestCase):
+
+  def testRestPoseCurvesAreOmitted(self):
+    curves = [
+      makeCurve("translation", [(0, "linear", (0.0, 0.0, 0.0)), (4, "linear", (0.0, -0.0, 0.0))]),
+      makeCurve("scale", [(0, "linear", (1.0, 1.0, 1.0))]),
+      makeCurve("orientation", [(0, "linear", (0.0, 0.0, 0.0, 1.0)), (4, "linear", (0.0, 0.0, 0.0, -1.0))])
+    ]
+    action = model.CalciumAction("walk", 4, curves)
+    simplified, collapsed, omitted = reduce.simplifyAction(action, False, True)
+    self.assertEqual(simplified.curves, [])
+    self.assertEqual((collapsed, omitted), (0, 3))
+  #end
+
+  def testDecomposedRestPoseCurvesAreOmitted(self):
+
+    #
+    # Values as decomposed from matrix_basis in the scene, rounded to
+    # 32-bit floats.
+    #
+
+    curves = [
+      makeCurve("translation", [(0, "linear", (-0.0, 1.1920929e-07, 0.0)), (4, "linear", (0.0, 0.0, -5.9604645e-08))]),
+      makeCurve("scale", [(0, "linear", (0.99999994, 1.0, 1.0000001)), (4, "linear", (1.0, 0.99999994, 1.0))]),
+      makeCurve("orientation", [(0, "linear", (-0.0, 0.0, 0.0, 0.99999994)), (4, "linear", (2.9802322e-08, -0.0, 0.0, -0.99999994))])
+    ]
+    action = model.CalciumAction("walk", 4, curves)
+    simplified, collapsed, omitted = reduce.simplifyAction(action, False, True)
+    self.assertEqual(simplified.curves, [])
+    self.assertEqual(omitted, 3)
+  #end
+
+  def testPosedCurvesAreKept(self):
+    curves = [
+      makeCurve("translation", [(0, "linear", (0.0, 0.0, 0.0)), (4, "linear", (0.001, 0.0, 0.0))]),
+      makeCurve("scale", [(0, "linear", (1.001, 1.0, 1.0))]),
+      makeCurve("orientation", [(0, "linear", rotationZ(0.001))])
+    ]
+    action = model.CalciumAction("walk", 4, curves)
+    simplified, collapsed, omitted = reduce.simplifyAction(action, False, True)
+    self.assertEqual(simplified.curves, curves)
+    self.assertEqual(omitted, 0)
+
+    simplified, collapsed, omitted = reduce.simplifyAction(action, False, False)
+    self.assertEqual(simplified.curves, curves)
+  #end
+
+  def testConstantCurvesAreCollapsed(self):
+    constant = makeCurve("translation", [(0, "linear", (1.0, 2.0, 3.0)), (2, "linear", (1.0, 2.0, 3.0)), (4, "constant", (1.0, 2.0, 3.0))])
+    changing = makeCurve("translation", [(0, "linear", (1.0, 2.0, 3.0)), (4, "linear", (1.0, 2.0, 3.5))])
+    rest     = makeCurve("scale", [(0, "linear", (1.0, 1.0, 1.0)), (4, "linear", (1.0, 1.0, 1.0))])
+    action   = model.CalciumAction("walk", 4, [constant, changing, rest])
+
+    simplified, collapsed, omitted = reduce.simplifyAction(action, True, False)
+    self.assertEqual((collapsed, omitted), (2, 0))
+    self.assertEqual([list(curve.indices) for curve in simplified.curves], [[0], [0, 4], [0]])
+
+    simplified, collapsed, omitted = reduce.simplifyAction(action, True, True)
+    self.assertEqual((collapsed, omitted), (1, 1))
+    self.assertEqual([list(curve.indices) for curve in simplified.curves], [[0], [0, 4]])
+  #end
+#endclass
+
+if __name__ == "__main__":
+  unittest.main()
+#endif
@@ -0,0 +1,323 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import array
+import io
+import unittest
+
+import support
+
+model = support.importModule("model")
+text  = support.importModule("text")
+
+BONE_INDICES = {"root" : 0, "arm" : 1}
+
+def makeFormatter(precision, bone_indices=None, baked=False, shared=False):
+  return text.CalciumTextFormatter(precision, bone_indices, baked, shared)
+#end
+
+def makeSkeleton():
+  return model.CalciumSkeleton("skeleton", [
+    model.CalciumBone("root", None, (0.0, 0.0, 0.0), (1.0, 1.0, 1.0), (0.0, 0.0, 0.0, 1.0)),
+    model.CalciumBone("arm", "root", (1.0, 2.0, 3.0), (1.0, 1.0, 1.0), (0.0, 0.0, 0.5, 0.5))
+  ])
+#end
+
+def makeAction():
+  translation = model.CalciumCurveBuilder("arm", "translation")
+  translation.append(1, "linear", "in", (0.0, 0.0, 0.0))
+  translation.append(5, "constant", "in-out", (1.0, 2.0, 3.0))
+  orientation = model.CalciumCurveBuilder("root", "orientation")
+  orientation.append(1, "exponential", "out", (0.0, 0.0, 0.0, 1.0))
+  return model.CalciumAction("walk", 8, [translation.build(), orientation.build()])
+#end
+
+#
+# The text that the exporter wrote for these elements before the model and
+# the formatter existed, with every value written with "%f".
+#
+
+EXPECTED_SKELETON = (
+  "[skeleton\n"
+  "  [skeleton-name \"skeleton\"]\n"
+  "  [skeleton-bones\n"
+  "    [bone\n"
+  "      [bone-name             \"root\"]\n"
+  "      [bone-translation      0.000000 0.000000 0.000000]\n"
+  "      [bone-scale            1.000000 1.000000 1.000000]\n"
+  "      [bone-orientation-xyzw 0.000000 0.000000 0.000000 1.000000]]\n"
+  "    [bone\n"
+  "      [bone-name             \"arm\"]\n"
+  "      [bone-parent           \"root\"]\n"
+  "      [bone-translation      1.000000 2.000000 3.000000]\n"
+  "      [bone-scale            1.000000 1.000000 1.000000]\n"
+  "      [bone-orientation-xyzw 0.000000 0.000000 0.500000 0.500000]]\n"
+  "  ]\n"
+  "]\n")
+
+EXPECTED_MESH = (
+  "[mesh\n"
+  "  [mesh-name \"mesh\"]\n"
+  "  [mesh-weight-arrays\n"
+  "      [mesh-weight-array\n"
+  "        [mesh-weight-array-bone \"arm\"]\n"
+  "        [mesh-weight-array-values\n"
+  "          [mesh-weight-array-value 0.000000]\n"
+  "          [mesh-weight-array-value 0.500000]\n"
+  "          [mesh-weight-array-value 1.000000]\n"
+  "        ]\n"
+  "      ]\n"
+  "  ]\n"
+  "]\n")
+
+EXPECTED_ACTION = (
+  "[action\n"
+  "  [action-name \"walk\"]\n"
+  "  [action-length 8]\n"
+  "  [curves\n"
+  "\n"
+  "    [curve\n"
+  "      [curve-bone \"arm\"]\n"
+  "      [curve-type translation]\n"
+  "      [curve-keyframes\n"
+  "        [curve-keyframe\n"
+  "          [curve-keyframe-index 1]\n"
+  "          [curve-keyframe-interpolation \"linear\"]\n"
+  "          [curve-keyframe-easing \"in\"]\n"
+  "          [curve-keyframe-vector3 0.000000 0.000000 0.000000]]\n"
+  "        [curve-keyframe\n"
+  "          [curve-keyframe-index 5]\n"
+  "          [curve-keyframe-interpolation \"constant\"]\n"
+  "          [curve-keyframe-easing \"in-out\"]\n"
+  "          [curve-keyframe-vector3 1.000000 2.000000 3.000000]]\n"
+  "    ]]\n"
+  "\n"
+  "    [curve\n"
+  "      [curve-bone \"root\"]\n"
+  "      [curve-type orientation]\n"
+  "      [curve-keyframes\n"
+  "        [curve-keyframe\n"
+  "          [curve-keyframe-index 1]\n"
+  "          [curve-keyframe-interpolation \"exponential\"]\n"
+  "          [curve-keyframe-easing \"out\"]\n"
+  "          [curve-keyframe-quaternion-xyzw 0.000000 0.000000 0.000000 1.000000]]\n"
+  "    ]]\n"
+  "\n"
+  "]]\n")
+
+class FormatterTest(unittest.TestCase):
+
+  def testHeader(self):
+    self.assertEqual(makeFormatter(6).formatHeader(24), "[version 1 0]\n[action-fps 24]\n")
+  #end
+
+  def testSkeleton(self):
+    self.assertEqual(makeFormatter(6).formatSkeleton(makeSkeleton()), EXPECTED_SKELETON)
+  #end
+
+  def testMeshWeightArrays(self):
+    weight_array = model.CalciumWeightArray("arm", array.array('i', [1, 2]), array.array('f', [0.5, 1.0]))
+    mesh         = model.CalciumMesh("mesh", 3, [weight_array], None)
+    self.assertEqual(makeFormatter(6).formatMesh(mesh), EXPECTED_MESH)
+  #end
+
+  def testMeshInfluences(self):
+    influences = model.CalciumInfluences(2, "uint8", array.array('H', [1, 0, 0, 1]), array.array('B', [255, 0, 200, 55]))
+    mesh       = model.CalciumMesh("mesh", 2, [], influences)
+    self.assertEqual(makeFormatter(6).formatMesh(mesh),
+      "[mesh\n"
+      "  [mesh-name \"mesh\"]\n"
+      "  [mesh-influences\n"
+      "    [mesh-influences-count 2]\n"
+      "    [mesh-influences-quantization uint8]\n"
+      "    [mesh-influences-values\n"
+      "      [mesh-influence 1 0 255 0]\n"
+      "      [mesh-influence 0 1 200 55]\n"
+      "    ]\n"
+      "  ]\n"
+      "]\n")
+  #end
+
+  def testAction(self):
+    self.assertEqual(makeFormatter(6).formatAction(makeAction()), EXPECTED_ACTION)
+  #end
+
+  def testPrecision(self):
+    formatted = makeFormatter(2).formatSkeleton(makeSkeleton())
+    self.assertIn("      [bone-translation      1.00 2.00 3.00]\n", formatted)
+    self.assertIn("      [bone-orientation-xyzw 0.00 0.00 0.50 0.50]]\n", formatted)
+  #end
+#endclass
+
+class FeaturesTest(unittest.TestCase):
+
+  def testHeaderFeatures(self):
+    cases = [
+      ({"bone_indices" : BONE_INDICES}, "\"bone-indices\""),
+      ({"baked" : True}, "\"baked-actions\""),
+      ({"shared" : True}, "\"shared-curves\""),
+      ({"bone_indices" : BONE_INDICES, "shared" : True}, "\"bone-indices\" \"shared-curves\""),
+      ({"bone_indices" : BONE_INDICES, "baked" : True, "shared" : True}, "\"bone-indices\" \"baked-actions\" \"shared-curves\"")
+    ]
+    for options, features in cases:
+      self.assertEqual(makeFormatter(6, **options).formatHeader(30), "[version 1 1]\n[features %s]\n[action-fps 30]\n" % features)
+    #endfor
+  #end
+
+  def testBoneIndices(self):
+    formatter = makeFormatter(6, bone_indices=BONE_INDICES)
+
+    skeleton = formatter.formatSkeleton(makeSkeleton())
+    self.assertIn(
+      "      [bone-name             \"arm\"]\n"
+      "      [bone-index            1]\n"
+      "      [bone-parent-index     0]\n", skeleton)
+    self.assertNotIn("[bone-parent ", skeleton)
+
+    weight_arrays = [
+      model.CalciumWeightArray("arm", array.array('i', [0]), array.array('f', [1.0])),
+      model.CalciumWeightArray("other", array.array('i', [0]), array.array('f', [1.0]))
+    ]
+    mesh = formatter.formatMesh(model.CalciumMesh("mesh", 1, weight_arrays, None))
+    self.assertIn("        [mesh-weight-array-bone-index 1]\n", mesh)
+    self.assertIn("        [mesh-weight-array-bone-index -1]\n", mesh)
+
+    action = formatter.formatAction(makeAction())
+    self.assertIn("      [curve-bone-index 1]\n", action)
+    self.assertIn("      [curve-bone-index 0]\n", action)
+    self.assertNotIn("[curve-bone ", action)
+  #end
+
+  def testBakedAction(self):
+    action = model.CalciumBakedAction("baked", 1, 24.0, 2, 1,
+      array.array('f', [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]),
+      array.array('f', [0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.5, 0.5]),
+      array.array('f', [1.0] * 6))
+    self.assertEqual(makeFormatter(2, baked=True).formatAction(action),
+      "[action\n"
+      "  [action-name \"baked\"]\n"
+      "  [action-length 1]\n"
+      "  [action-baked\n"
+      "    [action-baked-rate 24.00]\n"
+      "    [action-baked-frames 2]\n"
+      "    [action-baked-bones 1]\n"
+      "    [action-baked-translations\n"
+      "      [action-baked-frame 0.00 1.00 2.00]\n"
+      "      [action-baked-frame 3.00 4.00 5.00]\n"
+      "    ]\n"
+      "    [action-baked-orientations-xyzw\n"
+      "      [action-baked-frame 0.00 0.00 0.00 1.00]\n"
+      "      [action-baked-frame 0.00 0.00 0.50 0.50]\n"
+      "    ]\n"
+      "    [action-baked-scales\n"
+      "      [action-baked-frame 1.00 1.00 1.00]\n"
+      "      [action-baked-frame 1.00 1.00 1.00]\n"
+      "    ]\n"
+      "]]\n")
+  #end
+
+  def testSharedCurves(self):
+    formatter = makeFormatter(6, shared=True)
+    action    = makeAction()
+    curve     = action.curves[0]
+
+    formatted = formatter.formatAction(action)
+    self.assertIn(
+      "    [curve\n"
+      "      [curve-bone \"arm\"]\n"
+      "      [curve-type translation]\n"
+      "      [curve-shared \"%s\"]]\n" % curve.keyframesHash(), formatted)
+    self.assertNotIn("[curve-keyframes", formatted)
+
+    table    = formatter.formatSharedCurves([curve])
+    expected = EXPECTED_ACTION[EXPECTED_ACTION.index("      [curve-keyframes\n"):EXPECTED_ACTION.index("    [curve\n      [curve-bone \"root\"]")]
+    self.assertEqual(table,
+      "[shared-curves\n"
+      "\n"
+      "    [shared-curve\n"
+      "      [shared-curve-hash \"%s\"]\n"
+      "      [curve-type translation]\n" % curve.keyframesHash() + expected + "]\n")
+  #end
+#endclass
+
+class CountingFile(io.StringIO):
+
+  def __init__(self):
+    io.StringIO.__init__(self)
+    self.writes = 0
+  #end
+
+  def write(self, data):
+    self.writes += 1
+    return io.StringIO.write(self, data)
+  #end
+#endclass
+
+class SerializerTest(unittest.TestCase):
+
+  def testOutputMatchesFormatter(self):
+    formatter = makeFormatter(6)
+    expected  = "".join([
+      formatter.formatHeader(24),
+      EXPECTED_SKELETON,
+      EXPECTED_ACTION,
+      formatter.formatActionsEnd()
+    ])
+
+    for buffer_size in [1, 100, 1 << 20]:
+      out_file   = CountingFile()
+      serializer = text.CalciumTextSerializer(out_file, formatter, buffer_size, None, False)
+      serializer.writeHeader(24)
+      serializer.writeSkeleton(makeSkeleton())
+      serializer.writeAction(makeAction())
+      serializer.writeActionsEnd()
+      self.assertEqual(serializer.length(), len(expected))
+      serializer.flush()
+      self.assertEqual(out_file.getvalue(), expected)
+
+      if buffer_size == 1:
+        self.assertEqual(out_file.writes, 4)
+      elif buffer_size == 1 << 20:
+        self.assertEqual(out_file.writes, 1)
+      #endif
+    #endfor
+  #end
+
+  def testSpans(self):
+    formatter  = makeFormatter(6)
+    out_file   = io.StringIO()
+    serializer = text.CalciumTextSerializer(out_file, formatter, 1 << 20, None, True)
+
+    skeleton = model.CalciumSkeleton("sk\u00e9leton", makeSkeleton().bones)
+    serializer.writeHeader(24)
+    serializer.writeSkeleton(skeleton)
+    skeleton_span = serializer.lastSpan()
+    serializer.writeAction(makeAction())
+    action_span = serializer.lastSpan()
+    serializer.flush()
+
+    data = out_file.getvalue().encode("utf-8")
+    self.assertEqual(serializer.octets(), len(data))
+    self.assertEqual(serializer.length(), len(out_file.getvalue()))
+    self.assertEqual(serializer.length() + 1, serializer.octets())
+    self.assertEqual(data[skeleton_span[0]:skeleton_span[0] + skeleton_span[1]], formatter.formatSkeleton(skeleton).encode("utf-8"))
+    self.assertEqual(data[action_span[0]:action_span[0] + action_span[1]], EXPECTED_ACTION.encode("utf-8"))
+  #end
+#endclass
+
+if __name__ == "__main__":
+  unittest.main()
+#endif
@@ -0,0 +1,105 @@
+#
+# Copyright © 2016 <code@io7m.com> http://io7m.com
+#
+# Permission to use, copy, modify, and/or distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+import unittest
+
+import support
+
+validate = support.importModule("validate")
+
+def channel(name, frames, interpolation="LINEAR", easing="EASE_IN"):
+  return (name, [(frame, interpolation, easing) for frame in frames])
+#end
+
+class CalciumValidatorTest(unittest.TestCase):
+
+  def validate(self, channels):
+    errors = []
+    result = validate.CalciumValidator().validateGroup(errors, "walk", "location", channels)
+    return (result, errors)
+  #end
+
+  def testValidGroup(self):
+    result, errors = self.validate([channel("x", [1, 5]), channel("y", [1, 5]), channel("z", [1, 5])])
+    self.assertEqual(errors, [])
+    self.assertEqual(result, {1 : ("linear", "in"), 5 : ("linear", "in")})
+  #end
+
+  def testAbsentGroupIsIgnored(self):
+    result, errors = self.validate([("x", None), ("y", None), ("z", None)])
+    self.assertEqual(result, None)
+    self.assertEqual(errors, [])
+  #end
+
+  def testMissingChannel(self):
+    result, errors = self.validate([channel("x", [1, 5]), ("y", None), channel("z", [1, 5])])
+    self.assertEqual(result, None)
+    self.assertEqual(len(errors), 1)
+    self.assertIn("No keyframes are defined for a channel of a group", errors[0])
+    self.assertIn("Channel:  y", errors[0])
+  #end
+
+  def testKeyframeCountsDiffer(self):
+    result, errors = self.validate([channel("x", [1, 5]), channel("y", [1]), channel("z", [1, 5])])
+    self.assertEqual(result, None)
+    self.assertEqual(len(errors), 1)
+    self.assertIn("different number of keyframes", errors[0])
+  #end
+
+  def testKeyframesDoNotCorrespond(self):
+    result, errors = self.validate([channel("x", [1, 5]), channel("y", [1, 6]), channel("z", [1, 5])])
+    self.assertEqual(result, None)
+    missing = []
+    for error in errors:
+      frame   = error.split("Frame at:")[1].split()[0]
+      channel_name = error.split("Channel with missing keyframe:")[1].split()[0]
+      missing.append((frame, channel_name))
+    #endfor
+    self.assertEqual(sorted(missing), [("5", "y"), ("6", "x"), ("6", "z")])
+  #end
+
+  def testUnsupportedInterpolation(self):
+    result, errors = self.validate([channel("x", [1, 5], "BEZIER"), channel("y", [1, 5], "BEZIER"), channel("z", [1, 5], "BEZIER")])
+    self.assertEqual(result, None)
+    self.assertTrue(len(errors) > 0)
+    self.assertIn("interpolation type is not supported", errors[0])
+  #end
+
+  def testUnsupportedEasing(self):
+    result, errors = self.validate([channel("x", [1], "LINEAR", "AUTO")])
+    self.assertEqual(result, None)
+    self.assertEqual(len(errors), 1)
+    self.assertIn("easing type is not supported", errors[0])
+  #end
+
+  def testInterpolationDiffers(self):
+    result, errors = self.validate([channel("x", [1, 5]), channel("y", [1, 5], "CONSTANT"), channel("z", [1, 5])])
+    self.assertEqual(result, None)
+    self.assertEqual(len(errors), 2)
+    self.assertIn("interpolation value is not the same for all channels", errors[0])
+  #end
+
+  def testEasingDiffers(self):
+    result, errors = self.validate([channel("x", [1]), channel("y", [1], "LINEAR", "EASE_OUT")])
+    self.assertEqual(result, None)
+    self.assertEqual(len(errors), 1)
+    self.assertIn("easing value is not the same for all channels", errors[0])
+  #end
+#endclass
+
+if __name__ == "__main__":
+  unittest.main()
+#endif